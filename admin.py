@@ -1,9 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response, jsonify
 from functools import wraps
-from utils import get_db_connection, get_tables
-from mapping import table_mappings, normalize_column_name
+from utils import get_db_connection, get_tables, get_compiled_cache_stats
+import schema_catalog
+import archive
+from jobs import submit_job, JobQueueFull
+from margin import invalidate_shortfall_cache
+from queries import cached_text
 from auth import Auth
-import threading
 import logging
 import os
 import tempfile
@@ -59,154 +62,152 @@ def find_column(df, possible_names):
 
 def process_aggregate_data(excluded_users, engine, export=False, use_latest_date=False, selected_date=None):
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SHOW TABLES LIKE 'users'"))
-            if not result.fetchall():
-                logger.warning("Table 'users' does not exist")
-                return None, None, None, None, [], [], 0, [], [], None, "Table 'users' does not exist"
-
-            summary = pd.read_sql_table('users', con=engine, coerce_float=True, parse_dates=['date'])
-            logger.info(f"Read {len(summary)} rows from users table")
-
-            def clean_user_id(uid):
-                try:
-                    if uid is None or pd.isna(uid):
-                        return ''
-                    uid = str(uid).strip()
-                    if uid and uid.startswith('0'):
-                        uid = uid[1:]
-                    return uid
-                except Exception as e:
-                    logger.error(f"Error cleaning user_id {uid} (type: {type(uid)}): {str(e)}")
-                    return str(uid) if uid is not None else ''
-
-            required_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
-            if not required_columns.issubset(summary.columns):
-                missing_cols = required_columns - set(summary.columns)
-                logger.warning(f"Missing columns: {missing_cols}")
-                return None, None, None, None, [], [], 0, [], [], None, f"Missing columns: {missing_cols}"
-
-            summary['user_id'] = summary['user_id'].apply(clean_user_id)
-            summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
-
-            numeric_columns = ['allocation', 'mtm_all']
-            optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
-            for col in numeric_columns + optional_columns:
-                if col in summary.columns:
-                    summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
-
-            all_user_ids = sorted(summary['user_id'].unique().tolist())
-            logger.info(f"All user IDs: {len(all_user_ids)}")
-
-            latest_date = summary['date'].max()
-            if pd.isna(latest_date):
-                logger.warning("No valid dates found in users table")
-                return None, None, None, None, all_user_ids, [], 0, [], [], None, "No valid dates found"
-
-            if use_latest_date:
-                selected_date = latest_date
-                logger.info(f"Using latest date: {selected_date}")
-            elif selected_date:
-                try:
-                    selected_date = pd.to_datetime(selected_date).date()
-                except ValueError:
-                    logger.warning(f"Invalid date format: {selected_date}")
-                    return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "Invalid date format"
-            else:
-                selected_date = None
-
-            if selected_date:
-                filtered_summary = summary[summary['date'] == selected_date]
-                logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
-            else:
-                filtered_summary = summary
-
-            if filtered_summary.empty:
-                logger.warning(f"No data found for date={selected_date}")
-                return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, f"No data found for date {selected_date}"
-
-            filtered_summary = filtered_summary[filtered_summary['server'] != '5 Total']
-            filtered_summary = filtered_summary[
-                (filtered_summary['allocation'].notnull()) & 
-                (filtered_summary['allocation'] != 0) & 
-                (filtered_summary['mtm_all'].notnull()) & 
-                (filtered_summary['mtm_all'] != 0)
-            ]
-            filtered_summary = filtered_summary[~filtered_summary['alias'].str.contains('DEAL', case=False, na=False)]
-            filtered_summary = filtered_summary[
-                ~(
-                    (filtered_summary['max_loss'].isnull() | (filtered_summary['max_loss'] == 0)) &
-                    (filtered_summary['mtm_all'].isnull() | (filtered_summary['mtm_all'] == 0)) &
-                    (filtered_summary['algo'] != 5)
-                )
-            ]
-            filtered_summary = filtered_summary[filtered_summary['user_id'] != '92176368']
-            logger.info(f"After all filters: {len(filtered_summary)} rows")
-
+        if not schema_catalog.table_exists('users'):
+            logger.warning("Table 'users' does not exist")
+            return None, None, None, None, [], [], 0, [], [], None, "Table 'users' does not exist"
+
+        summary = pd.read_sql_table('users', con=engine, coerce_float=True, parse_dates=['date'])
+        logger.info(f"Read {len(summary)} rows from users table")
+
+        def clean_user_id(uid):
+            try:
+                if uid is None or pd.isna(uid):
+                    return ''
+                uid = str(uid).strip()
+                if uid and uid.startswith('0'):
+                    uid = uid[1:]
+                return uid
+            except Exception as e:
+                logger.error(f"Error cleaning user_id {uid} (type: {type(uid)}): {str(e)}")
+                return str(uid) if uid is not None else ''
+
+        required_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
+        if not required_columns.issubset(summary.columns):
+            missing_cols = required_columns - set(summary.columns)
+            logger.warning(f"Missing columns: {missing_cols}")
+            return None, None, None, None, [], [], 0, [], [], None, f"Missing columns: {missing_cols}"
+
+        summary['user_id'] = summary['user_id'].apply(clean_user_id)
+        summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
+
+        numeric_columns = ['allocation', 'mtm_all']
+        optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
+        for col in numeric_columns + optional_columns:
+            if col in summary.columns:
+                summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
+
+        all_user_ids = sorted(summary['user_id'].unique().tolist())
+        logger.info(f"All user IDs: {len(all_user_ids)}")
+
+        latest_date = summary['date'].max()
+        if pd.isna(latest_date):
+            logger.warning("No valid dates found in users table")
+            return None, None, None, None, all_user_ids, [], 0, [], [], None, "No valid dates found"
+
+        if use_latest_date:
+            selected_date = latest_date
+            logger.info(f"Using latest date: {selected_date}")
+        elif selected_date:
+            try:
+                selected_date = pd.to_datetime(selected_date).date()
+            except ValueError:
+                logger.warning(f"Invalid date format: {selected_date}")
+                return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "Invalid date format"
+        else:
+            selected_date = None
+
+        if selected_date:
+            filtered_summary = summary[summary['date'] == selected_date]
+            logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
+        else:
+            filtered_summary = summary
+
+        if filtered_summary.empty:
+            logger.warning(f"No data found for date={selected_date}")
+            return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, f"No data found for date {selected_date}"
+
+        filtered_summary = filtered_summary[filtered_summary['server'] != '5 Total']
+        filtered_summary = filtered_summary[
+            (filtered_summary['allocation'].notnull()) & 
+            (filtered_summary['allocation'] != 0) & 
+            (filtered_summary['mtm_all'].notnull()) & 
+            (filtered_summary['mtm_all'] != 0)
+        ]
+        filtered_summary = filtered_summary[~filtered_summary['alias'].str.contains('DEAL', case=False, na=False)]
+        filtered_summary = filtered_summary[
+            ~(
+                (filtered_summary['max_loss'].isnull() | (filtered_summary['max_loss'] == 0)) &
+                (filtered_summary['mtm_all'].isnull() | (filtered_summary['mtm_all'] == 0)) &
+                (filtered_summary['algo'] != 5)
+            )
+        ]
+        filtered_summary = filtered_summary[filtered_summary['user_id'] != '92176368']
+        logger.info(f"After all filters: {len(filtered_summary)} rows")
+
+        if filtered_summary.empty:
+            logger.warning(f"No data remains after filtering for date={selected_date}")
+            return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "No users meet the criteria"
+
+        if excluded_users:
+            filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
             if filtered_summary.empty:
-                logger.warning(f"No data remains after filtering for date={selected_date}")
-                return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "No users meet the criteria"
-
-            if excluded_users:
-                filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
-                if filtered_summary.empty:
-                    logger.warning("All users excluded")
-                    return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "All users excluded"
-
-            num_algos = filtered_summary['algo'].nunique()
-            unique_server_count = filtered_summary['server'].nunique()
-            logger.info(f"Number of algos: {num_algos}, Unique server count: {unique_server_count}")
-
-            filtered_summary['Return Ratio'] = (filtered_summary['mtm_all'] / filtered_summary['allocation']).round(2)
-            user_ratios = filtered_summary.groupby(['user_id', 'algo'])['Return Ratio'].mean().reset_index()
-            user_count = len(user_ratios)
-            top_count = max(1, int(user_count * 0.2))
-            top_users = user_ratios.sort_values(by='Return Ratio', ascending=False).head(top_count).to_dict('records')
-            least_users = user_ratios.sort_values(by='Return Ratio').head(top_count).to_dict('records')
-            logger.info(f"Top users: {len(top_users)}, Least users: {len(least_users)}")
-
-            grouped = filtered_summary.groupby(['algo', 'server']).agg(
-                **{
-                    'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
-                    'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
-                    'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
-                }
-            ).reset_index()
-
-            grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION']).round(2)
-
-            final_df = grouped.sort_values(by=['algo', 'server'])
-            final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
-            final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
-
-            grand_total = {
-                'ALGO': 'GRAND TOTAL',
-                'SERVER': '',
-                'No. of Users': final_df['No. of Users'].sum(),
-                'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
-                'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
-                'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+                logger.warning("All users excluded")
+                return None, None, None, None, all_user_ids, [], 0, [], [], latest_date, "All users excluded"
+
+        num_algos = filtered_summary['algo'].nunique()
+        unique_server_count = filtered_summary['server'].nunique()
+        logger.info(f"Number of algos: {num_algos}, Unique server count: {unique_server_count}")
+
+        filtered_summary['Return Ratio'] = (filtered_summary['mtm_all'] / filtered_summary['allocation']).round(2)
+        user_ratios = filtered_summary.groupby(['user_id', 'algo'])['Return Ratio'].mean().reset_index()
+        user_count = len(user_ratios)
+        top_count = max(1, int(user_count * 0.2))
+        top_users = user_ratios.sort_values(by='Return Ratio', ascending=False).head(top_count).to_dict('records')
+        least_users = user_ratios.sort_values(by='Return Ratio').head(top_count).to_dict('records')
+        logger.info(f"Top users: {len(top_users)}, Least users: {len(least_users)}")
+
+        grouped = filtered_summary.groupby(['algo', 'server']).agg(
+            **{
+                'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
+                'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
+                'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
             }
-
-            data = final_df.to_dict('records')
-            data.append(grand_total)
-            logger.info(f"Processed {len(data)} records, including Grand Total")
-
-            total_mtm = filtered_summary['mtm_all'].sum()
-            num_users = filtered_summary['user_id'].nunique()
-            servers = filtered_summary['server'].unique().tolist()
-            logger.info(f"Total MTM: {total_mtm}, Users: {num_users}, Servers: {servers}")
-
-            if export == 'csv':
-                output = io.StringIO()
-                writer = csv.DictWriter(output, fieldnames=['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio'])
-                writer.writeheader()
-                for row in data:
-                    writer.writerow(row)
-                output.seek(0)
-                return output, total_mtm, num_users, num_algos, servers, all_user_ids, top_users, least_users, latest_date, None
-
-            return data, total_mtm, num_users, num_algos, servers, all_user_ids, top_users, least_users, latest_date, None
+        ).reset_index()
+
+        grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION']).round(2)
+
+        final_df = grouped.sort_values(by=['algo', 'server'])
+        final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
+        final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
+
+        grand_total = {
+            'ALGO': 'GRAND TOTAL',
+            'SERVER': '',
+            'No. of Users': final_df['No. of Users'].sum(),
+            'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
+            'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
+            'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+        }
+
+        data = final_df.to_dict('records')
+        data.append(grand_total)
+        logger.info(f"Processed {len(data)} records, including Grand Total")
+
+        total_mtm = filtered_summary['mtm_all'].sum()
+        num_users = filtered_summary['user_id'].nunique()
+        servers = filtered_summary['server'].unique().tolist()
+        logger.info(f"Total MTM: {total_mtm}, Users: {num_users}, Servers: {servers}")
+
+        if export == 'csv':
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio'])
+            writer.writeheader()
+            for row in data:
+                writer.writerow(row)
+            output.seek(0)
+            return output, total_mtm, num_users, num_algos, servers, all_user_ids, top_users, least_users, latest_date, None
+
+        return data, total_mtm, num_users, num_algos, servers, all_user_ids, top_users, least_users, latest_date, None
 
     except Exception as e:
         logger.error(f"Error in process_aggregate_data: {str(e)}")
@@ -276,23 +277,20 @@ def upload_files():
             flash("No valid files (CSV, XLSX, or XLS) uploaded", "error")
             return redirect(url_for('admin.admin_home'))
         
-        result_list = []
-        event = threading.Event()
         uploaded_by = session.get('role', 'unknown')
-        thread, event = admin_bp.upload_files_to_table(
-            temp_dir, table_name, result_list, event, uploaded_by, has_header=has_header
-        )
-        thread.join()
-        
-        for category, message in result_list:
-            flash(message, category)
-        logger.info(f"Upload completed for table: {table_name}, results: {result_list}")
+        job_id = admin_bp.enqueue_upload(temp_dir, table_name, uploaded_by, has_header=has_header, cleanup=True)
+        # The job owns temp_dir from here and removes it when it finishes
+        temp_dir = None
+        flash(f"Upload queued as job {job_id}", "info")
+        logger.info(f"Upload queued for table: {table_name}, job: {job_id}")
+        return redirect(url_for('admin.admin_home', job=job_id))
     
     except Exception as e:
         logger.error(f"Error uploading files: {str(e)}")
         flash(f"Error uploading files: {str(e)}", "error")
     finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
     
     return redirect(url_for('admin.admin_home'))
 
@@ -342,6 +340,52 @@ def admin_other():
     logger.info(f"Passing tables to admin_other: {other_tables}")
     return render_template('admin_other.html', tables=other_tables)
 
+@admin_bp.route('/query_stats')
+def admin_query_stats():
+    if 'role' not in session or session.get('role', '') not in ['admin'] or not session['authenticated']:
+        flash("Please log in as admin to access this page", "error")
+        return redirect(url_for('login.login'))
+    stats = get_compiled_cache_stats()
+    stats['cached_statements'] = cached_text.cache_info()._asdict()
+    logger.info(f"Compiled cache stats: {stats}")
+    return jsonify(stats)
+
+@admin_bp.route('/archive_stats')
+def admin_archive_stats():
+    if 'role' not in session or session.get('role', '') not in ['admin'] or not session['authenticated']:
+        flash("Please log in as admin to access this page", "error")
+        return redirect(url_for('login.login'))
+    stats = archive.archive_stats()
+    logger.info(f"Archive stats: {stats}")
+    return jsonify(stats)
+
+def archive_job(table, keep_months, progress=None):
+    """archive.archive_table(); archived ob rows drop out of the cached margin pivots."""
+    try:
+        return archive.archive_table(table, keep_months=keep_months, progress=progress)
+    finally:
+        invalidate_shortfall_cache()
+
+@admin_bp.route('/archive/<table>', methods=['POST'])
+def admin_archive(table):
+    if 'role' not in session or session.get('role', '') not in ['admin'] or not session['authenticated']:
+        flash("Please log in as admin to access this page", "error")
+        return redirect(url_for('login.login'))
+    if table not in archive.ARCHIVE_TABLES:
+        flash(f"Archiving is not enabled for {table}", "error")
+        return redirect(url_for('admin.admin_home'))
+    keep_months = request.form.get('keep_months', str(archive.ARCHIVE_AFTER_MONTHS)).strip()
+    keep_months = int(keep_months) if keep_months.isdigit() else archive.ARCHIVE_AFTER_MONTHS
+    try:
+        # Keyed by table, so it never overlaps an upload into the same table
+        job_id = submit_job('archive', table, archive_job, table, keep_months=keep_months,
+                            created_by=session.get('email', session.get('role')))
+    except JobQueueFull as e:
+        flash(str(e), "warning")
+        return redirect(url_for('admin.admin_home'))
+    flash(f"Archiving of {table} queued as job {job_id}", "info")
+    return redirect(url_for('admin.admin_home', job=job_id))
+
 @admin_bp.route('/users', methods=['GET', 'POST'])
 @restrict_email
 @restrict_admin_user_management
@@ -489,65 +533,5 @@ def create_table(table_name):
     except Exception as e:
         return False, f"Error creating table: {str(e)}", "error"
 
-def upload_files_to_table(file_source, table_name, result_list, event, uploaded_by, has_header=True):
-    def upload_task():
-        engine = get_db_connection()
-        if not engine:
-            result_list.append(("error", "Database connection failed"))
-            event.set()
-            return
-        
-        try:
-            column_mapping = table_mappings.get(table_name, {})
-            if not column_mapping:
-                result_list.append(("error", f"No column mapping found for table {table_name}"))
-                event.set()
-                return
-            
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SHOW COLUMNS FROM {table_name}"))
-                table_columns = [row['Field'] for row in result.mappings()]
-                logger.debug(f"Table {table_name} columns: {table_columns}")
-
-            uploaded_files = [os.path.join(file_source, f) for f in os.listdir(file_source) if f.endswith(('.csv', '.xlsx', '.xls'))]
-            
-            for file_path in uploaded_files:
-                try:
-                    if file_path.endswith('.csv'):
-                        df = pd.read_csv(file_path, header=0 if has_header else None)
-                    elif file_path.endswith(('.xlsx', '.xls')):
-                        df = pd.read_excel(file_path, header=0 if has_header else None)
-                    
-                    original_columns = df.columns.tolist()
-                    normalized_columns = [normalize_column_name(col, column_mapping) for col in original_columns]
-                    df.columns = normalized_columns
-                    logger.debug(f"File {os.path.basename(file_path)} columns normalized: {original_columns} -> {normalized_columns}")
-                    
-                    valid_columns = [col for col in df.columns if col in column_mapping and col in table_columns]
-                    if not valid_columns:
-                        result_list.append(("error", f"No valid columns found in {os.path.basename(file_path)} for table {table_name}"))
-                        continue
-                    df = df[valid_columns]
-                    
-                    df.to_sql(table_name, engine, if_exists='append', index=False)
-                    result_list.append(("success", f"Uploaded {os.path.basename(file_path)} to {table_name} ({len(df)} rows)"))
-                    logger.info(f"Uploaded {file_path} to {table_name} with {len(df)} rows")
-                
-                except Exception as e:
-                    result_list.append(("error", f"Failed to upload {os.path.basename(file_path)}: {str(e)}"))
-                    logger.error(f"Error uploading {file_path}: {str(e)}")
-        
-        except Exception as e:
-            result_list.append(("error", f"Database error: {str(e)}"))
-            logger.error(f"Database error in upload_files_to_table: {str(e)}")
-        
-        finally:
-            event.set()
-    
-    thread = threading.Thread(target=upload_task)
-    thread.start()
-    return thread, event
-
 admin_bp.create_table = create_table
-admin_bp.upload_files_to_table = upload_files_to_table
 admin_bp.get_tables = get_tables
\ No newline at end of file
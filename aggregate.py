@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response
 from functools import wraps
 from utils import get_db_connection, logger
+import schema_catalog
+import excel_reader
 import pandas as pd
-from sqlalchemy.sql import text
 import csv
 import io
 import tempfile
@@ -53,128 +54,126 @@ def aggregate_page():
         return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
 
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SHOW TABLES LIKE 'users'"))
-            if not result.fetchall():
-                flash("Table 'users' does not exist. Please create it and upload data.", "error")
-                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
-
-            summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
-            logger.info(f"Read {len(summary)} rows from users")
-
-            def clean_user_id(uid):
-                try:
-                    if uid is None or pd.isna(uid):
-                        return ''
-                    uid = str(uid).strip()
-                    if uid and uid.startswith('0'):
-                        uid = uid[1:]
-                    return uid
-                except Exception as e:
-                    logger.error(f"Error cleaning user_id {uid}: {str(e)}")
-                    return str(uid) if uid is not None else ''
-
-            required_summary_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
-            if not required_summary_columns.issubset(summary.columns):
-                missing_cols = required_summary_columns - set(summary.columns)
-                flash(f"Required columns {missing_cols} missing in users table", "error")
-                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
-
-            summary['user_id'] = summary['user_id'].apply(clean_user_id)
-            summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
-            numeric_columns = ['allocation', 'mtm_all']
-            optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
-            for col in numeric_columns + optional_columns:
-                if col in summary.columns:
-                    summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
-
-            all_user_ids = sorted(summary['user_id'].unique().tolist())
-            logger.info(f"All user IDs: {len(all_user_ids)}")
-
-            total_mtm = None
-            num_users = None
-            servers = None
-            if selected_date:
-                try:
-                    selected_date = pd.to_datetime(selected_date).date()
-                    filtered_summary = summary[summary['date'] == selected_date]
-                    logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
-                except ValueError:
-                    flash("Invalid date format", "error")
-                    return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+        if not schema_catalog.table_exists('users'):
+            flash("Table 'users' does not exist. Please create it and upload data.", "error")
+            return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
 
-                if filtered_summary.empty:
-                    flash(f"No data found for the selected date {selected_date}", "warning")
-                    return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+        summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
+        logger.info(f"Read {len(summary)} rows from users")
 
-                filtered_summary = filtered_summary[
-                    (filtered_summary['allocation'].notnull()) & 
-                    (filtered_summary['allocation'] != 0) & 
-                    (filtered_summary['mtm_all'].notnull()) & 
-                    (filtered_summary['mtm_all'] != 0)
-                ]
-                logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+        def clean_user_id(uid):
+            try:
+                if uid is None or pd.isna(uid):
+                    return ''
+                uid = str(uid).strip()
+                if uid and uid.startswith('0'):
+                    uid = uid[1:]
+                return uid
+            except Exception as e:
+                logger.error(f"Error cleaning user_id {uid}: {str(e)}")
+                return str(uid) if uid is not None else ''
+
+        required_summary_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
+        if not required_summary_columns.issubset(summary.columns):
+            missing_cols = required_summary_columns - set(summary.columns)
+            flash(f"Required columns {missing_cols} missing in users table", "error")
+            return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
+
+        summary['user_id'] = summary['user_id'].apply(clean_user_id)
+        summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
+        numeric_columns = ['allocation', 'mtm_all']
+        optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
+        for col in numeric_columns + optional_columns:
+            if col in summary.columns:
+                summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
+
+        all_user_ids = sorted(summary['user_id'].unique().tolist())
+        logger.info(f"All user IDs: {len(all_user_ids)}")
+
+        total_mtm = None
+        num_users = None
+        servers = None
+        if selected_date:
+            try:
+                selected_date = pd.to_datetime(selected_date).date()
+                filtered_summary = summary[summary['date'] == selected_date]
+                logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
+            except ValueError:
+                flash("Invalid date format", "error")
+                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
 
+            if filtered_summary.empty:
+                flash(f"No data found for the selected date {selected_date}", "warning")
+                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+
+            filtered_summary = filtered_summary[
+                (filtered_summary['allocation'].notnull()) & 
+                (filtered_summary['allocation'] != 0) & 
+                (filtered_summary['mtm_all'].notnull()) & 
+                (filtered_summary['mtm_all'] != 0)
+            ]
+            logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+
+            if filtered_summary.empty:
+                flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+
+            if excluded_users:
+                filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
                 if filtered_summary.empty:
-                    flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                    flash("All users have been excluded from the calculation", "warning")
                     return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
 
-                if excluded_users:
-                    filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
-                    if filtered_summary.empty:
-                        flash("All users have been excluded from the calculation", "warning")
-                        return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
-
-                grouped = filtered_summary.groupby(['algo', 'server']).agg(
-                    **{
-                        'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
-                        'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
-                        'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
-                    }
-                ).reset_index()
-
-                grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION'])
-                final_df = grouped.sort_values(by=['algo', 'server'])
-                final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
-                final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
-                final_df['Return Ratio'] = final_df['Return Ratio'].round(2)
-
-                grand_total = {
-                    'ALGO': 'GRAND TOTAL',
-                    'SERVER': '',
-                    'No. of Users': final_df['No. of Users'].sum(),
-                    'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
-                    'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
-                    'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+            grouped = filtered_summary.groupby(['algo', 'server']).agg(
+                **{
+                    'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
+                    'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
+                    'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
                 }
+            ).reset_index()
+
+            grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION'])
+            final_df = grouped.sort_values(by=['algo', 'server'])
+            final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
+            final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
+            final_df['Return Ratio'] = final_df['Return Ratio'].round(2)
+
+            grand_total = {
+                'ALGO': 'GRAND TOTAL',
+                'SERVER': '',
+                'No. of Users': final_df['No. of Users'].sum(),
+                'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
+                'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
+                'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+            }
 
-                data = final_df.to_dict('records')
-                data.append(grand_total)
-                logger.info(f"Processed {len(data)} records for display, including Grand Total")
+            data = final_df.to_dict('records')
+            data.append(grand_total)
+            logger.info(f"Processed {len(data)} records for display, including Grand Total")
 
-                total_mtm = filtered_summary['mtm_all'].sum()
-                num_users = filtered_summary['user_id'].nunique()
-                servers = filtered_summary['server'].unique().tolist()
-                logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
-            else:
-                data = None
-
-            if export == 'csv' and data:
-                output = io.StringIO()
-                writer = csv.DictWriter(output, fieldnames=['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio'])
-                writer.writeheader()
-                for row in data:
-                    writer.writerow(row)
-                output.seek(0)
-                return Response(
-                    output,
-                    mimetype='text/csv',
-                    headers={'Content-Disposition': 'attachment;filename=aggregate_report.csv'}
-                )
-
-            if data:
-                flash(f"Aggregation completed: {len(data)} records processed", "success")
-            return render_template('aggregate.html', role=session.get('role'), data=data, total_mtm=total_mtm, num_users=num_users, servers=servers, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+            total_mtm = filtered_summary['mtm_all'].sum()
+            num_users = filtered_summary['user_id'].nunique()
+            servers = filtered_summary['server'].unique().tolist()
+            logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
+        else:
+            data = None
+
+        if export == 'csv' and data:
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio'])
+            writer.writeheader()
+            for row in data:
+                writer.writerow(row)
+            output.seek(0)
+            return Response(
+                output,
+                mimetype='text/csv',
+                headers={'Content-Disposition': 'attachment;filename=aggregate_report.csv'}
+            )
+
+        if data:
+            flash(f"Aggregation completed: {len(data)} records processed", "success")
+        return render_template('aggregate.html', role=session.get('role'), data=data, total_mtm=total_mtm, num_users=num_users, servers=servers, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
 
     except Exception as e:
         handle_error(e, "Aggregation")
@@ -197,57 +196,55 @@ def total_mtm():
         return redirect(url_for('aggregate.aggregate_page'))
 
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SHOW TABLES LIKE 'users'"))
-            if not result.fetchall():
-                flash("Table 'users' does not exist. Please create it and upload data.", "error")
-                return redirect(url_for('aggregate.aggregate_page'))
+        if not schema_catalog.table_exists('users'):
+            flash("Table 'users' does not exist. Please create it and upload data.", "error")
+            return redirect(url_for('aggregate.aggregate_page'))
 
-            summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
-            logger.info(f"Read {len(summary)} rows from users")
+        summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
+        logger.info(f"Read {len(summary)} rows from users")
 
-            summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
-            numeric_columns = ['mtm_all', 'allocation']
-            optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
-            for col in numeric_columns + optional_columns:
-                if col in summary.columns:
-                    summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
-
-            try:
-                selected_date = pd.to_datetime(selected_date).date()
-                filtered_summary = summary[summary['date'] == selected_date]
-                logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
-            except ValueError:
-                flash("Invalid date format", "error")
-                return redirect(url_for('aggregate.aggregate_page'))
-
-            if filtered_summary.empty:
-                flash(f"No data found for the selected date {selected_date}", "warning")
-                return redirect(url_for('aggregate.aggregate_page'))
-
-            filtered_summary = filtered_summary[
-                (filtered_summary['allocation'].notnull()) & 
-                (filtered_summary['allocation'] != 0) & 
-                (filtered_summary['mtm_all'].notnull()) & 
-                (filtered_summary['mtm_all'] != 0)
-            ]
-            logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+        summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
+        numeric_columns = ['mtm_all', 'allocation']
+        optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
+        for col in numeric_columns + optional_columns:
+            if col in summary.columns:
+                summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
 
+        try:
+            selected_date = pd.to_datetime(selected_date).date()
+            filtered_summary = summary[summary['date'] == selected_date]
+            logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
+        except ValueError:
+            flash("Invalid date format", "error")
+            return redirect(url_for('aggregate.aggregate_page'))
+
+        if filtered_summary.empty:
+            flash(f"No data found for the selected date {selected_date}", "warning")
+            return redirect(url_for('aggregate.aggregate_page'))
+
+        filtered_summary = filtered_summary[
+            (filtered_summary['allocation'].notnull()) & 
+            (filtered_summary['allocation'] != 0) & 
+            (filtered_summary['mtm_all'].notnull()) & 
+            (filtered_summary['mtm_all'] != 0)
+        ]
+        logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+
+        if filtered_summary.empty:
+            flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+            return redirect(url_for('aggregate.aggregate_page'))
+
+        excluded_users = session.get('excluded_users', [])
+        if excluded_users:
+            filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
             if filtered_summary.empty:
-                flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                flash("All users have been excluded from the calculation", "warning")
                 return redirect(url_for('aggregate.aggregate_page'))
 
-            excluded_users = session.get('excluded_users', [])
-            if excluded_users:
-                filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
-                if filtered_summary.empty:
-                    flash("All users have been excluded from the calculation", "warning")
-                    return redirect(url_for('aggregate.aggregate_page'))
-
-            total_mtm = filtered_summary['mtm_all'].sum()
-            num_users = filtered_summary['user_id'].nunique()
-            servers = filtered_summary['server'].unique().tolist()
-            logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
+        total_mtm = filtered_summary['mtm_all'].sum()
+        num_users = filtered_summary['user_id'].nunique()
+        servers = filtered_summary['server'].unique().tolist()
+        logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
 
         return redirect(url_for('aggregate.aggregate_page', selected_date=selected_date))
 
@@ -336,12 +333,6 @@ def realised_profit():
             file.save(file_path)
             logger.info(f"Saved uploaded file: {file_path}")
 
-            df = pd.read_excel(file_path)
-            if 'OrderStatus' not in df.columns:
-                df['OrderStatus'] = 'COMPLETE'
-            if 'LegID' not in df.columns:
-                df['LegID'] = 0
-
             column_mappings = {
                 'TradingSymbol': ['Exchange Symbol', 'Symbol', 'Trading Symbol', 'TradingSymbol'],
                 'quantity': ['Filled Qty', 'Filled Quantity', 'Qty Filled', 'Quantity'],
@@ -352,35 +343,44 @@ def realised_profit():
                 'LegID': ['Leg ID', 'LegID', 'Leg'],
                 'UserID': ['User ID', 'UserID', 'User']
             }
+            # Filled in when the file has no such column
+            column_defaults = {'OrderStatus': 'COMPLETE', 'LegID': 0}
 
-            columns = {}
-            missing_cols = []
-            for internal_name, possible_names in column_mappings.items():
-                found_col = find_column(df, possible_names)
-                if found_col:
-                    columns[found_col] = internal_name
-                else:
-                    missing_cols.append(internal_name)
-
-            if missing_cols:
-                expected_names = ", ".join([f"{', '.join(column_mappings[col])} (or {col})" for col in missing_cols])
-                flash(f"Missing required columns. Please ensure the Excel file contains: {expected_names}", "error")
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date='', excluded_users=session.get('excluded_users', []), all_user_ids=all_user_ids, user_ids=user_ids, profit_data=None, selected_user_id=selected_user_id)
-
-            df = df.rename(columns=columns)
-            required_columns = {'TradingSymbol', 'OrderSide', 'quantity', 'OrderStatus', 'OrderAverageTradedPrice', 'LegID', 'UserID'}
-            if not required_columns.issubset(df.columns):
-                missing_cols = required_columns - set(df.columns)
-                flash(f"Unexpected error: Missing columns {missing_cols}", "error")
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date='', excluded_users=session.get('excluded_users', []), all_user_ids=all_user_ids, user_ids=user_ids, profit_data=None, selected_user_id=selected_user_id)
-
-            user_ids = sorted(df['UserID'].unique().tolist())
-            logger.info(f"Extracted {len(user_ids)} unique User IDs: {user_ids}")
-
+            # Stream the workbook in chunks of just the mapped columns into the CSV used by calculate_profit
+            chunks = excel_reader.iter_chunks(file_path, columns=[name for names in column_mappings.values() for name in names])
             temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
-            df.to_csv(temp_file.name, index=False)
+            temp_file.close()
+            file_user_ids = set()
+            try:
+                for chunk_number, df in enumerate(chunks):
+                    if chunk_number == 0:
+                        columns = {}
+                        missing_cols = []
+                        for internal_name, possible_names in column_mappings.items():
+                            found_col = find_column(df, possible_names)
+                            if found_col:
+                                columns[found_col] = internal_name
+                            elif internal_name not in column_defaults:
+                                missing_cols.append(internal_name)
+
+                        if missing_cols:
+                            expected_names = ", ".join([f"{', '.join(column_mappings[col])} (or {col})" for col in missing_cols])
+                            flash(f"Missing required columns. Please ensure the Excel file contains: {expected_names}", "error")
+                            os.remove(temp_file.name)
+                            shutil.rmtree(temp_dir, ignore_errors=True)
+                            return render_template('aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date='', excluded_users=session.get('excluded_users', []), all_user_ids=all_user_ids, user_ids=user_ids, profit_data=None, selected_user_id=selected_user_id)
+
+                    df = df[list(columns)].rename(columns=columns)
+                    for column, default in column_defaults.items():
+                        if column not in df.columns:
+                            df[column] = default
+                    file_user_ids.update(df['UserID'].dropna().unique().tolist())
+                    df.to_csv(temp_file.name, mode='a', header=chunk_number == 0, index=False)
+            finally:
+                chunks.close()
+
+            user_ids = sorted(file_user_ids)
+            logger.info(f"Extracted {len(user_ids)} unique User IDs: {user_ids}")
             logger.info(f"Saved processed data to temporary file: {temp_file.name}")
 
             if 'realised_profit_data_path' in session:
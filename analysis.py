@@ -6,8 +6,9 @@ import numpy as np
 import tempfile
 import os
 import io
-from sqlalchemy import text
 from datetime import datetime
+from queries import date_equals, status_equals
+import archive
 
 analysis_bp = Blueprint('analysis', __name__, template_folder='templates')
 
@@ -210,13 +211,21 @@ def hedge_cost_page():
                 if not engine:
                     raise ValueError("Failed to establish database connection")
 
-                ob_query = """
+                date_clause, params = date_equals('date', 'selected_date', selected_date)
+                status_clause, status_params = status_equals('status', 'status', 'COMPLETE')
+                params.update(status_params)
+                ob_query = f"""
                     SELECT user_id, order_id, symbol, order_time, transaction, quantity, avg_price, status, date, tag
                     FROM ob
-                    WHERE DATE(date) = :selected_date AND UPPER(status) = 'COMPLETE'
+                    WHERE {date_clause} AND {status_clause}
+                    ORDER BY user_id, order_time
                 """
                 with engine.connect() as connection:
-                    df = pd.read_sql(text(ob_query), connection, params={"selected_date": selected_date})
+                    # Live rows from MySQL, archived months from Parquet (archive.py)
+                    df = archive.read_range(connection, 'ob', ob_query, params, selected_date, selected_date,
+                                            columns=['user_id', 'order_id', 'symbol', 'order_time', 'transaction', 'quantity',
+                                                     'avg_price', 'status', 'date', 'tag'],
+                                            equals={'status': 'COMPLETE'}, order_by=['user_id', 'order_time'])
 
                 if df.empty:
                     flash("No valid data found for the selected date with status 'COMPLETE'.", "error")
@@ -261,8 +270,7 @@ def hedge_cost_page():
                                            date_based_data=None, date_based_summary_stats=None,
                                            date_based_ce_cat_counts=None, date_based_pe_cat_counts=None)
 
-                df['order_time'] = pd.to_datetime(df['order_time'], errors='coerce')
-                df.sort_values(by=['user_id', 'order_time'], inplace=True)
+                # Rows arrive sorted by user and order time (DATETIME(3), parsed at ingest)
                 df.reset_index(drop=True, inplace=True)
 
                 df['CE/PE'] = df['symbol'].str[-2:]
@@ -5,15 +5,30 @@ from flask_compress import Compress
 from sqlalchemy import text
 import os
 import pandas as pd
-import threading
+import time
+import shutil
+import tempfile
 import io
+import itertools
 import json
 import math
 import mysql.connector
 import logging
 from datetime import datetime
 from utils import get_db_connection, get_tables, get_table_columns, logger
-from mapping import table_mappings, normalize_column_name, ob_column_mapping
+from mapping import table_mappings, normalize_column_name, resolve_headers, alias_index, ob_column_mapping, datetime_columns
+from queries import ensure_analytics_indexes, QueryBuilder
+from migrations import migration, migrate_on_startup, column_exists, create_index
+from jobs import submit_job, get_job_status, cancel_job, recover_stale_jobs, JobQueueFull
+from chunked_mutation import run_chunked, chunked_job, estimated_rows, MUTATION_CHUNK_ROWS
+from batch_writer import import_frame, clamp_batch_size, BACKGROUND_IMPORT_ROWS
+from ddl import AlterPlan, alter_job, INSTANT_ONLY, BACKGROUND_ALTER_ROWS
+import schema_catalog
+import archive
+import excel_reader
+from search_index import apply_search, ensure_search_index
+from partitions import maintain_partitions, date_range_for_match, truncate_covered_partitions
+from type_inference import infer_frame_types, is_wider, widen, coerce_for_column, record_inferred_schema, parse_datetime_column
 from login import login_bp
 from admin import admin_bp
 from user import user_bp
@@ -25,9 +40,9 @@ from markupsafe import escape
 from dashboard import dashboard
 from analysis import analysis_bp
 from aggregate import aggregate_bp
-from margin import margin_bp
+from margin import margin_bp, invalidate_shortfall_cache, attach_shared_cache as attach_margin_cache
 from configure import APP_CONFIG
-from jainam import init_app, jainam_bp
+from jainam import init_app, jainam_bp, invalidate_dashboard_counts
 from dotenv import load_dotenv
 import os
 
@@ -47,7 +62,15 @@ def zip_filter(*args, **kwargs):
 app.jinja_env.filters['zip'] = zip_filter
 print("Zip filter registered:", 'zip' in app.jinja_env.filters)
 
-cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+# Shared by every worker process on the host (shared_cache.py); CACHE_TYPE=SimpleCache for per-process
+cache = Cache(app, config={
+    'CACHE_TYPE': os.getenv('CACHE_TYPE', 'shared_cache.SQLiteCache'),
+    'CACHE_DIR': os.getenv('CACHE_DIR'),
+    'CACHE_THRESHOLD': int(os.getenv('CACHE_THRESHOLD', 5000)),
+    'CACHE_DEFAULT_TIMEOUT': 300,
+})
+schema_catalog.attach_shared_cache(cache.cache)
+attach_margin_cache(cache.cache)
 Compress(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -61,43 +84,39 @@ def get_tables_cached(prefix=None):
 def get_table_columns_cached(table):
     return get_table_columns(table)
 
+def invalidate_table_metadata(table_name=None):
+    """Call after DDL: drops the schema catalog and the memoized table/column lists."""
+    schema_catalog.invalidate(table_name)
+    cache.delete_memoized(get_tables_cached)
+    if table_name:
+        cache.delete_memoized(get_table_columns_cached, table_name)
+
+def invalidate_table_data(table_name):
+    """Call after rows of a table changed: drops the caches derived from its data, in every worker."""
+    table_name = table_name.lower()
+    if table_name in ('ob', 'users'):
+        invalidate_shortfall_cache()
+    if table_name in ('jainam', 'user_partner_data'):
+        invalidate_dashboard_counts()
+
+def invalidating_job(func, table_name):
+    """Wrap a job function that writes rows of `table_name` so invalidate_table_data() runs when it ends."""
+    def job(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Also after a failure or cancellation: completed chunks stay committed
+            invalidate_table_data(table_name)
+    return job
+
 def check_index_exists(connection, table_name, index_name):
-    try:
-        result = connection.execute(
-            text(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = '{index_name}'")
-        )
-        return result.fetchone() is not None
-    except Exception as e:
-        logger.error(f"Error checking index {index_name} on table {table_name}: {str(e)}")
-        return False
+    return schema_catalog.index_exists(table_name, index_name)
 
 def get_column_type(connection, table_name, column_name):
-    try:
-        result = connection.execute(
-            text(f"SHOW COLUMNS FROM `{table_name}` WHERE Field = '{column_name}'")
-        )
-        row = result.fetchone()
-        return row[1] if row else None
-    except Exception as e:
-        logger.error(f"Error checking column type for {column_name} in {table_name}: {str(e)}")
-        return None
+    return schema_catalog.get_column_type(table_name, column_name)
 
 def get_existing_tables():
-    engine = get_db_connection()
-    if engine is None:
-        return []
-    try:
-        connection = engine.raw_connection()
-        cursor = connection.cursor()
-        cursor.execute("SHOW TABLES")
-        tables = [table[0] for table in cursor.fetchall()]
-        cursor.close()
-        connection.close()
-        logger.info(f"Retrieved tables: {tables}")
-        return tables
-    except Exception as e:
-        logger.error(f"Error fetching tables: {str(e)}")
-        return []
+    return get_tables()
 
 def standardize_headers(headers):
     """
@@ -150,8 +169,7 @@ def create_new_table(table_name):
         cursor.close()
         connection.close()
         logger.info(f"Table '{table_name}' created successfully")
-        cache.delete_memoized(get_tables_cached)
-        cache.delete_memoized(get_table_columns_cached, table_name)
+        invalidate_table_metadata(table_name)
         return True, f"Table '{table_name}' created! Columns will be added based on uploaded files.", "success"
     except Exception as e:
         logger.error(f"Error creating table '{table_name}': {str(e)}")
@@ -249,8 +267,7 @@ def check_file_exists(file_path, table_name, file_name):
 
 def check_column_alias_conflict(columns, column_mapping):
     normalized_to_original = {}
-    for col in columns:
-        normalized = normalize_column_name(col, column_mapping)
+    for col, normalized in zip(columns, resolve_headers(columns, column_mapping)):
         if normalized == col.lower():
             continue
         if normalized in normalized_to_original and normalized_to_original[normalized] != col:
@@ -281,23 +298,12 @@ def check_column_alias_conflict(columns, column_mapping):
 
 def check_unmapped_columns(columns, column_mapping, file_name, table_name):
     unmapped_columns = []
-    valid_columns = set()
-    
-    for mapped_col, variations in column_mapping.items():
-        valid_columns.add(mapped_col.lower())
-        if isinstance(variations, dict) and 'aliases' in variations:
-            aliases = variations.get('aliases', [])
-        elif isinstance(variations, list):
-            aliases = variations
-        else:
-            aliases = []
-        for alias in aliases:
-            valid_columns.add(str(alias).strip().lower())
-    
-    for col in columns:
+    valid_columns = alias_index(column_mapping).valid_names
+
+    for col, normalized in zip(columns, resolve_headers(columns, column_mapping)):
         if table_name.lower() == 'ob' and col.lower().startswith('unnamed:'):
             continue
-        normalized_col = normalize_column_name(col, column_mapping).lower()
+        normalized_col = normalized.lower()
         if normalized_col not in valid_columns and col.lower() not in valid_columns:
             unmapped_columns.append(col)
     
@@ -306,6 +312,36 @@ def check_unmapped_columns(columns, column_mapping, file_name, table_name):
         return True, f"File {file_name} has columns not in mapping: {', '.join(unmapped_columns)}"
     return False, None
 
+def check_sheet_headers(raw_headers, column_mapping, table_name, label):
+    """
+    Check an Excel sheet's header row against a predefined table's mapping.
+    Returns: (headers, error, matches) - the standardized headers (ending in 'Tag' for ob), an
+    error message when the header row can't be used, and whether every expected column is present.
+    """
+    headers = standardize_headers([str(col) for col in raw_headers])
+    if table_name == 'ob':
+        if len(headers) not in [19, 20]:
+            logger.warning(f"Expected 19 or 20 headers in {label}, found {len(headers)}")
+            logger.debug(f"Headers in {label}: {headers}")
+            return headers, f"Expected 19 or 20 headers in {label}, found {len(headers)}", False
+        if len(headers) == 20:
+            logger.info(f"Found 20 headers in {label}, using first 19 and setting 20th as 'Tag'")
+        headers = headers[:19] + ["Tag"]
+
+    has_unmapped, unmapped_error = check_unmapped_columns(headers, column_mapping, label, table_name)
+    if has_unmapped:
+        logger.warning(unmapped_error)
+        return headers, unmapped_error, False
+    conflict, conflicting_col, conflicting_with = check_column_alias_conflict(headers, column_mapping)
+    if conflict:
+        logger.warning(f"Column alias conflict in {label}: '{conflicting_col}' conflicts with '{conflicting_with}'")
+        return headers, f"Column alias conflict in {label}: '{conflicting_col}' conflicts with '{conflicting_with}'", False
+
+    normalized_columns = set(resolve_headers([col for col in headers if not col.lower().startswith('unnamed:')], column_mapping))
+    normalized_columns = {col for col in normalized_columns if col.lower() not in ['server', 'date', 'dte']}
+    expected_columns = set(col for col in column_mapping.keys() if col.lower() not in ['server', 'date', 'dte'])
+    return headers, None, expected_columns.issubset(normalized_columns)
+
 def get_latest_uploads(limit=5):
     engine = get_db_connection()
     if engine is None:
@@ -408,9 +444,7 @@ def create_table(table_name):
                                 if not isinstance(mysql_type, str):
                                     logger.warning(f"Invalid datatype for column `{col}` in `{table_name}`, skipping column")
                                     continue
-                                if table_name.lower() == 'gridlog' and col == 'timestamp':
-                                    mysql_type = "TEXT"
-                                elif table_name.lower() == 'gridlog' and col == 'date':
+                                if table_name.lower() == 'gridlog' and col == 'date':
                                     mysql_type = "DATE"
                                 connection.execute(text(f"ALTER TABLE `{table_name}` ADD COLUMN `{col}` {mysql_type}"))
                                 existing_columns.add(col.lower())
@@ -432,8 +466,7 @@ def create_table(table_name):
                     logger.info(f"No predefined mapping for table `{table_name}`, using default structure with {primary_key} only")
         
         logger.info(f"Table '{table_name}' created successfully")
-        cache.delete_memoized(get_tables_cached)
-        cache.delete_memoized(get_table_columns_cached, table_name)
+        invalidate_table_metadata(table_name)
         return True, f"Table '{table_name}' created successfully!", "success"
     except Exception as e:
         logger.error(f"Error creating table {table_name}: {type(e).__name__} - {str(e)}")
@@ -473,9 +506,7 @@ def initialize_predefined_tables():
                                             if not isinstance(mysql_type, str):
                                                 logger.warning(f"Invalid datatype for column `{col}` in `{table_name_lower}`, skipping column")
                                                 continue
-                                            if table_name_lower == 'gridlog' and col == 'timestamp':
-                                                mysql_type = "TEXT"
-                                            elif table_name_lower == 'gridlog' and col == 'date':
+                                            if table_name_lower == 'gridlog' and col == 'date':
                                                 mysql_type = "DATE"
                                             logger.info(f"Adding column `{col}` to table `{table_name_lower}` with type {mysql_type}")
                                             connection.execute(text(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` {mysql_type}"))
@@ -497,94 +528,203 @@ def initialize_predefined_tables():
                                     else:
                                         logger.debug(f"Column `{col}` already exists in `{table_name_lower}`, skipping")
                                 logger.info(f"Table '{table_name_lower}' already exists, ensured columns from mapping")
-                                cache.delete_memoized(get_table_columns_cached, table_name_lower)
+                                invalidate_table_metadata(table_name_lower)
                     except Exception as e:
                         logger.error(f"Error updating table {table_name_lower} with mapped columns: {type(e).__name__} - {str(e)}")
                         raise RuntimeError(f"Failed to update predefined table '{table_name_lower}': {type(e).__name__} - {str(e)}")
 
+# Core schema migrations (tracked in schema_version). When table_mappings gains columns
+# for a predefined table, add a new migration rather than editing an applied one.
+@migration('core', 1, 'upload_log table')
+def migrate_upload_log(connection):
+    create_upload_log_table()
+
+@migration('core', 2, 'Predefined tables and their mapped columns')
+def migrate_predefined_tables(connection):
+    initialize_predefined_tables()
+
+@migration('core', 3, 'Composite indexes for the orderbook analytics')
+def migrate_analytics_indexes(connection):
+    # analysis.py, margin.py
+    ensure_analytics_indexes(connection)
+
+@migration('core', 4, 'DATETIME(3) order_time/exchange_time/timestamp with a _raw text fallback')
+def migrate_datetime_columns(connection):
+    for table_name, columns in datetime_columns.items():
+        for column, raw_type in columns.items():
+            convert_datetime_column(connection, table_name, column, raw_type)
+    # Per-user order sequence for a day, sorted in SQL (analysis.py, margin.py)
+    if column_exists(connection, 'ob', 'order_time'):
+        create_index(connection, 'ob', 'idx_ob_date_user_time', ['date', 'user_id', 'order_time'])
+
+def convert_datetime_column(connection, table_name, column, raw_type, chunk_size=5000):
+    """
+    Turn a text timestamp column into DATETIME(3). The text column is renamed to <column>_raw,
+    a DATETIME(3) column takes its place, and rows are parsed in row_id chunks (each in its own
+    transaction); _raw keeps only the values that failed to parse. The backfill covers every row
+    with a _raw value and no DATETIME yet, so a run interrupted part-way resumes on the next call.
+    """
+    raw_column = f"{column}_raw"
+    if connection.execute(text("SHOW TABLES LIKE :table_name"), {'table_name': table_name}).fetchone() is None:
+        return
+    if not column_exists(connection, table_name, column):
+        return
+    current_type = connection.execute(text(f"SHOW COLUMNS FROM `{table_name}` LIKE :column"), {'column': column}).fetchone()[1]
+    if str(current_type).lower().startswith('datetime'):
+        if not column_exists(connection, table_name, raw_column):
+            connection.execute(text(f"ALTER TABLE `{table_name}` ADD COLUMN `{raw_column}` {raw_type}"))
+            return
+    else:
+        connection.execute(text(f"ALTER TABLE `{table_name}` RENAME COLUMN `{column}` TO `{raw_column}`"))
+        connection.execute(text(f"ALTER TABLE `{table_name}` ADD COLUMN `{column}` DATETIME(3) NULL AFTER `{raw_column}`"))
+    logger.info(f"Backfilling `{table_name}`.{column} from {raw_column}")
+
+    last_id = 0
+    converted = failed = 0
+    while True:
+        with connection.engine.begin() as chunk:
+            rows = chunk.execute(text(f"""
+                SELECT row_id, `{raw_column}`, `date` FROM `{table_name}`
+                WHERE row_id > :last_id AND `{column}` IS NULL AND `{raw_column}` IS NOT NULL
+                ORDER BY row_id LIMIT :chunk_size
+            """), {'last_id': last_id, 'chunk_size': chunk_size}).fetchall()
+            if not rows:
+                break
+            frame = pd.DataFrame(rows, columns=['row_id', 'raw', 'date'])
+            parsed, unparsed = parse_datetime_column(frame['raw'], frame['date'])
+            chunk.execute(
+                text(f"UPDATE `{table_name}` SET `{column}` = :parsed, `{raw_column}` = :unparsed WHERE row_id = :row_id"),
+                [{'row_id': int(row_id), 'parsed': p, 'unparsed': u} for row_id, p, u in zip(frame['row_id'], parsed, unparsed)]
+            )
+            converted += int(parsed.notna().sum())
+            failed += int(unparsed.notna().sum())
+            last_id = rows[-1][0]
+    logger.info(f"Converted `{table_name}`.{column} to DATETIME(3): {converted} parsed, {failed} kept in {raw_column}")
+
 def map_columns(df, column_mapping):
     new_columns = {}
-    for col in df.columns:
-        normalized = normalize_column_name(col, column_mapping)
+    for col, normalized in zip(df.columns, resolve_headers(df.columns, column_mapping)):
         if normalized in column_mapping:
             new_columns[col] = normalized
     df.rename(columns=new_columns, inplace=True)
     return df
 
 def get_existing_columns(cursor, table_name):
-    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
-    return [col[0] for col in cursor.fetchall()]
+    return schema_catalog.get_columns(table_name)
+
+
+def upload_column_type(table_name, column, is_predefined, inferred_types):
+    """MySQL type for a column an upload adds: from table_mappings for predefined tables, else inferred."""
+    if not is_predefined:
+        # The inferred type; TEXT when the column is empty
+        return inferred_types.get(column, (None, None))[0] or 'TEXT'
+    if column == 'sno' and table_name == 'ob':
+        return "INT"
+    if column.endswith('_raw') and column[:-4] in datetime_columns.get(table_name, {}):
+        return datetime_columns[table_name][column[:-4]]
+    if column.lower() == 'date' and table_name in table_mappings:
+        return "DATE"
+    if column.lower() == 'status_message' or (column.lower() == 'tag' and table_name == 'ob'):
+        return "TEXT"
+    if table_name == 'users' and column.lower() == 'dte':
+        return "VARCHAR(10)"
+    mysql_type = table_mappings.get(table_name, {}).get(column, {}).get("datatype")
+    if mysql_type and isinstance(mysql_type, str):
+        return mysql_type
+    logger.warning(f"No valid datatype defined for column `{column}` in `{table_name}`, using TEXT")
+    return "TEXT"
+
+
+def plan_upload_columns(table_name, columns, is_predefined, inferred_types):
+    """
+    The whole column diff of an upload batch as one ddl.AlterPlan: existing columns whose
+    inferred type is wider (non-predefined tables) are modified, missing ones are added.
+    """
+    plan = AlterPlan(table_name)
+    existing = {col.lower() for col in schema_catalog.get_columns(table_name)}
+    for col, (inferred_type, _) in inferred_types.items():
+        current_type = schema_catalog.get_column_type(table_name, col)
+        if inferred_type and is_wider(current_type, inferred_type):
+            plan.modify_column(col, widen(current_type, inferred_type))
+    for col in columns:
+        if col.lower() not in existing:
+            plan.add_column(col, upload_column_type(table_name, col, is_predefined, inferred_types))
+            existing.add(col.lower())
+    return plan
+
 
+def _run_upload(file_source, table_name, uploaded_by, has_header=True, batch_size=1000, progress=None):
+    """
+    Import every CSV/Excel file in `file_source` into `table_name`, synchronously.
+    progress(stage=, rows=, file=, file_status=) is called as files and batches complete
+    (jobs.Job.progress when run as a background job).
+    Returns: list of (category, message) results.
+    """
+    results = []
+    if progress is None:
+        progress = lambda **kwargs: None
+
+    folder_path = file_source
+    logger.info(f"Starting upload of files from {folder_path} to table {table_name}")
 
-def upload_files_to_table(file_source, table_name, result_list, event, uploaded_by, has_header=True, batch_size=1000):
-    result_lock = threading.Lock()
+    if not os.path.isdir(folder_path):
+        results.append(("error", "Invalid folder path"))
+        return results
+
+    files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.csv', '.xlsx', '.xls', '.xlsb'))]
+    if not files:
+        results.append(("warning", "No CSV or Excel files found"))
+        return results
+
+    logger.info(f"Found {len(files)} files to upload: {files}")
     
-    def task():
-        folder_path = file_source
-        logger.info(f"Starting upload of files from {folder_path} to table {table_name}")
-
-        if not os.path.isdir(folder_path):
-            with result_lock:
-                result_list.append(("error", "Invalid folder path"))
-            event.set()
-            return
+    engine = get_db_connection()
+    if not engine:
+        results.append(("error", "Database connection failed during upload"))
+        return results
 
-        files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.csv', '.xlsx', '.xls', '.xlsb'))]
-        if not files:
-            with result_lock:
-                result_list.append(("warning", "No CSV or Excel files found"))
-            event.set()
-            return
+    existing_tables = get_tables()
+    table_name_lower = table_name.lower()
+    predefined_tables = ['orderbook', 'users', 'portfolios', 'ob', 'strategytags', 'legs', 'multilegorders', 'positions', 'gridlog']
+    is_predefined = table_name_lower in predefined_tables
 
-        logger.info(f"Found {len(files)} files to upload: {files}")
-        
-        engine = get_db_connection()
-        if not engine:
-            with result_lock:
-                result_list.append(("error", "Database connection failed during upload"))
-            event.set()
-            return
+    if table_name_lower not in existing_tables:
+        success, msg, category = create_new_table(table_name_lower)
+        results.append((category, msg))
+        if category == "error":
+            return results
 
-        existing_tables = get_tables()
-        table_name_lower = table_name.lower()
-        predefined_tables = ['orderbook', 'users', 'portfolios', 'ob', 'strategytags', 'legs', 'multilegorders', 'positions', 'gridlog']
-        is_predefined = table_name_lower in predefined_tables
-
-        if table_name_lower not in existing_tables:
-            success, msg, category = create_new_table(table_name_lower)
-            with result_lock:
-                result_list.append((category, msg))
-            if category == "error":
-                event.set()
-                return
-
-        connection = None
-        cursor = None
-        total_rows = 0
-        reference_headers = None  # To store headers of the first file for consistency
+    connection = None
+    cursor = None
+    total_rows = 0
+    reference_headers = None  # To store headers of the first file for consistency
 
-        try:
-            connection = engine.raw_connection()
-            cursor = connection.cursor()
+    try:
+        connection = engine.raw_connection()
+        cursor = connection.cursor()
 
-            for file in files:
+        for file in files:
+            file_status = 'skipped'
+            chunks = None
+            progress(stage=f"Processing {file}", file=file, file_status='processing')
+            try:
                 file_path = os.path.join(folder_path, file)
                 file_name = os.path.basename(file_path)
                 max_file_size = 100 * 1024 * 1024  # 100 MB
                 if os.path.getsize(file_path) > max_file_size:
-                    with result_lock:
-                        result_list.append(("error", f"File {file_name} is too large (max {max_file_size / 1024 / 1024} MB)"))
+                    results.append(("error", f"File {file_name} is too large (max {max_file_size / 1024 / 1024} MB)"))
                     continue
 
                 file_exists, error_msg, file_hash = check_file_exists(file_path, table_name_lower, file_name)
                 if file_exists:
-                    with result_lock:
-                        result_list.append(("error", error_msg))
+                    results.append(("error", error_msg))
                     continue
 
                 try:
                     df = None
                     headers = None
+                    file_rows = 0
+                    file_committed = False
                     column_mapping = ob_column_mapping if table_name_lower == 'ob' else table_mappings.get(table_name_lower, {})
 
                     if file_name.lower().endswith('.csv'):
@@ -598,8 +738,7 @@ def upload_files_to_table(file_source, table_name, result_list, event, uploaded_
                             if len(headers) not in [19, 20]:
                                 logger.warning(f"Expected 19 or 20 headers in {file_name}, found {len(headers)}")
                                 logger.debug(f"Headers in {file_name}: {headers}")
-                                with result_lock:
-                                    result_list.append(("error", f"Expected 19 or 20 headers in {file_name}, found {len(headers)}"))
+                                results.append(("error", f"Expected 19 or 20 headers in {file_name}, found {len(headers)}"))
                                 continue
                             if len(headers) == 20:
                                 logger.info(f"Found 20 headers in {file_name}, using first 19 and setting 20th as 'Tag'")
@@ -613,27 +752,30 @@ def upload_files_to_table(file_source, table_name, result_list, event, uploaded_
                                 reference_headers = headers
                             elif headers != reference_headers:  # Check exact match including position
                                 logger.warning(f"Header mismatch in {file_name}. Expected: {reference_headers}, Found: {headers}")
-                                with result_lock:
-                                    result_list.append(("error", f"Header mismatch in {file_name}. All files must have identical headers in the same order."))
+                                results.append(("error", f"Header mismatch in {file_name}. All files must have identical headers in the same order."))
                                 continue
 
                         # Extract server and date (only for predefined tables if needed)
                         server, date = extract_server_and_date(file_name, table_name_lower, headers)
                         if is_predefined and (not server or not date) and not ('server' in [h.lower() for h in headers] and 'date' in [h.lower() for h in headers]):
                             logger.warning(f"Skipping {file_name} due to invalid server or date in filename")
-                            with result_lock:
-                                result_list.append(("error", f"Invalid server or date in filename {file_name}"))
+                            results.append(("error", f"Invalid server or date in filename {file_name}"))
                             continue
 
-                        df = pd.read_csv(file_path, header=None if table_name_lower == 'ob' else (0 if has_header else None), 
-                                       skiprows=1 if table_name_lower == 'ob' else 0, 
-                                       names=headers if table_name_lower == 'ob' else None,
-                                       dtype_backend='numpy_nullable', keep_default_na=False, dtype=str)
-                        
+                        open_chunks = lambda: pd.read_csv(file_path, header=None if table_name_lower == 'ob' else (0 if has_header else None), 
+                                           skiprows=1 if table_name_lower == 'ob' else 0, 
+                                           names=headers if table_name_lower == 'ob' else None,
+                                           dtype_backend='numpy_nullable', keep_default_na=False, dtype=str,
+                                           chunksize=excel_reader.CHUNK_ROWS)
+                        chunks = open_chunks()
+                        df = next(chunks, None)
+                        if df is None:
+                            results.append(("warning", f"No valid rows to import from {file_name}"))
+                            continue
+                    
                         if table_name_lower == 'ob' and len(df.columns) != 20:
                             logger.warning(f"Expected 20 columns in data rows of {file_name}, found {len(df.columns)}")
-                            with result_lock:
-                                result_list.append(("error", f"Expected 20 columns in data rows of {file_name}, found {len(df.columns)}"))
+                            results.append(("error", f"Expected 20 columns in data rows of {file_name}, found {len(df.columns)}"))
                             continue
 
                         if not has_header and table_name_lower != 'ob':
@@ -644,26 +786,21 @@ def upload_files_to_table(file_source, table_name, result_list, event, uploaded_
                         if is_predefined:
                             has_unmapped, unmapped_error = check_unmapped_columns(df.columns, column_mapping, file_name, table_name_lower)
                             if has_unmapped:
-                                with result_lock:
-                                    result_list.append(("error", unmapped_error))
+                                results.append(("error", unmapped_error))
                                 continue
                             conflict, conflicting_col, conflicting_with = check_column_alias_conflict(df.columns, column_mapping)
                             if conflict:
-                                with result_lock:
-                                    result_list.append(("error", f"Column alias conflict in {file_name}: '{conflicting_col}' conflicts with '{conflicting_with}'"))
+                                results.append(("error", f"Column alias conflict in {file_name}: '{conflicting_col}' conflicts with '{conflicting_with}'"))
                                 continue
-                            normalized_columns = {normalize_column_name(col, column_mapping) for col in df.columns if not col.lower().startswith('unnamed:')}
+                            normalized_columns = set(resolve_headers([col for col in df.columns if not col.lower().startswith('unnamed:')], column_mapping))
                             normalized_columns = {col for col in normalized_columns if col.lower() not in ['server', 'date', 'dte']}
                             expected_columns = set(col for col in column_mapping.keys() if col.lower() not in ['server', 'date', 'dte'])
                             if not expected_columns.issubset(normalized_columns):
                                 logger.warning(f"CSV {file_name} does not match expected '{table_name_lower}' table columns: {expected_columns}")
-                                with result_lock:
-                                    result_list.append(("warning", f"CSV {file_name} does not match expected '{table_name_lower}' table columns"))
+                                results.append(("warning", f"CSV {file_name} does not match expected '{table_name_lower}' table columns"))
                                 continue
                     else:  # Excel files
-                        engine_param = 'pyxlsb' if file_name.lower().endswith('.xlsb') else None
-                        xls = pd.ExcelFile(file_path, engine=engine_param)
-                        sheet_names = xls.sheet_names
+                        sheet_names = excel_reader.sheet_names(file_path)
                         logger.info(f"Sheets in {file_name}: {sheet_names}")
 
                         sheet_mapping = {
@@ -676,126 +813,60 @@ def upload_files_to_table(file_source, table_name, result_list, event, uploaded_
                             "positions": "Positions",
                             "gridlog": "Gridlog"
                         }
-                        
+                    
                         target_sheet = sheet_mapping.get(table_name_lower) if is_predefined else None
                         matching_sheet = None
 
                         if is_predefined:
-                            # First try the mapped sheet name
-                            if target_sheet and target_sheet in sheet_names:
-                                try:
-                                    df = pd.read_excel(file_path, sheet_name=target_sheet, header=0, index_col=None, 
-                                                    dtype_backend='numpy_nullable', keep_default_na=False, engine=engine_param)
-                                    headers = standardize_headers([str(col) for col in df.columns])
-                                    df.columns = headers
-                                    
-                                    if table_name_lower == 'ob':
-                                        if len(headers) not in [19, 20]:
-                                            logger.warning(f"Expected 19 or 20 headers in {file_name} (sheet: {target_sheet}), found {len(headers)}")
-                                            logger.debug(f"Headers in {file_name} (sheet: {target_sheet}): {headers}")
-                                            with result_lock:
-                                                result_list.append(("error", f"Expected 19 or 20 headers in {file_name} (sheet: {target_sheet}), found {len(headers)}"))
-                                            continue
-                                        if len(headers) == 20:
-                                            logger.info(f"Found 20 headers in {file_name} (sheet: {target_sheet}), using first 19 and setting 20th as 'Tag'")
-                                            headers = headers[:19]
-                                            headers.append("Tag")
-                                        else:
-                                            headers.append("Tag")
-                                        df.columns = headers
-                                        if len(df.columns) != 20:
-                                            logger.warning(f"Expected 20 columns in data rows of {file_name} (sheet: {target_sheet}), found {len(df.columns)}")
-                                            with result_lock:
-                                                result_list.append(("error", f"Expected 20 columns in data rows of {file_name} (sheet: {target_sheet}), found {len(df.columns)}"))
-                                            continue
-                                    
-                                    has_unmapped, unmapped_error = check_unmapped_columns(df.columns, column_mapping, 
-                                                                                        f"{file_name} (sheet: {target_sheet})", table_name_lower)
-                                    if has_unmapped:
-                                        logger.warning(unmapped_error)
-                                        with result_lock:
-                                            result_list.append(("error", unmapped_error))
-                                        continue
-                                    conflict, conflicting_col, conflicting_with = check_column_alias_conflict(df.columns, column_mapping)
-                                    if conflict:
-                                        logger.warning(f"Column alias conflict in sheet {target_sheet} of {file_name}: '{conflicting_col}' conflicts with '{conflicting_with}'")
-                                        with result_lock:
-                                            result_list.append(("error", f"Column alias conflict in {file_name}: '{conflicting_col}' conflicts with '{conflicting_with}'"))
+                            # Probe header rows only, the mapped sheet first; then parse just the matching sheet
+                            candidates = [target_sheet] if target_sheet in sheet_names else []
+                            candidates += [sheet_name for sheet_name in sheet_names if sheet_name != target_sheet]
+                            probe_error = None
+                            probes = excel_reader.iter_sheet_headers(file_path, candidates)
+                            try:
+                                for sheet_name, raw_headers in probes:
+                                    if raw_headers is None:
                                         continue
-                                    normalized_columns = {normalize_column_name(col, column_mapping) for col in df.columns 
-                                                        if not col.lower().startswith('unnamed:')}
-                                    normalized_columns = {col for col in normalized_columns if col.lower() not in ['server', 'date', 'dte']}
-                                    expected_columns = set(col for col in column_mapping.keys() if col.lower() not in ['server', 'date', 'dte'])
-                                    if expected_columns.issubset(normalized_columns):
-                                        matching_sheet = target_sheet
-                                        logger.info(f"Found matching sheet '{target_sheet}' in {file_name} with columns: {normalized_columns}")
-                                except Exception as e:
-                                    logger.warning(f"Error reading sheet {target_sheet} in {file_name}: {str(e)}")
-                            
-                            # If mapped sheet not found or doesn't match, check all sheets for header match
+                                    headers, error, matches = check_sheet_headers(raw_headers, column_mapping, table_name_lower,
+                                                                                  f"{file_name} (sheet: {sheet_name})")
+                                    if matches:
+                                        matching_sheet = sheet_name
+                                        break
+                                    if error and sheet_name == target_sheet:
+                                        # The mapped sheet exists but can't be used: report it rather than guess
+                                        probe_error = error
+                                        break
+                            finally:
+                                probes.close()
+
+                            if probe_error:
+                                results.append(("error", probe_error))
+                                continue
                             if not matching_sheet:
-                                for sheet_name in sheet_names:
-                                    try:
-                                        temp_df = pd.read_excel(file_path, sheet_name=sheet_name, header=0, index_col=None, 
-                                                              dtype_backend='numpy_nullable', keep_default_na=False, engine=engine_param)
-                                        headers = standardize_headers([str(col) for col in temp_df.columns])
-                                        temp_df.columns = headers
-                                        
-                                        if table_name_lower == 'ob':
-                                            if len(headers) not in [19, 20]:
-                                                logger.warning(f"Expected 19 or 20 headers in {file_name} (sheet: {sheet_name}), found {len(headers)}")
-                                                logger.debug(f"Headers in {file_name} (sheet: {sheet_name}): {headers}")
-                                                continue
-                                            if len(headers) == 20:
-                                                logger.info(f"Found 20 headers in {file_name} (sheet: {sheet_name}), using first 19 and setting 20th as 'Tag'")
-                                                headers = headers[:19]
-                                                headers.append("Tag")
-                                            else:
-                                                headers.append("Tag")
-                                            temp_df.columns = headers
-                                            if len(temp_df.columns) != 20:
-                                                logger.warning(f"Expected 20 columns in data rows of {file_name} (sheet: {sheet_name}), found {len(temp_df.columns)}")
-                                                continue
-                                        
-                                        has_unmapped, unmapped_error = check_unmapped_columns(headers, column_mapping, 
-                                                                                            f"{file_name} (sheet: {sheet_name})", table_name_lower)
-                                        if has_unmapped:
-                                            logger.warning(unmapped_error)
-                                            continue
-                                        conflict, conflicting_col, conflicting_with = check_column_alias_conflict(headers, column_mapping)
-                                        if conflict:
-                                            logger.warning(f"Column alias conflict in sheet {sheet_name} of {file_name}: '{conflicting_col}' conflicts with '{conflicting_with}'")
-                                            continue
-                                        normalized_columns = {normalize_column_name(col, column_mapping) for col in headers 
-                                                            if not col.lower().startswith('unnamed:')}
-                                        normalized_columns = {col for col in normalized_columns if col.lower() not in ['server', 'date', 'dte']}
-                                        expected_columns = set(col for col in column_mapping.keys() if col.lower() not in ['server', 'date', 'dte'])
-                                        if expected_columns.issubset(normalized_columns):
-                                            matching_sheet = sheet_name
-                                            df = temp_df
-                                            df.columns = headers
-                                            logger.info(f"Found matching sheet '{sheet_name}' in {file_name} with columns: {normalized_columns}")
-                                            break
-                                    except Exception as e:
-                                        logger.warning(f"Error reading sheet {sheet_name} in {file_name}: {str(e)}")
-                                        continue
+                                logger.warning(f"No sheet in {file_name} matches expected '{table_name_lower}' table columns")
+                                results.append(("warning", f"No sheet in {file_name} matches expected '{table_name_lower}' table columns"))
+                                continue
 
-                                if not matching_sheet:
-                                    logger.warning(f"No sheet in {file_name} matches expected '{table_name_lower}' table columns: {expected_columns}")
-                                    with result_lock:
-                                        result_list.append(("warning", f"No sheet in {file_name} matches expected '{table_name_lower}' table columns"))
-                                    continue
+                            open_chunks = lambda: excel_reader.iter_chunks(file_path, matching_sheet)
+                            chunks = open_chunks()
+                            df = next(chunks)
+                            if len(df.columns) != len(headers):
+                                logger.warning(f"Expected {len(headers)} columns in data rows of {file_name} (sheet: {matching_sheet}), found {len(df.columns)}")
+                                results.append(("error", f"Expected {len(headers)} columns in data rows of {file_name} (sheet: {matching_sheet}), found {len(df.columns)}"))
+                                continue
+                            df.columns = headers
+                            logger.info(f"Found matching sheet '{matching_sheet}' in {file_name} with columns: {headers}")
                         else:
                             # For non-predefined tables, use the first sheet
-                            df = pd.read_excel(file_path, sheet_name=sheet_names[0], header=0, index_col=None, 
-                                             dtype_backend='numpy_nullable', keep_default_na=False, engine=engine_param)
+                            open_chunks = lambda: excel_reader.iter_chunks(file_path, sheet_names[0])
+                            chunks = open_chunks()
+                            df = next(chunks)
                             headers = standardize_headers([str(col) for col in df.columns])
                             if reference_headers is None:
                                 reference_headers = headers
                             elif headers != reference_headers:  # Check exact match including position
                                 logger.warning(f"Header mismatch in {file_name}. Expected: {reference_headers}, Found: {headers}")
-                                with result_lock:
-                                    result_list.append(("error", f"Header mismatch in {file_name}. All files must have identical headers in the same order."))
+                                results.append(("error", f"Header mismatch in {file_name}. All files must have identical headers in the same order."))
                                 continue
                             df.columns = headers
 
@@ -803,193 +874,277 @@ def upload_files_to_table(file_source, table_name, result_list, event, uploaded_
                         server, date = extract_server_and_date(file_name, table_name_lower, headers)
                         if is_predefined and (not server or not date) and not ('server' in [h.lower() for h in headers] and 'date' in [h.lower() for h in headers]):
                             logger.warning(f"Skipping {file_name} due to invalid server or date in filename")
-                            with result_lock:
-                                result_list.append(("error", f"Invalid server or date in filename {file_name}"))
+                            results.append(("error", f"Invalid server or date in filename {file_name}"))
                             continue
 
-                    # Process DataFrame and add columns to table
-                    if is_predefined and column_mapping:
-                        df = map_columns(df, column_mapping)
-                    else:
-                        df.columns = headers  # Use standardized headers
-
-                    if table_name_lower == 'ob' and 'tag' in df.columns:
-                        df['tag'] = df['tag'].fillna('').astype(str)
-
-                    # Validate and map DTE for 'users' table
-                    if table_name_lower == 'users' and 'dte' in df.columns:
-                        valid_dtes = {'0DTE', '1DTE', '2DTE', '3DTE', '4DTE'}
-                        dte_mapping = {
-                                '0': '0DTE', '0dte': '0DTE', 'dte0': '0DTE', 'DTE0': '0DTE',
-                                '1': '1DTE', '1dte': '1DTE', 'dte1': '1DTE', 'DTE1': '1DTE',
-                                '2': '2DTE', '2dte': '2DTE', 'dte2': '2DTE', 'DTE2': '2DTE',
-                                '3': '3DTE', '3dte': '3DTE', 'dte3': '3DTE', 'DTE3': '3DTE',
-                                '4': '4DTE', '4dte': '4DTE', 'dte4': '4DTE', 'DTE4': '4DTE',
-                                '0/1':'0/1DTE', '0DTE/1DTE': '0/1DTE'
-                            }
-                        invalid_dtes = set(df['dte'].dropna()) - valid_dtes - set(dte_mapping.keys())
-                        if invalid_dtes:
-                            logger.warning(f"Invalid DTE values in {file_name}: {invalid_dtes}")
-                            with result_lock:
-                                result_list.append(("error", f"Invalid DTE values in {file_name}: {invalid_dtes}. Must be one of {valid_dtes} or {set(dte_mapping.keys())}"))
-                            continue
-                        df['dte'] = df['dte'].map(lambda x: dte_mapping.get(str(x), x) if pd.notnull(x) else x)
-
-                    logger.info(f"Processed DataFrame for {file_name}: {df.head().to_dict()}")
-
-                    # Add server and date to DataFrame only for predefined tables if not already present
-                    if is_predefined:
-                        if table_name_lower in table_mappings:
-                            if 'server' not in [h.lower() for h in df.columns]:
-                                df['server'] = server
-                            if 'date' not in [h.lower() for h in df.columns]:
-                                df['date'] = date.strftime('%Y-%m-%d') if date else None
-
-                    # Filter out empty rows
-                    def is_row_empty(row):
-                        return all(pd.isna(row[col]) or str(row[col]).strip().lower() in ['', 'na', 'nan'] 
-                                   for col in df.columns if col.lower() not in ['row_id', 'id', 'server', 'date', 'dte'])
-
-                    df = df[~df.apply(is_row_empty, axis=1)]
-
-                    logger.info(f"Filtered DataFrame for {file_name}: {df.head().to_dict()}")
-
-                    if df.empty:
-                        logger.info(f"No valid rows to import from {file_name}")
-                        with result_lock:
-                            result_list.append(("warning", f"No valid rows to import from {file_name}"))
-                        continue
-
-                    # Get existing columns in the table
-                    cursor.execute(f"SHOW COLUMNS FROM `{table_name_lower}`")
-                    existing_columns = [col.lower() for col in [row[0] for row in cursor.fetchall()]]
+                    # Ingest the file chunk by chunk (CSV chunksize / excel_reader.iter_chunks): the first
+                    # chunk was checked above, later chunks take its columns. All of a file's rows go in
+                    # one transaction, committed once the whole file is in and rolled back otherwise
+                    file_columns = list(df.columns)
+                    file_rows = 0
+                    file_failed = False
+                    # When a later chunk needs a column change, its ALTER TABLE would wait on this
+                    # file's uncommitted rows: they are rolled back, a sizing pass collects the column
+                    # types of the whole file for one ALTER, and the file is imported again
+                    sizing = sized = False
+                    file_types = {}
+                    while True:
+                        restart = False
+                        for df in itertools.chain([df], chunks):
+                            if len(df.columns) != len(file_columns):
+                                results.append(("error", f"Expected {len(file_columns)} columns in data rows of {file_name}, found {len(df.columns)}"))
+                                file_failed = True
+                                break
+                            df.columns = file_columns
+
+                            # Process DataFrame and add columns to table
+                            if is_predefined and column_mapping:
+                                df = map_columns(df, column_mapping)
+                            else:
+                                df.columns = headers  # Use standardized headers
+
+                            if table_name_lower == 'ob' and 'tag' in df.columns:
+                                df['tag'] = df['tag'].fillna('').astype(str)
+
+                            # Validate and map DTE for 'users' table
+                            if table_name_lower == 'users' and 'dte' in df.columns:
+                                valid_dtes = {'0DTE', '1DTE', '2DTE', '3DTE', '4DTE'}
+                                dte_mapping = {
+                                        '0': '0DTE', '0dte': '0DTE', 'dte0': '0DTE', 'DTE0': '0DTE',
+                                        '1': '1DTE', '1dte': '1DTE', 'dte1': '1DTE', 'DTE1': '1DTE',
+                                        '2': '2DTE', '2dte': '2DTE', 'dte2': '2DTE', 'DTE2': '2DTE',
+                                        '3': '3DTE', '3dte': '3DTE', 'dte3': '3DTE', 'DTE3': '3DTE',
+                                        '4': '4DTE', '4dte': '4DTE', 'dte4': '4DTE', 'DTE4': '4DTE',
+                                        '0/1':'0/1DTE', '0DTE/1DTE': '0/1DTE'
+                                    }
+                                invalid_dtes = set(df['dte'].dropna()) - valid_dtes - set(dte_mapping.keys())
+                                if invalid_dtes:
+                                    logger.warning(f"Invalid DTE values in {file_name}: {invalid_dtes}")
+                                    results.append(("error", f"Invalid DTE values in {file_name}: {invalid_dtes}. Must be one of {valid_dtes} or {set(dte_mapping.keys())}"))
+                                    file_failed = True
+                                    break
+                                df['dte'] = df['dte'].map(lambda x: dte_mapping.get(str(x), x) if pd.notnull(x) else x)
+
+                            logger.info(f"Processed DataFrame for {file_name}: {df.head().to_dict()}")
+
+                            # Add server and date to DataFrame only for predefined tables if not already present
+                            if is_predefined:
+                                if table_name_lower in table_mappings:
+                                    if 'server' not in [h.lower() for h in df.columns]:
+                                        df['server'] = server
+                                    if 'date' not in [h.lower() for h in df.columns]:
+                                        df['date'] = date.strftime('%Y-%m-%d') if date else None
+
+                            # Filter out empty rows
+                            def is_row_empty(row):
+                                return all(pd.isna(row[col]) or str(row[col]).strip().lower() in ['', 'na', 'nan'] 
+                                           for col in df.columns if col.lower() not in ['row_id', 'id', 'server', 'date', 'dte'])
+
+                            df = df[~df.apply(is_row_empty, axis=1)]
+
+                            logger.info(f"Filtered DataFrame for {file_name}: {df.head().to_dict()}")
+
+                            if df.empty:
+                                continue
 
-                    # Add columns to the table if they don't exist
-                    for col in df.columns:
-                        if col.lower() not in existing_columns:
-                            try:
-                                if is_predefined:
-                                    if col == 'sno' and table_name_lower == 'ob':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` INT")
-                                    elif table_name_lower == 'gridlog' and col == 'timestamp':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` TEXT")
-                                    elif table_name_lower == 'gridlog' and col == 'date':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` DATE")
-                                    elif col.lower() == 'status_message':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` TEXT")
-                                    elif col.lower() == 'date' and table_name_lower in table_mappings:
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` DATE")
-                                    elif col.lower() == 'tag' and table_name_lower == 'ob':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` TEXT")
-                                    elif table_name_lower == 'users' and col.lower() == 'dte':
-                                        cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` VARCHAR(10)")
+                            # Parse timestamps into DATETIME(3) once here, keeping unparseable text in <column>_raw
+                            if is_predefined:
+                                for col in datetime_columns.get(table_name_lower, {}):
+                                    if col in df.columns:
+                                        df[col], df[f"{col}_raw"] = parse_datetime_column(df[col], df['date'] if 'date' in df.columns else None)
+
+                            # Column diff for this chunk (usually only the first has one): widened and new columns, as one ALTER TABLE
+                            inferred_types = infer_frame_types(df) if not is_predefined else {}
+                            if sizing:
+                                for col, (column_type, date_format) in inferred_types.items():
+                                    file_types[col] = (widen(file_types.get(col, (None, None))[0], column_type), date_format)
+                                continue
+                            plan = plan_upload_columns(table_name_lower, df.columns, is_predefined, inferred_types)
+                            if plan and file_rows:
+                                restart = True
+                                break
+                            if plan:
+                                connection.commit()
+                                progress(stage=f"{file_name}: {plan.describe()}")
+                                try:
+                                    # On its own connection; the uploader's cursor holds no locks after the commit
+                                    algorithm = plan.apply(engine, invalidate=invalidate_table_metadata)
+                                    results.append(("info", f"{file_name}: {plan.describe()} (ALGORITHM {algorithm})"))
+                                except Exception as e:
+                                    logger.error(f"Error altering `{table_name_lower}` for {file_name}: {str(e)}")
+                                    results.append(("error", f"Failed to update columns of {table_name_lower} ({plan.describe()}): {str(e)}"))
+                                    file_failed = True
+                                    break
+
+                            # Prepare columns for insertion
+                            # Generated columns (e.g. jainam.is_jainam) are computed by MySQL and can't be written
+                            table_columns = schema_catalog.get_writable_columns(table_name_lower)
+                            insert_columns = [col for col in table_columns if col.lower() not in ['row_id', 'id']]
+                            logger.info(f"Insert columns for {table_name_lower}: {insert_columns}")
+
+                            # Reindex DataFrame to match table columns
+                            df = df.reindex(columns=insert_columns, fill_value=None)
+
+                            # Data type conversions for predefined tables
+                            if is_predefined:
+                                if 'sno' in df.columns and table_name_lower == 'ob':
+                                    df['sno'] = pd.to_numeric(df['sno'], errors='coerce').where(pd.notnull(df['sno']), None)
+                                if 'date' in df.columns and table_name_lower in table_mappings:
+                                    if table_name_lower == 'gridlog':
+                                        df['date'] = df['date'].replace(['NaT', pd.NaT, pd.NA, ''], None)
                                     else:
-                                        mysql_type = table_mappings.get(table_name_lower, {}).get(col, {}).get("datatype")
-                                        if mysql_type and isinstance(mysql_type, str):
-                                            cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` {mysql_type}")
-                                        else:
-                                            logger.warning(f"No valid datatype defined for column `{col}` in `{table_name_lower}`, using TEXT")
-                                            cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` TEXT")
-                                else:
-                                    # For non-predefined tables, use TEXT for all new columns
-                                    cursor.execute(f"ALTER TABLE `{table_name_lower}` ADD COLUMN `{col}` TEXT")
-                                existing_columns.append(col.lower())
-                            except Exception as e:
-                                if 'Duplicate column name' in str(e):
-                                    logger.warning(f"Column `{col}` already exists in `{table_name_lower}`, skipping addition")
-                                else:
-                                    logger.error(f"Error adding column `{col}` to `{table_name_lower}`: {str(e)}")
-                                    with result_lock:
-                                        result_list.append(("error", f"Failed to add column {col} to {table_name_lower}: {str(e)}"))
-                                    continue
+                                        df['date'] = pd.to_datetime(df['date'], errors='coerce', format='%Y-%m-%d').dt.date
+                                    df['date'] = df['date'].where(pd.notnull(df['date']), None)
+                                if 'dte' in df.columns and table_name_lower == 'users':
+                                    df['dte'] = df['dte'].astype(str).where(pd.notnull(df['dte']), None)
+                                if 'status' in df.columns:
+                                    df['status'] = df['status'].astype(str)
+                                if 'status_message' in df.columns:
+                                    df['status_message'] = df['status_message'].fillna('').astype(str)
+                                if 'tag' in df.columns and table_name_lower == 'ob':
+                                    df['tag'] = df['tag'].fillna('').astype(str)
+                                for col in df.columns:
+                                    if table_mappings.get(table_name_lower, {}).get(col, {}).get("datatype") in ['INT', 'FLOAT', 'DECIMAL']:
+                                        df[col] = pd.to_numeric(df[col], errors='coerce').where(pd.notnull(df[col]), None)
+
+                            # Non-predefined tables: parse numbers and dates for the typed columns, record the schema
+                            if inferred_types:
+                                final_types = {}
+                                for col, (_, date_format) in inferred_types.items():
+                                    column_type = schema_catalog.get_column_type(table_name_lower, col)
+                                    final_types[col] = column_type
+                                    if col in df.columns and column_type and column_type.split('(')[0].upper() in ('INT', 'BIGINT', 'DECIMAL', 'DATE', 'DATETIME'):
+                                        df[col] = coerce_for_column(df[col], column_type, date_format)
+                                try:
+                                    with engine.begin() as schema_connection:
+                                        record_inferred_schema(schema_connection, table_name_lower, final_types, len(df))
+                                except Exception as e:
+                                    logger.warning(f"Could not record inferred schema for {table_name_lower}: {type(e).__name__} - {str(e)}")
+
+                            # Replace NaN and empty strings with None
+                            df = df.astype(object).replace('nan', None).replace('', None)
+                            values = [tuple(None if pd.isna(val) else val.item() if hasattr(val, 'item') else val for val in row) 
+                                     for row in df[insert_columns].values]
+
+                            # Insert data into the table
+                            columns_str = ", ".join([f"`{col}`" for col in insert_columns])
+                            placeholders = ", ".join(["%s"] * len(insert_columns))
+                            insert_query = f"INSERT INTO `{table_name_lower}` ({columns_str}) VALUES ({placeholders})"
+
+                            for i in range(0, len(values), batch_size):
+                                batch = values[i:i + batch_size]
+                                cursor.executemany(insert_query, batch)
+                                total_rows += len(batch)
+                                file_rows += len(batch)
+                                progress(stage=f"Writing {file_name}", rows=len(batch))
+
+                        if file_failed or not (restart or sizing):
+                            break
+                        if restart:
+                            if sized:
+                                results.append(("error", f"Columns of {table_name_lower} kept changing while {file_name} was imported"))
+                                file_failed = True
+                                break
+                            connection.rollback()
+                            total_rows -= file_rows
+                            progress(stage=f"Sizing the columns of {file_name}", rows=-file_rows)
+                            file_rows = 0
+                            sizing = True
+                        else:
+                            sizing = False
+                            sized = True
+                            plan = plan_upload_columns(table_name_lower, list(file_types), is_predefined, file_types)
+                            if plan:
+                                progress(stage=f"{file_name}: {plan.describe()}")
+                                try:
+                                    algorithm = plan.apply(engine, invalidate=invalidate_table_metadata)
+                                    results.append(("info", f"{file_name}: {plan.describe()} (ALGORITHM {algorithm})"))
+                                except Exception as e:
+                                    logger.error(f"Error altering `{table_name_lower}` for {file_name}: {str(e)}")
+                                    results.append(("error", f"Failed to update columns of {table_name_lower} ({plan.describe()}): {str(e)}"))
+                                    file_failed = True
+                                    break
+                        chunks.close()
+                        chunks = open_chunks()
+                        df = next(chunks)
+
+                    if file_failed:
+                        connection.rollback()
+                        total_rows -= file_rows
+                        if file_rows:
+                            results.append(("warning", f"{file_rows} rows of {file_name} were rolled back"))
+                            progress(rows=-file_rows)
+                        file_status = 'error'
+                        continue
                     connection.commit()
+                    file_committed = True
+                    if not file_rows:
+                        logger.info(f"No valid rows to import from {file_name}")
+                        results.append(("warning", f"No valid rows to import from {file_name}"))
+                        continue
 
-                    # Prepare columns for insertion
-                    table_columns = get_existing_columns(cursor, table_name_lower)
-                    insert_columns = [col for col in table_columns if col.lower() not in ['row_id', 'id']]
-                    logger.info(f"Insert columns for {table_name_lower}: {insert_columns}")
-
-                    # Reindex DataFrame to match table columns
-                    df = df.reindex(columns=insert_columns, fill_value=None)
-
-                    # Data type conversions for predefined tables
-                    if is_predefined:
-                        if 'sno' in df.columns and table_name_lower == 'ob':
-                            df['sno'] = pd.to_numeric(df['sno'], errors='coerce').where(pd.notnull(df['sno']), None)
-                        if 'date' in df.columns and table_name_lower in table_mappings:
-                            if table_name_lower == 'gridlog':
-                                df['date'] = df['date'].replace(['NaT', pd.NaT, pd.NA, ''], None)
-                            else:
-                                df['date'] = pd.to_datetime(df['date'], errors='coerce', format='%Y-%m-%d').dt.date
-                            df['date'] = df['date'].where(pd.notnull(df['date']), None)
-                        if 'dte' in df.columns and table_name_lower == 'users':
-                            df['dte'] = df['dte'].astype(str).where(pd.notnull(df['dte']), None)
-                        if 'status' in df.columns:
-                            df['status'] = df['status'].astype(str)
-                        if 'status_message' in df.columns:
-                            df['status_message'] = df['status_message'].fillna('').astype(str)
-                        if 'tag' in df.columns and table_name_lower == 'ob':
-                            df['tag'] = df['tag'].fillna('').astype(str)
-                        for col in df.columns:
-                            if table_mappings.get(table_name_lower, {}).get(col, {}).get("datatype") in ['INT', 'FLOAT', 'DECIMAL']:
-                                df[col] = pd.to_numeric(df[col], errors='coerce').where(pd.notnull(df[col]), None)
-
-                    # Replace NaN and empty strings with None
-                    df = df.astype(object).replace('nan', None).replace('', None)
-                    values = [tuple(None if pd.isna(val) else val.item() if hasattr(val, 'item') else val for val in row) 
-                             for row in df[insert_columns].values]
-
-                    # Insert data into the table
-                    columns_str = ", ".join([f"`{col}`" for col in insert_columns])
-                    placeholders = ", ".join(["%s"] * len(insert_columns))
-                    insert_query = f"INSERT INTO `{table_name_lower}` ({columns_str}) VALUES ({placeholders})"
-
-                    for i in range(0, len(values), batch_size):
-                        batch = values[i:i + batch_size]
-                        cursor.executemany(insert_query, batch)
-                        connection.commit()
-                        total_rows += len(batch)
-
-                    logger.info(f"Imported {file_name} to {table_name_lower} ({len(values)} rows) with columns: {list(df.columns)}")
-                    with result_lock:
-                        result_list.append(("success", f"Imported {file_name} to {table_name_lower} ({len(values)} rows)"))
-                    
+                    logger.info(f"Imported {file_name} to {table_name_lower} ({file_rows} rows) with columns: {list(df.columns)}")
+                    results.append(("success", f"Imported {file_name} to {table_name_lower} ({file_rows} rows)"))
+                
                     log_upload(table_name_lower, uploaded_by, file_hash, file_name)
+                    file_status = 'done'
 
                 except Exception as e:
                     logger.error(f"Error processing {file_name}: {type(e).__name__} - {str(e)}")
-                    with result_lock:
-                        result_list.append(("error", f"Error processing {file_name}: {type(e).__name__} - {str(e)}"))
-            with result_lock:
-                result_list.append(("success", f"File import completed! Total rows imported: {total_rows}"))
-
-        except Exception as e:
-            logger.error(f"Error in upload task: {type(e).__name__} - {str(e)}")
-            with result_lock:
-                result_list.append(("error", f"Error in upload task: {type(e).__name__} - {str(e)}"))
-        finally:
-            if cursor:
-                try:
-                    cursor.close()
-                except Exception as e:
-                    logger.error(f"Error closing cursor: {type(e).__name__} - {str(e)}")
-            if connection and connection.is_connected():
-                try:
-                    connection.close()
-                except Exception as e:
-                    logger.error(f"Error closing connection: {type(e).__name__} - {str(e)}")
-            event.set()
+                    results.append(("error", f"Error processing {file_name}: {type(e).__name__} - {str(e)}"))
+                    file_status = 'error'
+                    if not file_committed:
+                        # None of the file's rows are kept
+                        try:
+                            connection.rollback()
+                        except Exception as rollback_error:
+                            logger.error(f"Error rolling back {file_name}: {str(rollback_error)}")
+                        total_rows -= file_rows
+                        if file_rows:
+                            progress(rows=-file_rows)
+            finally:
+                if chunks is not None:
+                    chunks.close()
+                progress(file=file, file_status=file_status)
+        results.append(("success", f"File import completed! Total rows imported: {total_rows}"))
+        if total_rows:
+            progress(stage="Updating search index")
+            ensure_search_index(table_name_lower, engine)
+            if schema_catalog.is_partitioned(table_name_lower):
+                # New dates may be past the pre-created months; keep partitions ahead of them
+                maintain_partitions(engine, tables=[table_name_lower])
+        if total_rows:
+            invalidate_table_data(table_name_lower)
 
-    try:
-        thread = threading.Thread(target=task)
-        thread.start()
-        return thread, event
     except Exception as e:
-        logger.error(f"Error starting upload thread: {type(e).__name__} - {str(e)}")
-        with result_lock:
-            result_list.append(("error", f"Error starting upload thread: {type(e).__name__} - {str(e)}"))
-        event.set()
-        return None, event
+        logger.error(f"Error in upload task: {type(e).__name__} - {str(e)}")
+        results.append(("error", f"Error in upload task: {type(e).__name__} - {str(e)}"))
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except Exception as e:
+                logger.error(f"Error closing cursor: {type(e).__name__} - {str(e)}")
+        if connection and connection.is_connected():
+            try:
+                connection.close()
+            except Exception as e:
+                logger.error(f"Error closing connection: {type(e).__name__} - {str(e)}")
+    return results
+
+
+def enqueue_upload(file_source, table_name, uploaded_by, has_header=True, cleanup=False):
+    """
+    Queue an upload as a background job (serialised per table) and return the job id.
+    With cleanup=True, file_source is removed once the job has finished.
+    """
+    def upload_job(progress):
+        try:
+            return _run_upload(file_source, table_name, uploaded_by, has_header, progress=progress)
+        finally:
+            if cleanup:
+                shutil.rmtree(file_source, ignore_errors=True)
+    return submit_job('upload', table_name.lower(), upload_job, created_by=uploaded_by)
 
 
 @app.after_request
@@ -1052,41 +1207,55 @@ def upload():
             flash('No file or folder path provided!', 'error')
             return redirect(url_for('upload'))
         
-        result_list = []
-        event = threading.Event()
-        
         if 'file' in request.files and request.files['file'].filename:
             file = request.files['file']
             if not file.filename.lower().endswith(('.csv', '.xlsx', '.xls', '.xlsb')):
                 flash('Invalid file format! Only CSV and Excel files are allowed.', 'error')
                 return redirect(url_for('upload'))
             
-            upload_dir = os.path.join('uploads', table_name)
-            os.makedirs(upload_dir, exist_ok=True)
-            file_path = os.path.join(upload_dir, file.filename)
+            # Each upload gets its own directory so queued jobs never pick up each other's files
+            os.makedirs('uploads', exist_ok=True)
+            upload_dir = tempfile.mkdtemp(prefix=f"{table_name}_", dir='uploads')
+            file_path = os.path.join(upload_dir, os.path.basename(file.filename))
             file.save(file_path)
-            
-            upload_files_to_table(upload_dir, table_name, result_list, event, uploaded_by, has_header)
-            event.wait()
-            
-            for category, msg in result_list:
-                flash(msg, category)
-            
-            return redirect(url_for('upload'))
-        
+            source, cleanup = upload_dir, True
         elif 'folder_path' in request.form and request.form['folder_path']:
-            folder_path = request.form['folder_path'].strip()
-            upload_files_to_table(folder_path, table_name, result_list, event, uploaded_by, has_header)
-            event.wait()
-            
-            for category, msg in result_list:
-                flash(msg, category)
-            
+            source, cleanup = request.form['folder_path'].strip(), False
+        else:
+            flash('No file or folder path provided!', 'error')
+            return redirect(url_for('upload'))
+
+        try:
+            job_id = enqueue_upload(source, table_name, uploaded_by, has_header, cleanup=cleanup)
+        except JobQueueFull as e:
+            if cleanup:
+                shutil.rmtree(source, ignore_errors=True)
+            flash(str(e), 'error')
             return redirect(url_for('upload'))
+        flash(f"Upload queued as job {job_id}", 'info')
+        return redirect(url_for('upload', job=job_id))
     
     tables = get_tables_cached()
     return render_template('upload.html', tables=tables)
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if 'authenticated' not in session or not session['authenticated']:
+        return jsonify({'error': 'Not authenticated'}), 401
+    status = get_job_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_route(job_id):
+    if 'authenticated' not in session or not session['authenticated']:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not cancel_job(job_id):
+        return jsonify({'error': 'Job not found, already finished or not cancellable'}), 409
+    logger.info(f"Cancellation requested for job {job_id} by {session.get('email', session.get('role'))}")
+    return jsonify({'cancel_requested': True})
+
 @app.route('/view_table/<table>', methods=['GET', 'POST'])
 def view_table(table):
     # Check authentication
@@ -1119,9 +1288,7 @@ def view_table(table):
                 return redirect(url_for('admin.admin_home') if session['role'] == 'admin' else url_for('user.user_home'))
 
             # Get primary key
-            result = connection.execute(text(f"SHOW KEYS FROM `{table}` WHERE Key_name = 'PRIMARY'"))
-            row = result.fetchone()
-            primary_key = row[4] if row else ('id' if table.lower() == 'upload_log' else 'row_id')
+            primary_key = schema_catalog.get_primary_key(table, 'id' if table.lower() == 'upload_log' else 'row_id')
 
             # Categorical columns for dropdowns
             categorical_columns = ['algo', 'server', 'enabled', 'status', 'dte', 'order_type', 'product', 'validity', 'strategy_tag', 'logged_in', 'sqoff_done', 'broker', 'operator', 'log_type', 'transaction', 'exchange']
@@ -1163,17 +1330,15 @@ def view_table(table):
             per_page = max(1, min(per_page, 3000))
             offset = start
 
-            # Build SQL query
-            query = f"SELECT * FROM `{table}`"
-            conditions = []
-            params = {}
+            # Build SQL query (stable bind names so each filter combination reuses one compiled statement)
+            builder = QueryBuilder(f"`{table}`")
+            like_filters = {}
+            in_filters = {}
+            date_range = None
 
             # Global search
             if search_query:
-                search_conditions = [f"CAST(`{col}` AS CHAR) LIKE :search_{col}" for col in columns]
-                conditions.append("(" + " OR ".join(search_conditions) + ")")
-                for col in columns:
-                    params[f'search_{col}'] = f"%{search_query}%"
+                apply_search(builder, table, columns, 'search', search_query, cast=True)
 
             # Column-specific searches
             for key, value in column_searches.items():
@@ -1181,8 +1346,8 @@ def view_table(table):
                     col_index = int(key.replace('column_', ''))
                     if 0 <= col_index < len(columns):
                         col_name = columns[col_index]
-                        conditions.append(f"`{col_name}` LIKE :{key}")
-                        params[key] = f"%{value}%"
+                        builder.where(f"`{col_name}` LIKE :column_{col_index}", **{f"column_{col_index}": f"%{value}%"})
+                        like_filters[col_name] = value
                 except ValueError:
                     logger.warning(f"Invalid column search key: {key}")
 
@@ -1191,13 +1356,10 @@ def view_table(table):
                 try:
                     col_index = int(key.replace('dropdown_', ''))
                     if 0 <= col_index < len(columns) and columns[col_index].lower() in categorical_columns:
-                        col_name = columns[col_index]
                         values = value.split(',')
                         if values:
-                            placeholders = ', '.join([f':{key}_{i}' for i in range(len(values))])
-                            conditions.append(f"`{col_name}` IN ({placeholders})")
-                            for i, val in enumerate(values):
-                                params[f'{key}_{i}'] = val
+                            builder.where_in(columns[col_index], f"dropdown_{col_index}", values)
+                            in_filters[columns[col_index]] = values
                 except ValueError:
                     logger.warning(f"Invalid dropdown filter key: {key}")
 
@@ -1208,35 +1370,49 @@ def view_table(table):
                     from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
                     to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
                     if from_date_obj <= to_date_obj:
-                        conditions.append(f"`{date_column}` BETWEEN :from_date AND :to_date")
-                        params['from_date'] = from_date_obj
-                        params['to_date'] = to_date_obj
+                        builder.where(f"`{date_column}` BETWEEN :from_date AND :to_date", from_date=from_date_obj, to_date=to_date_obj)
+                        date_range = (from_date_obj, to_date_obj)
                     else:
                         flash("Invalid date range: 'From' date must be before 'To' date", "warning")
                 except ValueError:
                     flash("Invalid date format", "warning")
                     logger.warning(f"Invalid date format: from_date={from_date}, to_date={to_date}")
 
-            # Construct WHERE clause
-            where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-            order_by_clause = f" ORDER BY `{sort_column}` {sort_direction.upper()}"
+            order_by_clause = f"`{sort_column}` {sort_direction.upper()}"
 
             # Log query for debugging
-            logger.debug(f"Query: {query} {where_clause}{order_by_clause}")
-            logger.debug(f"Parameters: {params}")
+            logger.debug(f"Query: SELECT * FROM `{table}`{builder.where_sql} ORDER BY {order_by_clause}")
+            logger.debug(f"Parameters: {builder.params}")
 
             # Count queries
-            total_rows_query = f"SELECT COUNT(*) FROM `{table}`"
-            filtered_rows_query = f"SELECT COUNT(*) FROM `{table}` {where_clause}"
-            total_rows = connection.execute(text(total_rows_query)).scalar() or 0
-            filtered_rows = connection.execute(text(filtered_rows_query), params).scalar() or 0
+            total_rows = connection.execute(QueryBuilder(f"`{table}`").count()).scalar() or 0
+            filtered_rows = connection.execute(builder.count(), builder.bind()).scalar() or 0
+
+            # Archived months inside the date range are read from Parquet and merged with the live rows
+            archived = None
+            if date_range and archive.archived_parts(table, *date_range):
+                archived = archive.filter_frame(archive.read_archive(table, *date_range), search=search_query,
+                                                like=like_filters, isin=in_filters)
+                total_rows += archive.archived_row_count(table)
+                filtered_rows += len(archived)
 
             # Paginated query
-            query_paginated = f"{query} {where_clause}{order_by_clause} LIMIT :limit OFFSET :offset"
-            params['limit'] = per_page
-            params['offset'] = offset
-            result = connection.execute(text(query_paginated), params)
-            paginated_data = [dict(row._mapping) for row in result.fetchall()]
+            query_paginated = builder.select(order_by=order_by_clause, paginate=True)
+
+            def fetch_page(offset):
+                began = time.perf_counter()
+                if archived is None or archived.empty:
+                    result = connection.execute(query_paginated, builder.bind(limit=per_page, offset=offset))
+                    rows = [dict(row._mapping) for row in result.fetchall()]
+                    archive.record_read('mysql', len(rows), time.perf_counter() - began)
+                    return rows
+                # The first offset + per_page live rows are enough to place this page exactly
+                result = connection.execute(query_paginated, builder.bind(limit=offset + per_page, offset=0))
+                live_rows = [dict(row._mapping) for row in result.fetchall()]
+                archive.record_read('mysql', len(live_rows), time.perf_counter() - began)
+                return archive.merge_page(live_rows, archived, sort_column, sort_direction == 'desc', offset, per_page)
+
+            paginated_data = fetch_page(offset)
 
             # Calculate total pages
             total_pages = max(1, math.ceil(filtered_rows / per_page))
@@ -1245,18 +1421,18 @@ def view_table(table):
             if page > total_pages:
                 page = total_pages
                 offset = (page - 1) * per_page
-                params['offset'] = offset
-                result = connection.execute(text(query_paginated), params)
-                paginated_data = [dict(row._mapping) for row in result.fetchall()]
+                paginated_data = fetch_page(offset)
 
             # Get unique values for categorical columns
             unique_values = {}
             for i, col in enumerate(columns):
                 if col.lower() in categorical_columns:
                     try:
-                        unique_query = f"SELECT DISTINCT `{col}` FROM `{table}` {where_clause} ORDER BY `{col}`"
-                        unique_result = connection.execute(text(unique_query), params)
+                        unique_result = connection.execute(builder.distinct(f"`{col}`", order_by=f"`{col}`"), builder.bind())
                         unique_values[str(i)] = [str(row[0]) for row in unique_result.fetchall() if row[0] is not None]
+                        if archived is not None and col in archived.columns and not archived.empty:
+                            archived_values = {str(value) for value in archived[col].dropna().unique()}
+                            unique_values[str(i)] = sorted(set(unique_values[str(i)]) | archived_values)
                     except Exception as e:
                         logger.error(f"Error fetching unique values for column {col}: {str(e)}")
                         unique_values[str(i)] = []
@@ -1360,22 +1536,20 @@ def download_table(table):
             rows_per_page = max(1, rows_per_page)
             offset = (page - 1) * rows_per_page
 
-            query = f"SELECT * FROM `{table}`"
-            conditions = []
-            params = {}
+            builder = QueryBuilder(f"`{table}`")
+            like_filters = {}
+            date_range = None
 
             if search_query:
-                search_conditions = [f"`{col}` LIKE :search" for col in columns]
-                conditions.append("(" + " OR ".join(search_conditions) + ")")
-                params['search'] = f"%{search_query}%"
+                apply_search(builder, table, columns, 'search', search_query)
 
             for key, value in column_searches.items():
                 try:
                     col_index = int(key.replace('column_', ''))
                     if 0 <= col_index < len(columns):
                         col_name = columns[col_index]
-                        conditions.append(f"`{col_name}` LIKE :{key}")
-                        params[key] = f"%{value}%"
+                        builder.where(f"`{col_name}` LIKE :column_{col_index}", **{f"column_{col_index}": f"%{value}%"})
+                        like_filters[col_name] = value
                 except ValueError:
                     continue
 
@@ -1384,22 +1558,33 @@ def download_table(table):
                     from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
                     to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
                     if from_date_obj <= to_date_obj:
-                        conditions.append("`date` BETWEEN :from_date AND :to_date")
-                        params['from_date'] = from_date_obj
-                        params['to_date'] = to_date_obj
+                        builder.where("`date` BETWEEN :from_date AND :to_date", from_date=from_date_obj, to_date=to_date_obj)
+                        date_range = (from_date_obj, to_date_obj)
                 except ValueError:
                     pass
 
-            where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-
             if download_all:
-                query_final = f"{query} {where_clause}"
+                query_final = builder.select()
+                params = builder.bind()
             else:
-                query_final = f"{query} {where_clause} LIMIT :limit OFFSET :offset"
-                params['limit'] = rows_per_page
-                params['offset'] = offset
+                query_final = builder.select(paginate=True)
+                params = builder.bind(limit=rows_per_page, offset=offset)
 
-            df = pd.read_sql(text(query_final), connection, params=params)
+            df = pd.read_sql(query_final, connection, params=params)
+
+            # Archived months inside the date range come from Parquet (appended after the live rows)
+            if date_range and archive.archived_parts(table, *date_range):
+                archived = archive.filter_frame(archive.read_archive(table, *date_range), search=search_query, like=like_filters)
+                if download_all:
+                    df = pd.concat([df, archived[[col for col in df.columns if col in archived.columns]]], ignore_index=True)
+                else:
+                    live_total = connection.execute(builder.count(), builder.bind()).scalar() or 0
+                    # Pages past the live rows continue into the archived rows
+                    archived_offset = max(offset - live_total, 0)
+                    remaining = rows_per_page - len(df)
+                    if remaining > 0:
+                        archived = archived.iloc[archived_offset:archived_offset + remaining]
+                        df = pd.concat([df, archived[[col for col in df.columns if col in archived.columns]]], ignore_index=True)
 
             csv_output = io.BytesIO()
             df.to_csv(csv_output, index=False)
@@ -1435,6 +1620,81 @@ def download_table(table):
         return redirect(url_for('view_table', table=table, page=1))
     
 
+def run_import(connection, table, df, replace=False, batch_size=None, first_row_number=2):
+    """
+    manage_database imports through batch_writer.import_frame: inline for small inputs (results
+    flashed), as a background job above BACKGROUND_IMPORT_ROWS. Returns the job id, or None.
+    """
+    batch_size = clamp_batch_size(batch_size)
+    # The import uses its own connections; end this one's transaction so its metadata lock
+    # doesn't block the RENAME TABLE of a replace import
+    connection.commit()
+    if len(df) > BACKGROUND_IMPORT_ROWS:
+        try:
+            job_id = submit_job('import', table, invalidating_job(import_frame, table), table, df, replace=replace, batch_size=batch_size,
+                                first_row_number=first_row_number, created_by=session.get('email', session.get('role')))
+        except JobQueueFull as e:
+            flash(str(e), "warning")
+            return None
+        flash(f"Import of {len(df)} rows queued as job {job_id}", "info")
+        return job_id
+    for category, message in import_frame(table, df, replace=replace, batch_size=batch_size, first_row_number=first_row_number):
+        flash(message, category)
+    invalidate_table_data(table)
+    if replace:
+        invalidate_table_metadata(table)
+    return None
+
+
+def run_mutation(connection, table, statement, condition, params, label, message):
+    """
+    manage_database bulk updates/deletes through chunked_mutation: inline for small tables,
+    as a cancellable background job when the table has more than one chunk of rows.
+    `message` is the result text, with {rows} for the affected row count. Returns the job id, or None.
+    """
+    # Chunks commit on their own connections; don't hold this one's snapshot and locks meanwhile
+    connection.commit()
+    if estimated_rows(connection, table) > MUTATION_CHUNK_ROWS:
+        try:
+            job_id = submit_job('mutation', table, invalidating_job(chunked_job, table), table, statement, condition, params, message,
+                                created_by=session.get('email', session.get('role')), cancellable=True)
+        except JobQueueFull as e:
+            flash(str(e), "warning")
+            return None
+        flash(f"{label} queued as job {job_id}", "info")
+        return job_id
+    affected_rows = run_chunked(table, statement, condition, params)
+    invalidate_table_data(table)
+    flash(message.format(rows=affected_rows), "success" if affected_rows > 0 else "warning")
+    return None
+
+
+def run_alter(connection, plan, label, message):
+    """
+    manage_database column changes through ddl.AlterPlan, as one ALTER TABLE. ALGORITHM=INSTANT
+    changes always run inline; others run inline on small tables and as a background job
+    (INPLACE with LOCK=NONE where MySQL allows it) above BACKGROUND_ALTER_ROWS. The schema
+    caches are invalidated once the ALTER has committed. Returns the job id, or None.
+    """
+    # The ALTER runs on its own connection; this one's metadata lock would block it
+    connection.commit()
+    if estimated_rows(connection, plan.table_name) > BACKGROUND_ALTER_ROWS:
+        if plan.apply(algorithms=INSTANT_ONLY, invalidate=invalidate_table_metadata):
+            flash(message, "success")
+            return None
+        try:
+            job_id = submit_job('alter', plan.table_name, alter_job, plan, message, invalidate=invalidate_table_metadata,
+                                created_by=session.get('email', session.get('role')))
+        except JobQueueFull as e:
+            flash(str(e), "warning")
+            return None
+        flash(f"{label} queued as job {job_id}", "info")
+        return job_id
+    algorithm = plan.apply(invalidate=invalidate_table_metadata)
+    flash(f"{message} (ALGORITHM {algorithm})", "success")
+    return None
+
+
 @app.route('/manage_database', defaults={'table': None}, methods=['GET', 'POST'])
 @app.route('/manage_database/<table>', methods=['GET', 'POST'])
 def manage_database(table):
@@ -1456,8 +1716,7 @@ def manage_database(table):
             connection.execution_options(autocommit=False)
 
             # Fetch all tables
-            result = connection.execute(text("SHOW TABLES"))
-            tables = [row[0] for row in result.fetchall()]
+            tables = get_tables()
 
             # If no table is selected, render empty template
             if not table:
@@ -1475,9 +1734,7 @@ def manage_database(table):
                                      search_query='', from_date='', to_date='')
 
             # Get primary key
-            result = connection.execute(text(f"SHOW KEYS FROM `{table}` WHERE Key_name = 'PRIMARY'"))
-            row = result.fetchone()
-            primary_key = row[4] if row else ('id' if table.lower() == 'upload_log' else 'row_id')
+            primary_key = schema_catalog.get_primary_key(table, 'id' if table.lower() == 'upload_log' else 'row_id')
 
             # Get columns
             columns = get_table_columns_cached(table)
@@ -1509,41 +1766,27 @@ def manage_database(table):
             offset = (page - 1) * per_page
 
             # Build query
-            query = f"SELECT * FROM `{table}`"
-            conditions = []
-            params = {}
+            builder = QueryBuilder(f"`{table}`")
 
             if search_query:
-                search_conditions = []
-                for i, col in enumerate(columns):
-                    search_conditions.append(f"`{col}` LIKE :search_{i}")
-                    params[f'search_{i}'] = f"%{search_query}%"
-                if search_conditions:
-                    conditions.append("(" + " OR ".join(search_conditions) + ")")
+                apply_search(builder, table, columns, 'search', search_query)
 
             if 'date' in columns:
                 if from_date:
                     try:
                         from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
-                        conditions.append("`date` >= :from_date")
-                        params['from_date'] = from_date_obj
+                        builder.where("`date` >= :from_date", from_date=from_date_obj)
                     except ValueError:
                         flash("Invalid from date format", "error")
                 if to_date:
                     try:
                         to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
-                        conditions.append("`date` <= :to_date")
-                        params['to_date'] = to_date_obj
+                        builder.where("`date` <= :to_date", to_date=to_date_obj)
                     except ValueError:
                         flash("Invalid to date format", "error")
 
-            where_clause = ""
-            if conditions:
-                where_clause = " WHERE " + " AND ".join(conditions)
-
             # Get total rows
-            total_rows_query = f"SELECT COUNT(*) FROM `{table}` {where_clause}"
-            total_rows = connection.execute(text(total_rows_query), params).scalar()
+            total_rows = connection.execute(builder.count(), builder.bind()).scalar()
             total_pages = math.ceil(total_rows / per_page) if total_rows > 0 else 1
             page = min(max(1, page), total_pages)
 
@@ -1562,16 +1805,11 @@ def manage_database(table):
                         elif not new_column.isalnum():
                             flash("New column name must be alphanumeric", "error")
                         else:
-                            column_type = get_column_type(connection, table, old_column)
-                            if column_type:
-                                query = text(f"ALTER TABLE `{table}` CHANGE `{old_column}` `{new_column}` {column_type}")
-                                connection.execute(query)
-                                connection.commit()
-                                flash(f"Column '{old_column}' renamed to '{new_column}'", "success")
-                                cache.delete_memoized(get_table_columns_cached, table)
-                                columns = get_table_columns_cached(table)
-                            else:
-                                flash(f"Could not determine type for column '{old_column}'", "error")
+                            job_id = run_alter(connection, AlterPlan(table).rename_column(old_column, new_column),
+                                               "Column rename", f"Column '{old_column}' renamed to '{new_column}'")
+                            if job_id:
+                                return redirect(url_for('manage_database', table=table, job=job_id))
+                            columns = get_table_columns_cached(table)
 
                     # Cell Update
                     elif action == 'edit_cell':
@@ -1580,6 +1818,8 @@ def manage_database(table):
                         row_id = request.form.get('row_id')
                         if not column or column not in columns or not row_id:
                             flash("Invalid column or row ID", "error")
+                        elif schema_catalog.is_generated_column(table, column):
+                            flash(f"Column '{column}' is generated by the database and can't be edited", "error")
                         else:
                             try:
                                 row_id = int(row_id)
@@ -1589,6 +1829,7 @@ def manage_database(table):
                                 affected_rows = result.rowcount
                                 flash(f"Updated {affected_rows} row(s) in column '{column}'", "success" if affected_rows > 0 else "warning")
                                 connection.commit()
+                                invalidate_table_data(table)
                             except ValueError:
                                 logger.error(f"Invalid row_id format: {row_id}")
                                 flash("Invalid row ID format", "error")
@@ -1615,6 +1856,7 @@ def manage_database(table):
                                 affected_rows = result.rowcount
                                 flash(f"Deleted {affected_rows} row(s)", "success" if affected_rows > 0 else "warning")
                                 connection.commit()
+                                invalidate_table_data(table)
                             except Exception as e:
                                 logger.error(f"Error deleting rows: {str(e)}")
                                 flash(f"Error deleting rows: {str(e)}", "error")
@@ -1625,19 +1867,15 @@ def manage_database(table):
                         if not columns_to_delete:
                             flash("No columns selected for deletion", "warning")
                         else:
-                            deleted_count = 0
+                            plan = AlterPlan(table)
                             for col in columns_to_delete:
                                 if col in columns and col.lower() != primary_key.lower():
-                                    try:
-                                        connection.execute(text(f"ALTER TABLE `{table}` DROP COLUMN `{col}`"))
-                                        deleted_count += 1
-                                    except Exception as e:
-                                        logger.error(f"Error deleting column '{col}': {e}")
-                                        flash(f"Error deleting column '{col}': {str(e)}", "error")
-                            if deleted_count > 0:
-                                flash(f"Successfully deleted {deleted_count} column(s)", "success")
-                                connection.commit()
-                                cache.delete_memoized(get_table_columns_cached, table)
+                                    plan.drop_column(col)
+                            if plan:
+                                job_id = run_alter(connection, plan, "Column deletion",
+                                                   f"Successfully deleted {len(plan)} column(s)")
+                                if job_id:
+                                    return redirect(url_for('manage_database', table=table, job=job_id))
                                 columns = get_table_columns_cached(table)
                             else:
                                 flash("No valid columns deleted", "warning")
@@ -1650,20 +1888,37 @@ def manage_database(table):
                         if not column or column not in columns:
                             flash("Invalid column name", "error")
                         else:
-                            query = text(f"UPDATE `{table}` SET `{column}` = :new_data WHERE `{column}` = :old_data")
-                            params_update = {'new_data': new_data, 'old_data': old_data}
-                            result = connection.execute(query, params_update)
-                            affected_rows = result.rowcount
-                            flash(f"Bulk updated {affected_rows} rows in column '{column}'", "success" if affected_rows > 0 else "warning")
-                            connection.commit()
+                            job_id = run_mutation(connection, table, f"UPDATE `{table}` SET `{column}` = :new_data",
+                                                  f"`{column}` = :old_data", {'new_data': new_data, 'old_data': old_data},
+                                                  "Bulk update", f"Bulk updated {{rows}} rows in column '{column}'")
+                            if job_id:
+                                return redirect(url_for('manage_database', table=table, job=job_id))
 
                     # Bulk Delete
                     elif action == 'bulk_delete':
                         column = request.form.get('column')
                         value = request.form.get('value')
                         match_type = request.form.get('match_type')
+                        date_range = date_range_for_match(match_type, value) if column == 'date' else None
                         if not column or column not in columns:
                             flash("Invalid column name", "error")
+                        elif date_range and schema_catalog.is_partitioned(table):
+                            # Whole days of a date-partitioned table: truncate the partitions the range covers,
+                            # and delete from the others through the chunked executor (pruned by the date condition)
+                            connection.commit()
+                            truncated_rows, partial = truncate_covered_partitions(connection, table, *date_range)
+                            if truncated_rows:
+                                invalidate_table_data(table)
+                                flash(f"Truncated {truncated_rows} rows", "success")
+                            if partial:
+                                job_id = run_mutation(connection, table, f"DELETE FROM `{table}`",
+                                                      "`date` >= :start AND `date` < :end",
+                                                      {'start': date_range[0], 'end': date_range[1]},
+                                                      "Bulk delete", "Batch deleted {rows} rows")
+                                if job_id:
+                                    return redirect(url_for('manage_database', table=table, job=job_id))
+                            elif not truncated_rows:
+                                flash("Batch deleted 0 rows", "warning")
                         else:
                             if match_type == 'exact':
                                 condition = f"`{column}` = :value"
@@ -1676,11 +1931,10 @@ def manage_database(table):
                             elif match_type == 'ends':
                                 condition = f"`{column}` LIKE :value"
                                 value = f"%{value}"
-                            query = text(f"DELETE FROM `{table}` WHERE {condition}")
-                            result = connection.execute(query, {'value': value})
-                            affected_rows = result.rowcount
-                            flash(f"Batch deleted {affected_rows} rows", "success" if affected_rows > 0 else "warning")
-                            connection.commit()
+                            job_id = run_mutation(connection, table, f"DELETE FROM `{table}`", condition, {'value': value},
+                                                  "Bulk delete", "Batch deleted {rows} rows")
+                            if job_id:
+                                return redirect(url_for('manage_database', table=table, job=job_id))
 
                     # Bulk Insert
                     elif action == 'bulk_insert':
@@ -1694,21 +1948,18 @@ def manage_database(table):
                             if not data_rows:
                                 flash("Empty CSV data", "error")
                             else:
-                                headers = data_rows[0] if has_headers else columns
+                                insert_columns = schema_catalog.get_writable_columns(table)
+                                headers = data_rows[0] if has_headers else insert_columns
                                 start_row = 1 if has_headers else 0
-                                if len(headers) != len(columns):
+                                if len(headers) != len(insert_columns):
                                     flash("CSV columns do not match table columns", "error")
                                 else:
-                                    placeholders = ','.join([':' + str(i) for i in range(len(columns))])
-                                    query = text(f"INSERT INTO `{table}` (`{'`,`'.join(columns)}`) VALUES ({placeholders})")
-                                    inserted_count = 0
-                                    for row in data_rows[start_row:]:
-                                        if len(row) == len(columns):
-                                            params_insert = {str(i): row[i] for i in range(len(row))}
-                                            connection.execute(query, params_insert)
-                                            inserted_count += 1
-                                    flash(f"Inserted {inserted_count} row(s)", "success" if inserted_count > 0 else "warning")
-                                    connection.commit()
+                                    rows = [row for row in data_rows[start_row:] if len(row) == len(insert_columns)]
+                                    df = pd.DataFrame(rows, columns=insert_columns)
+                                    job_id = run_import(connection, table, df, batch_size=request.form.get('batch_size'),
+                                                        first_row_number=start_row + 1)
+                                    if job_id:
+                                        return redirect(url_for('manage_database', table=table, job=job_id))
 
                     # Add Column
                     elif action == 'add_column':
@@ -1720,13 +1971,10 @@ def manage_database(table):
                         elif not data_type:
                             flash("Data type required", "error")
                         else:
-                            query = f"ALTER TABLE `{table}` ADD `{column_name}` {data_type}"
-                            if default_value:
-                                query += f" DEFAULT '{default_value}'"
-                            connection.execute(text(query))
-                            connection.commit()
-                            flash(f"Column '{column_name}' added", "success")
-                            cache.delete_memoized(get_table_columns_cached, table)
+                            job_id = run_alter(connection, AlterPlan(table).add_column(column_name, data_type, default_value),
+                                               "Column addition", f"Column '{column_name}' added")
+                            if job_id:
+                                return redirect(url_for('manage_database', table=table, job=job_id))
                             columns = get_table_columns_cached(table)
 
                     # Modify Column
@@ -1738,10 +1986,10 @@ def manage_database(table):
                         elif not data_type:
                             flash("Data type required", "error")
                         else:
-                            connection.execute(text(f"ALTER TABLE `{table}` MODIFY COLUMN `{column}` {data_type}"))
-                            connection.commit()
-                            flash(f"Column '{column}' modified", "success")
-                            cache.delete_memoized(get_table_columns_cached, table)
+                            job_id = run_alter(connection, AlterPlan(table).modify_column(column, data_type),
+                                               "Column change", f"Column '{column}' modified")
+                            if job_id:
+                                return redirect(url_for('manage_database', table=table, job=job_id))
                             columns = get_table_columns_cached(table)
 
                     # Import Data
@@ -1755,19 +2003,17 @@ def manage_database(table):
                             if filename.endswith('.csv'):
                                 df = pd.read_csv(file)
                             else:
-                                df = pd.read_excel(file)
-                            if set(df.columns) != set(columns):
+                                # Streamed (openpyxl read-only) rather than materialising every cell object
+                                df = excel_reader.read_frame(file)
+                            # Generated columns may be present (e.g. from an export) but are never imported
+                            insert_columns = schema_catalog.get_writable_columns(table)
+                            if set(df.columns) - (set(columns) - set(insert_columns)) != set(insert_columns):
                                 flash("File columns do not match table columns", "error")
                             else:
-                                if import_mode == 'replace':
-                                    connection.execute(text(f"TRUNCATE TABLE `{table}`"))
-                                placeholders = ','.join([f':{col}' for col in columns])
-                                query = text(f"INSERT INTO `{table}` (`{'`,`'.join(columns)}`) VALUES ({placeholders})")
-                                for _, row in df.iterrows():
-                                    params_insert = {col: row[col] for col in columns}
-                                    connection.execute(query, params_insert)
-                                flash(f"Imported {len(df)} row(s)", "success")
-                                connection.commit()
+                                job_id = run_import(connection, table, df[insert_columns], replace=import_mode == 'replace',
+                                                    batch_size=request.form.get('batch_size'))
+                                if job_id:
+                                    return redirect(url_for('manage_database', table=table, job=job_id))
 
                 except Exception as e:
                     connection.rollback()
@@ -1775,9 +2021,7 @@ def manage_database(table):
                     flash(f"Error: {str(e)}", "error")
 
             # Fetch data
-            query_paginated = f"SELECT * FROM `{table}` {where_clause} LIMIT :per_page OFFSET :offset"
-            params.update({'per_page': per_page, 'offset': offset})
-            result = connection.execute(text(query_paginated), params)
+            result = connection.execute(builder.select(paginate=True), builder.bind(limit=per_page, offset=offset))
             data = [dict(row._mapping) for row in result.fetchall()]
             for row in data:
                 for key in row:
@@ -1832,19 +2076,21 @@ init_app(app)
 
 admin_bp.get_tables = get_tables
 admin_bp.create_table = create_table
-admin_bp.upload_files_to_table = upload_files_to_table
+admin_bp.enqueue_upload = enqueue_upload
 admin_bp.cache = cache
 
 user_bp.get_tables = get_tables
-user_bp.upload_files_to_table = upload_files_to_table
+user_bp.enqueue_upload = enqueue_upload
 user_bp.cache = cache
 
+jainam_bp.cache = cache
+
+# Single schema_version check; pending migrations (core, jainam, auth) are applied here
+# unless MIGRATE_ON_STARTUP=false, in which case `python migrate.py` applies them.
 with app.app_context():
-    success, msg, category = create_upload_log_table()
-    if category == "error":
-        logger.error(f"Failed to initialize upload_log table: {msg}")
-        raise RuntimeError(f"Failed to initialize upload_log table: {msg}")
-    initialize_predefined_tables()
+    migrate_on_startup(get_db_connection())
+    # Jobs a previous run left queued or running never finish; report them as failed
+    recover_stale_jobs()
 
 if __name__ == '__main__':
     port = int(os.environ.get('FLASK_PORT', APP_CONFIG['PORT']))
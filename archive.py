@@ -0,0 +1,455 @@
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from utils import get_db_connection, logger
+from migrations import migration
+from partitions import add_months, month_start, delete_date_range
+import schema_catalog
+
+# Cold history lives in <ARCHIVE_DIR>/<table>/<YYYY-MM>/part-<timestamp>.parquet (zstd)
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_TABLES = ('ob', 'gridlog')
+# Months kept in MySQL besides the current one; older closed months can be archived
+ARCHIVE_AFTER_MONTHS = int(os.getenv('ARCHIVE_AFTER_MONTHS', 3))
+ARCHIVE_CHUNK = 50000
+ARCHIVE_COMPRESSION = 'zstd'
+# The manifest changes only when a month is archived; other processes pick it up within this
+MANIFEST_TTL = 60
+
+_manifest = None
+_manifest_loaded_at = 0.0
+_manifest_lock = threading.Lock()
+
+# Read latency per storage tier, for this process
+TIER_STATS = {'mysql': {'reads': 0, 'rows': 0, 'seconds': 0.0}, 'archive': {'reads': 0, 'rows': 0, 'seconds': 0.0}}
+_tier_stats_lock = threading.Lock()
+
+
+class ArchiveError(Exception):
+    """Raised when a month can't be archived safely (e.g. rows changed while it was written)."""
+
+
+@migration('archive', 1, 'archive_manifest table for Parquet cold storage')
+def migrate_archive_manifest(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS archive_manifest (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            table_name VARCHAR(255) NOT NULL,
+            month DATE NOT NULL,
+            path VARCHAR(1024) NOT NULL,
+            row_count BIGINT NOT NULL,
+            file_bytes BIGINT NOT NULL,
+            mysql_bytes BIGINT NOT NULL,
+            archived_at DATETIME NOT NULL,
+            INDEX idx_archive_manifest_table_month (table_name, month)
+        ) ENGINE=InnoDB
+    """))
+
+
+def record_read(tier, rows, seconds):
+    """Add one read of `rows` rows taking `seconds` to the tier's latency statistics."""
+    with _tier_stats_lock:
+        stats = TIER_STATS[tier]
+        stats['reads'] += 1
+        stats['rows'] += rows
+        stats['seconds'] += seconds
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def _arrow_type(column_type):
+    """Parquet column type for a MySQL column type."""
+    column_type = str(column_type or '').lower()
+    base = column_type.split('(')[0].strip()
+    if base in ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint'):
+        return pa.int64()
+    if base == 'decimal':
+        args = re.findall(r'\d+', column_type)
+        precision, scale = (int(args[0]), int(args[1])) if len(args) >= 2 else (10, 0)
+        return pa.decimal128(precision, scale)
+    if base in ('float', 'double', 'real'):
+        return pa.float64()
+    if base == 'date':
+        return pa.date32()
+    if base in ('datetime', 'timestamp'):
+        return pa.timestamp('ms')
+    return pa.string()
+
+
+def _to_arrow(frame, schema):
+    """Coerce a chunk of MySQL rows to the archive schema, so every chunk of a file matches."""
+    for field in schema:
+        column = frame[field.name]
+        if pa.types.is_integer(field.type):
+            frame[field.name] = pd.to_numeric(column, errors='coerce').astype('Int64')
+        elif pa.types.is_floating(field.type):
+            frame[field.name] = pd.to_numeric(column, errors='coerce')
+        elif pa.types.is_date(field.type):
+            frame[field.name] = pd.to_datetime(column, errors='coerce').dt.date
+        elif pa.types.is_timestamp(field.type):
+            frame[field.name] = pd.to_datetime(column, errors='coerce')
+        elif pa.types.is_string(field.type):
+            frame[field.name] = column.astype(str).where(column.notna(), None)
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+def _month_fingerprint(connection, table_name, start, end, lock=False):
+    """
+    (row count, checksum of every column) of a month of rows. lock=True reads with FOR UPDATE,
+    which locks the month's rows and the gaps between them until the transaction ends.
+    """
+    columns_sql = ", ".join(f"`{col}`" for col in schema_catalog.get_columns(table_name))
+    count, checksum = connection.execute(text(f"""
+        SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', {columns_sql}))), 0) FROM `{table_name}`
+        WHERE `date` >= :start AND `date` < :end{' FOR UPDATE' if lock else ''}
+    """), {'start': start, 'end': end}).fetchone()
+    return int(count or 0), int(checksum or 0)
+
+
+def _write_month(connection, table_name, start, end, path):
+    """Stream a month of rows into a Parquet file on the caller's connection. Returns the number of rows written."""
+    columns = schema_catalog.get_columns(table_name)
+    schema = pa.schema([(col, _arrow_type(schema_catalog.get_column_type(table_name, col))) for col in columns])
+    columns_sql = ", ".join(f"`{col}`" for col in columns)
+    rows = 0
+    temp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        result = connection.execution_options(stream_results=True).execute(
+            text(f"SELECT {columns_sql} FROM `{table_name}` WHERE `date` >= :start AND `date` < :end"),
+            {'start': start, 'end': end}
+        )
+        with pq.ParquetWriter(temp_path, schema, compression=ARCHIVE_COMPRESSION) as writer:
+            while True:
+                batch = result.fetchmany(ARCHIVE_CHUNK)
+                if not batch:
+                    break
+                writer.write_table(_to_arrow(pd.DataFrame(batch, columns=columns), schema))
+                rows += len(batch)
+        written = pq.ParquetFile(temp_path).metadata.num_rows
+        if written != rows:
+            raise ArchiveError(f"{path} holds {written} rows, expected {rows}")
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return rows
+
+
+def _average_row_bytes(connection, table_name):
+    return connection.execute(text("""
+        SELECT AVG_ROW_LENGTH FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name
+    """), {'table_name': table_name}).scalar() or 0
+
+
+def archive_month(engine, table_name, month):
+    """
+    Move one closed month of a table to Parquet. The month's rows are locked (SELECT ... FOR
+    UPDATE) before the file is written, and the manifest row and the DELETE go in the same
+    transaction, so only rows that are in the file are removed. Partitioned tables truncate the
+    month's partition instead: that DDL runs under LOCK TABLES, once the month's rows are
+    checked to be unchanged since they were written. Rows uploaded for the month later are
+    archived as a further part.
+    Returns: (rows archived, path).
+    """
+    start = month_start(month)
+    end = add_months(start, 1)
+    path = os.path.join(ARCHIVE_DIR, table_name, f"{start:%Y-%m}", f"part-{datetime.now():%Y%m%d%H%M%S}.parquet")
+    partitioned = schema_catalog.is_partitioned(table_name)
+
+    manifest_id = None
+    written = False
+    try:
+        with engine.connect() as connection:
+            with connection.begin():
+                rows, checksum = _month_fingerprint(connection, table_name, start, end, lock=True)
+                if not rows:
+                    return 0, None
+                written = True
+                if _write_month(connection, table_name, start, end, path) != rows:
+                    raise ArchiveError(f"{table_name} {start:%Y-%m} changed while it was archived")
+                manifest_id = connection.execute(text("""
+                    INSERT INTO archive_manifest (table_name, month, path, row_count, file_bytes, mysql_bytes, archived_at)
+                    VALUES (:table_name, :month, :path, :row_count, :file_bytes, :mysql_bytes, :archived_at)
+                """), {
+                    'table_name': table_name, 'month': start, 'path': path, 'row_count': rows,
+                    'file_bytes': os.path.getsize(path), 'mysql_bytes': rows * _average_row_bytes(connection, table_name),
+                    'archived_at': datetime.now(),
+                }).lastrowid
+                if not partitioned:
+                    connection.execute(text(f"DELETE FROM `{table_name}` WHERE `date` >= :start AND `date` < :end"),
+                                       {'start': start, 'end': end})
+
+            if partitioned:
+                # Partition DDL would commit (and release) the row locks first; LOCK TABLES keeps
+                # writers out from the check until the partition is truncated
+                connection.execute(text(f"LOCK TABLES `{table_name}` WRITE"))
+                try:
+                    if _month_fingerprint(connection, table_name, start, end) != (rows, checksum):
+                        raise ArchiveError(f"{table_name} {start:%Y-%m} changed while it was archived")
+                    delete_date_range(connection, table_name, start, end)
+                    connection.commit()
+                except Exception:
+                    # UNLOCK TABLES would commit a half-done DELETE
+                    connection.rollback()
+                    raise
+                finally:
+                    connection.execute(text("UNLOCK TABLES"))
+    except Exception:
+        if manifest_id and partitioned:
+            # Committed before the truncation; the non-partitioned path rolled it back already
+            with engine.begin() as connection:
+                connection.execute(text("DELETE FROM archive_manifest WHERE id = :id"), {'id': manifest_id})
+        if written and os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        invalidate_manifest()
+    logger.info(f"Archived {rows} rows of {table_name} {start:%Y-%m} to {path}")
+    return rows, path
+
+
+def archivable_months(engine, table_name, keep_months=ARCHIVE_AFTER_MONTHS):
+    """Closed months older than the last `keep_months` that still have rows in MySQL."""
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"""
+            SELECT YEAR(`date`), MONTH(`date`) FROM `{table_name}`
+            WHERE `date` < :cutoff
+            GROUP BY YEAR(`date`), MONTH(`date`)
+            ORDER BY 1, 2
+        """), {'cutoff': cutoff}).fetchall()
+    return [date(int(year), int(month), 1) for year, month in rows]
+
+
+def archive_table(table_name, keep_months=ARCHIVE_AFTER_MONTHS, progress=None):
+    """
+    Archive every closed month of a table older than `keep_months`, oldest first.
+    Job function (see jobs.submit_job): returns a list of (category, message) results.
+    """
+    if progress is None:
+        progress = lambda **kwargs: None
+    if table_name not in ARCHIVE_TABLES:
+        return [("error", f"Archiving is not enabled for {table_name}")]
+    engine = get_db_connection()
+    if not engine:
+        return [("error", "Database connection failed")]
+
+    results = []
+    months = archivable_months(engine, table_name, keep_months)
+    if not months:
+        return [("info", f"Nothing to archive in {table_name}")]
+    for month in months:
+        label = f"{table_name} {month:%Y-%m}"
+        progress(stage=f"Archiving {label}", file=label, file_status='processing')
+        try:
+            rows, path = archive_month(engine, table_name, month)
+            progress(rows=rows, file=label, file_status='done')
+            results.append(("success", f"Archived {rows} rows of {label}"))
+        except Exception as e:
+            logger.error(f"Error archiving {label}: {type(e).__name__} - {str(e)}")
+            progress(file=label, file_status='error')
+            results.append(("error", f"Error archiving {label}: {type(e).__name__} - {str(e)}"))
+            break
+    return results
+
+
+def _load_manifest():
+    engine = get_db_connection()
+    if not engine:
+        raise RuntimeError("Database connection failed")
+    with engine.connect() as connection:
+        if not schema_catalog.table_exists('archive_manifest'):
+            return {}
+        rows = connection.execute(text("""
+            SELECT table_name, month, path, row_count, file_bytes, mysql_bytes
+            FROM archive_manifest ORDER BY table_name, month, id
+        """)).mappings().fetchall()
+    manifest = {}
+    for row in rows:
+        manifest.setdefault(row['table_name'], []).append(dict(row))
+    return manifest
+
+
+def get_manifest():
+    """{table: [manifest rows]}, cached for MANIFEST_TTL seconds."""
+    global _manifest, _manifest_loaded_at
+    with _manifest_lock:
+        if _manifest is None or time.monotonic() - _manifest_loaded_at > MANIFEST_TTL:
+            try:
+                _manifest = _load_manifest()
+                _manifest_loaded_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error loading archive manifest: {type(e).__name__} - {str(e)}")
+                return _manifest or {}
+        return _manifest
+
+
+def invalidate_manifest():
+    global _manifest
+    with _manifest_lock:
+        _manifest = None
+
+
+def archived_parts(table_name, start=None, end=None):
+    """Manifest rows of a table whose month overlaps the inclusive date range [start, end]."""
+    start, end = _as_date(start), _as_date(end)
+    parts = []
+    for part in get_manifest().get(table_name, []):
+        month = part['month']
+        if end is not None and month > end:
+            continue
+        if start is not None and add_months(month, 1) <= start:
+            continue
+        parts.append(part)
+    return parts
+
+
+def archived_row_count(table_name):
+    return sum(part['row_count'] for part in get_manifest().get(table_name, []))
+
+
+def read_archive(table_name, start=None, end=None, columns=None):
+    """Archived rows of a table with start <= date <= end (either bound optional), as one DataFrame."""
+    start, end = _as_date(start), _as_date(end)
+    parts = archived_parts(table_name, start, end)
+    if not parts:
+        return pd.DataFrame(columns=columns or [])
+    filters = []
+    if start is not None:
+        filters.append(('date', '>=', start))
+    if end is not None:
+        filters.append(('date', '<=', end))
+    began = time.perf_counter()
+    frames = [pd.read_parquet(part['path'], columns=columns, filters=filters or None) for part in parts]
+    frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    record_read('archive', len(frame), time.perf_counter() - began)
+    return frame
+
+
+def archived_dates(table_name, start=None, end=None):
+    """Distinct dates of the archived rows of a table with start <= date <= end; reads only the date column."""
+    if not archived_parts(table_name, start, end):
+        return set()
+    dates = read_archive(table_name, start, end, columns=['date'])['date'].dropna()
+    return {_as_date(value) for value in dates.unique()}
+
+
+def filter_frame(frame, search=None, like=None, isin=None, equals=None):
+    """
+    Apply the view/download filters to archived rows, matching MySQL's case-insensitive
+    collation: `search` in any column, {column: substring}, {column: [values]}, {column: value}.
+    """
+    if frame.empty:
+        return frame
+    mask = pd.Series(True, index=frame.index)
+    text_frame = {}
+
+    def as_text(column):
+        if column not in text_frame:
+            text_frame[column] = frame[column].astype(str).where(frame[column].notna(), '').str.lower()
+        return text_frame[column]
+
+    if search:
+        needle = search.lower()
+        matches = pd.Series(False, index=frame.index)
+        for column in frame.columns:
+            matches |= as_text(column).str.contains(needle, regex=False)
+        mask &= matches
+    for column, value in (like or {}).items():
+        if column in frame.columns:
+            mask &= as_text(column).str.contains(str(value).lower(), regex=False)
+    for column, values in (isin or {}).items():
+        if column in frame.columns:
+            mask &= as_text(column).isin([str(v).lower() for v in values])
+    for column, value in (equals or {}).items():
+        if column in frame.columns:
+            mask &= as_text(column) == str(value).lower()
+    return frame[mask]
+
+
+def sort_frame(frame, order_by, descending=False):
+    """Sort like MySQL: NULLs first ascending, last descending."""
+    if frame.empty:
+        return frame
+    order_by = [order_by] if isinstance(order_by, str) else list(order_by)
+    na_position = 'last' if descending else 'first'
+    try:
+        return frame.sort_values(order_by, ascending=not descending, na_position=na_position, kind='stable')
+    except TypeError:
+        # Mixed value types in a column (live rows vs archived rows); compare as text
+        return frame.sort_values(order_by, ascending=not descending, na_position=na_position, kind='stable',
+                                 key=lambda column: column.astype(str))
+
+
+def read_range(connection, table_name, sql, params, start, end, columns, equals=None, order_by=None, rename=None):
+    """
+    Query router for date-bounded reads: `sql` (with `params`) reads the live rows, the months in
+    [start, end] that have been archived are read from Parquet and filtered with `equals`
+    (which must mirror the SQL's conditions), and the two are concatenated.
+    `columns` are the source columns; `rename` maps them to the SQL's aliases.
+    """
+    began = time.perf_counter()
+    live = pd.read_sql(text(sql), connection, params=params)
+    record_read('mysql', len(live), time.perf_counter() - began)
+    if not archived_parts(table_name, start, end):
+        return live
+    archived = filter_frame(read_archive(table_name, start, end, columns), equals=equals)
+    if rename:
+        archived = archived.rename(columns=rename)
+    if archived.empty:
+        return live
+    merged = pd.concat([live, archived[list(live.columns)]], ignore_index=True) if not live.empty else archived.reset_index(drop=True)
+    return sort_frame(merged, order_by).reset_index(drop=True) if order_by else merged
+
+
+def merge_page(live_rows, archived, sort_column, descending, offset, limit):
+    """
+    One page over live + archived rows. `live_rows` must be the first offset + limit live rows
+    in the same order, so the merged page is exact without reading the rest of the live table.
+    Returns: list of row dicts.
+    """
+    live = pd.DataFrame(live_rows)
+    if archived.empty:
+        frame = live
+    elif live.empty:
+        frame = archived
+    else:
+        frame = pd.concat([live, archived[[col for col in live.columns if col in archived.columns]]], ignore_index=True)
+    frame = sort_frame(frame, sort_column, descending).iloc[offset:offset + limit]
+    return [{col: (None if pd.isna(val) else val) for col, val in row.items()} for row in frame.to_dict('records')]
+
+
+def archive_stats():
+    """Storage per archived table and read latency per tier (this process)."""
+    tables = {}
+    for table_name, parts in get_manifest().items():
+        file_bytes = sum(part['file_bytes'] for part in parts)
+        mysql_bytes = sum(part['mysql_bytes'] for part in parts)
+        tables[table_name] = {
+            'months': len({part['month'] for part in parts}),
+            'rows': sum(part['row_count'] for part in parts),
+            'parquet_bytes': file_bytes,
+            'mysql_bytes_estimate': mysql_bytes,
+            'compression_ratio': round(mysql_bytes / file_bytes, 2) if file_bytes else None,
+            'bytes_saved': mysql_bytes - file_bytes,
+        }
+    with _tier_stats_lock:
+        tiers = {tier: dict(stats) for tier, stats in TIER_STATS.items()}
+    for stats in tiers.values():
+        stats['avg_ms'] = round(stats['seconds'] * 1000 / stats['reads'], 2) if stats['reads'] else 0.0
+        stats['seconds'] = round(stats['seconds'], 3)
+    return {'archive_dir': ARCHIVE_DIR, 'keep_months': ARCHIVE_AFTER_MONTHS, 'tables': tables, 'tiers': tiers}
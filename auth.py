@@ -4,6 +4,7 @@ from flask import session
 from passlib.hash import bcrypt
 from sqlalchemy import text
 from utils import get_db_connection
+from migrations import migration
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -390,4 +391,9 @@ class Auth:
     def logout():
         """Clear session"""
         session.clear()
-        logger.info("User logged out")
\ No newline at end of file
+        logger.info("User logged out")
+
+
+@migration('auth', 1, 'auth table with default users')
+def migrate_auth_table(connection):
+    Auth.init_db()
@@ -0,0 +1,202 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from utils import get_db_connection, logger
+import schema_catalog
+
+DEFAULT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+BATCH_SIZE_RANGE = (100, 10000)
+# Imports above this many rows run as background jobs with progress reporting
+BACKGROUND_IMPORT_ROWS = int(os.getenv('BACKGROUND_IMPORT_ROWS', 20000))
+# Suffixes of the tables used by replace imports (see import_frame)
+LOAD_SUFFIX = '__load'
+OLD_SUFFIX = '__old'
+
+
+def coerce_frame(df, column_types, required=(), first_row_number=2):
+    """
+    Vectorised type coercion for a DataFrame about to be bulk inserted.
+    Args:
+        df (DataFrame): Input rows; missing columns are added as NULL.
+        column_types (dict): {column: 'str' | 'float' | 'int' | 'date' | 'datetime'}.
+        required (iterable): Columns that must be non-empty; rows failing this are dropped.
+        first_row_number (int): Spreadsheet row number of df's first row, used in warnings.
+    Returns: (clean_df, warnings) where warnings is a list of per-row messages.
+    """
+    df = df.reindex(columns=list(column_types.keys())).reset_index(drop=True)
+    row_numbers = pd.Series(np.arange(len(df)) + first_row_number, index=df.index)
+    drop_mask = pd.Series(False, index=df.index)
+    warnings = []
+
+    for col, col_type in column_types.items():
+        original = df[col]
+        present = original.notna() & (original.astype(str).str.strip() != '')
+        if col_type == 'str':
+            df[col] = original.astype(str).str.strip().where(present, None)
+            continue
+        if col_type in ('float', 'int'):
+            converted = pd.to_numeric(original.where(present), errors='coerce')
+            invalid = present & converted.isna()
+            for row_number, value in zip(row_numbers[invalid], original[invalid]):
+                warnings.append(f"Row {row_number}: invalid number '{value}' in {col}, stored as NULL")
+            if col_type == 'int':
+                converted = converted.round()
+        elif col_type in ('date', 'datetime'):
+            converted = pd.to_datetime(original.where(present), errors='coerce')
+            invalid = present & converted.isna()
+            for row_number, value in zip(row_numbers[invalid], original[invalid]):
+                warnings.append(f"Row {row_number}: invalid date '{value}' in {col}, row skipped")
+            drop_mask |= invalid
+            if col_type == 'date':
+                converted = converted.dt.date
+        else:
+            raise ValueError(f"Unsupported column type '{col_type}' for {col}")
+        df[col] = converted.astype(object).where(converted.notna(), None)
+
+    for col in required:
+        missing = df[col].isna() & ~drop_mask
+        for row_number in row_numbers[missing]:
+            warnings.append(f"Row {row_number}: empty {col}, row skipped")
+        drop_mask |= missing
+
+    return df[~drop_mask], warnings
+
+
+def frame_to_records(df, columns=None):
+    """Convert a DataFrame to a list of dicts with NaN/NaT as None and numpy scalars as Python values."""
+    columns = list(columns or df.columns)
+    records = []
+    for values in df[columns].itertuples(index=False, name=None):
+        records.append({
+            col: None if val is None or (not isinstance(val, str) and pd.isna(val))
+            else val.item() if hasattr(val, 'item') else val
+            for col, val in zip(columns, values)
+        })
+    return records
+
+
+def insert_records(connection, table_name, columns, records, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Insert records with multi-row executemany batches on the caller's connection, so
+    the whole load runs inside the caller's transaction. progress(rows=n) is called per batch.
+    Returns: number of rows inserted.
+    """
+    if not records:
+        return 0
+    columns_str = ", ".join(f"`{col}`" for col in columns)
+    placeholders = ", ".join(f":{col}" for col in columns)
+    insert_query = text(f"INSERT INTO `{table_name}` ({columns_str}) VALUES ({placeholders})")
+    total = 0
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        connection.execute(insert_query, batch)
+        total += len(batch)
+        if progress:
+            progress(stage=f"Writing {table_name}", rows=len(batch))
+    logger.debug(f"Inserted {total} rows into {table_name} in batches of {batch_size}")
+    return total
+
+
+def summarize_warnings(warnings, limit=5):
+    """Short, flash-friendly summary of per-row warnings."""
+    if not warnings:
+        return ''
+    shown = "; ".join(warnings[:limit])
+    more = f" (and {len(warnings) - limit} more)" if len(warnings) > limit else ''
+    return f"{len(warnings)} row warning(s): {shown}{more}"
+
+
+def clamp_batch_size(value):
+    """Batch size from a form value, limited to BATCH_SIZE_RANGE."""
+    try:
+        batch_size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_BATCH_SIZE
+    return max(BATCH_SIZE_RANGE[0], min(batch_size, BATCH_SIZE_RANGE[1]))
+
+
+def column_kinds(table_name, columns):
+    """coerce_frame() kinds for the table's columns, from their MySQL types."""
+    kinds = {}
+    for col in columns:
+        base = (schema_catalog.get_column_type(table_name, col) or '').lower().split('(')[0].strip()
+        if base in ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint'):
+            kinds[col] = 'int'
+        elif base in ('decimal', 'float', 'double', 'real'):
+            kinds[col] = 'float'
+        elif base == 'date':
+            kinds[col] = 'date'
+        elif base in ('datetime', 'timestamp'):
+            kinds[col] = 'datetime'
+        else:
+            kinds[col] = 'str'
+    return kinds
+
+
+def has_foreign_keys(engine, table_name):
+    """True when the table has a foreign key or is referenced by one."""
+    with engine.connect() as connection:
+        return connection.execute(text("""
+            SELECT 1 FROM information_schema.REFERENTIAL_CONSTRAINTS
+            WHERE CONSTRAINT_SCHEMA = DATABASE() AND (TABLE_NAME = :table_name OR REFERENCED_TABLE_NAME = :table_name)
+            LIMIT 1
+        """), {'table_name': table_name}).fetchone() is not None
+
+
+def import_frame(table_name, df, replace=False, batch_size=DEFAULT_BATCH_SIZE, first_row_number=2, progress=None):
+    """
+    Load a DataFrame whose columns are the table's columns: coerced per column type in one
+    vectorised pass, then written in executemany batches inside a single transaction.
+    replace=True loads into an empty copy of the table and swaps it in with one atomic
+    RENAME TABLE, so readers see either the old rows or the new ones, never an empty table.
+    CREATE TABLE ... LIKE doesn't copy foreign keys and a swap would break the ones pointing
+    at the table, so a table with foreign keys is replaced by DELETE + insert in one transaction.
+    Usable as a job function (see jobs.submit_job).
+    Returns: list of (category, message) results.
+    """
+    if progress is None:
+        progress = lambda **kwargs: None
+    engine = get_db_connection()
+    if not engine:
+        return [("error", "Database connection failed")]
+
+    # Generated columns can't be written (MySQL error 3105); MySQL computes them
+    columns = [col for col in df.columns if not schema_catalog.is_generated_column(table_name, col)]
+    progress(stage=f"Preparing {len(df)} rows")
+    clean, warnings = coerce_frame(df, column_kinds(table_name, columns), first_row_number=first_row_number)
+    records = frame_to_records(clean, columns)
+    results = []
+
+    if not replace:
+        with engine.begin() as connection:
+            inserted = insert_records(connection, table_name, columns, records, batch_size, progress)
+    elif has_foreign_keys(engine, table_name):
+        with engine.begin() as connection:
+            progress(stage=f"Clearing {table_name}")
+            connection.execute(text(f"DELETE FROM `{table_name}`"))
+            inserted = insert_records(connection, table_name, columns, records, batch_size, progress)
+    else:
+        load_table = f"{table_name}{LOAD_SUFFIX}"
+        old_table = f"{table_name}{OLD_SUFFIX}"
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS `{load_table}`"))
+            connection.execute(text(f"CREATE TABLE `{load_table}` LIKE `{table_name}`"))
+        try:
+            with engine.begin() as connection:
+                inserted = insert_records(connection, load_table, columns, records, batch_size, progress)
+            progress(stage=f"Swapping in the new {table_name}")
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE IF EXISTS `{old_table}`"))
+                connection.execute(text(f"RENAME TABLE `{table_name}` TO `{old_table}`, `{load_table}` TO `{table_name}`"))
+                connection.execute(text(f"DROP TABLE `{old_table}`"))
+        finally:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE IF EXISTS `{load_table}`"))
+            schema_catalog.invalidate(table_name)
+    logger.info(f"Imported {inserted} rows into {table_name} ({'replace' if replace else 'append'}, batches of {batch_size})")
+
+    results.append(("success", f"{'Replaced contents with' if replace else 'Imported'} {inserted} row(s)"))
+    if warnings:
+        results.append(("warning", summarize_warnings(warnings)))
+    return results
@@ -0,0 +1,82 @@
+import os
+from sqlalchemy import text
+from utils import get_db_connection, logger
+import schema_catalog
+
+# Primary key rows visited per chunk; each chunk is its own short transaction
+MUTATION_CHUNK_ROWS = int(os.getenv('MUTATION_CHUNK_ROWS', 5000))
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+
+
+def estimated_rows(connection, table_name):
+    """InnoDB's row estimate for a table (no scan)."""
+    return connection.execute(text("""
+        SELECT TABLE_ROWS FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name
+    """), {'table_name': table_name}).scalar() or 0
+
+
+def chunkable_key(table_name):
+    """The table's single integer primary key column, or None when it can't be walked in ranges."""
+    table = schema_catalog.get_catalog().get(table_name) or {}
+    primary_key = table.get('primary_key') or []
+    if not primary_key:
+        return None
+    column_type = (schema_catalog.get_column_type(table_name, primary_key[0]) or '').lower()
+    return primary_key[0] if column_type.split('(')[0].strip() in INTEGER_TYPES else None
+
+
+def run_chunked(table_name, statement, condition, params, chunk_rows=MUTATION_CHUNK_ROWS, progress=None):
+    """
+    Apply `statement` ("DELETE FROM `t`" or "UPDATE `t` SET ...") to the rows matching `condition`,
+    walking the integer primary key in ranges of `chunk_rows` rows with a commit per chunk, so
+    no chunk holds locks or undo for long. Rows inserted above the key range seen at the start
+    are not touched; otherwise the total equals the single-statement result. Tables without an
+    integer primary key get the single statement.
+    progress(stage=, rows=) is called per chunk (jobs.Job.progress, which raises JobCancelled
+    when a cancellable job is cancelled; completed chunks stay committed).
+    Returns: total affected rows.
+    """
+    if progress is None:
+        progress = lambda **kwargs: None
+    engine = get_db_connection()
+    if not engine:
+        raise RuntimeError("Database connection failed")
+
+    key = chunkable_key(table_name)
+    if key is None:
+        with engine.begin() as connection:
+            affected = connection.execute(text(f"{statement} WHERE {condition}"), params).rowcount
+        progress(stage=f"Updated {table_name}", rows=affected)
+        return affected
+
+    with engine.connect() as connection:
+        low, high = connection.execute(text(f"SELECT MIN(`{key}`), MAX(`{key}`) FROM `{table_name}`")).fetchone()
+    if low is None:
+        return 0
+
+    boundary_query = text(f"""
+        SELECT `{key}` FROM `{table_name}` WHERE `{key}` >= :low AND `{key}` <= :high
+        ORDER BY `{key}` LIMIT 1 OFFSET :offset
+    """)
+    chunk_query = text(f"{statement} WHERE `{key}` >= :chunk_low AND `{key}` < :chunk_high AND ({condition})")
+    total = 0
+    chunks = 0
+    while low <= high:
+        with engine.begin() as connection:
+            # Upper bound of the next chunk_rows keys, found on the primary key index
+            upper = connection.execute(boundary_query, {'low': low, 'high': high, 'offset': chunk_rows}).scalar()
+            chunk_high = upper if upper is not None else high + 1
+            affected = connection.execute(chunk_query, {**params, 'chunk_low': low, 'chunk_high': chunk_high}).rowcount
+        total += affected
+        chunks += 1
+        low = chunk_high
+        progress(stage=f"{table_name}: {chunks} chunk(s), {key} up to {chunk_high - 1} of {high}", rows=affected)
+    logger.info(f"Chunked mutation on {table_name}: {total} rows in {chunks} chunk(s) of {chunk_rows}")
+    return total
+
+
+def chunked_job(table_name, statement, condition, params, message, chunk_rows=MUTATION_CHUNK_ROWS, progress=None):
+    """Job function around run_chunked(); `message` takes {rows}. Returns the (category, message) result."""
+    affected = run_chunked(table_name, statement, condition, params, chunk_rows, progress)
+    return [("success" if affected > 0 else "warning", message.format(rows=affected))]
@@ -9,6 +9,17 @@ load_dotenv()
 APP_CONFIG = {
     'PORT': int(os.getenv('FLASK_PORT', 8000)),  # Default to 8000
     'HOST': os.getenv('FLASK_HOST', '0.0.0.0'),  # Default to 0.0.0.0 for Docker
-    'DEBUG': os.getenv('FLASK_DEBUG', 'True').lower() == 'true',  # Accepts 'True' or 'False'
+    'DEBUG': os.getenv('FLASK_DEBUG', 'False').lower() == 'true',  # Accepts 'True' or 'False'
     'SECRET_KEY': os.getenv('FLASK_SECRET_KEY', 'your-secure-secret-key-1234567890'),
 }
+
+# Production server (serve.py). WORKERS > 1 pre-forks that many waitress processes on one socket.
+SERVER_CONFIG = {
+    'THREADS': int(os.getenv('WAITRESS_THREADS', 8)),  # Request threads per process
+    'WORKERS': int(os.getenv('WAITRESS_WORKERS', 1)),  # Processes (POSIX only when > 1)
+    'CONNECTION_LIMIT': int(os.getenv('WAITRESS_CONNECTION_LIMIT', 200)),  # Open client connections per process
+    'CHANNEL_TIMEOUT': int(os.getenv('WAITRESS_CHANNEL_TIMEOUT', 300)),  # Seconds before an inactive connection is dropped
+    'BACKLOG': int(os.getenv('WAITRESS_BACKLOG', 2048)),  # listen() backlog
+    'SEND_BYTES': int(os.getenv('WAITRESS_SEND_BYTES', 18000)),  # Bytes per socket send
+    'OUTBUF_OVERFLOW': int(os.getenv('WAITRESS_OUTBUF_OVERFLOW', 8 * 1024 * 1024)),  # Response bytes buffered in RAM before spilling to a temp file
+}
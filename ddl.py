@@ -0,0 +1,107 @@
+import os
+from sqlalchemy import text
+from utils import get_db_connection, logger
+import schema_catalog
+
+# ALTER TABLE algorithms, tried in order. MySQL rejects an ALGORITHM/LOCK clause it can't honour
+# instead of silently copying the table, so each attempt either keeps its guarantee or fails
+# fast without changing anything. The last entry is the server's default (a table copy at worst).
+ALGORITHMS = (
+    ('INSTANT', 'ALGORITHM=INSTANT'),
+    ('INPLACE', 'ALGORITHM=INPLACE, LOCK=NONE'),
+    ('DEFAULT', None),
+)
+INSTANT_ONLY = ALGORITHMS[:1]
+# Tables with more rows than this get non-instant ALTERs as background jobs
+BACKGROUND_ALTER_ROWS = int(os.getenv('BACKGROUND_ALTER_ROWS', 200000))
+# Unknown algorithm/lock, and "operation not supported" for the requested algorithm/lock
+UNSUPPORTED_ALGORITHM_ERRORS = (1800, 1801, 1845, 1846)
+
+
+def _unsupported(error):
+    orig = getattr(error, 'orig', error)
+    code = orig.args[0] if getattr(orig, 'args', None) else None
+    return code in UNSUPPORTED_ALGORITHM_ERRORS
+
+
+class AlterPlan:
+    """
+    Column changes for one table, applied as a single ALTER TABLE statement so the table is
+    rebuilt (when it has to be) once rather than once per column.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.clauses = []
+        self.descriptions = []
+        self.params = {}
+
+    def __len__(self):
+        return len(self.clauses)
+
+    def add_column(self, column, column_type, default=None):
+        clause = f"ADD COLUMN `{column}` {column_type}"
+        if default not in (None, ''):
+            param = f"default_{len(self.params)}"
+            self.params[param] = default
+            clause += f" DEFAULT :{param}"
+        self.clauses.append(clause)
+        self.descriptions.append(f"add `{column}` {column_type}")
+        return self
+
+    def modify_column(self, column, column_type):
+        self.clauses.append(f"MODIFY COLUMN `{column}` {column_type}")
+        self.descriptions.append(f"modify `{column}` to {column_type}")
+        return self
+
+    def rename_column(self, old_column, new_column):
+        # RENAME COLUMN keeps the definition (type, NULL, default) as it is
+        self.clauses.append(f"RENAME COLUMN `{old_column}` TO `{new_column}`")
+        self.descriptions.append(f"rename `{old_column}` to `{new_column}`")
+        return self
+
+    def drop_column(self, column):
+        self.clauses.append(f"DROP COLUMN `{column}`")
+        self.descriptions.append(f"drop `{column}`")
+        return self
+
+    def statement(self, options=None):
+        clauses = self.clauses + ([options] if options else [])
+        return f"ALTER TABLE `{self.table_name}` " + ", ".join(clauses)
+
+    def describe(self):
+        return f"ALTER TABLE `{self.table_name}`: " + "; ".join(self.descriptions)
+
+    def apply(self, engine=None, algorithms=ALGORITHMS, invalidate=schema_catalog.invalidate):
+        """
+        Run the plan as one ALTER TABLE, trying each of `algorithms` in turn, then call
+        invalidate(table) once the change is committed.
+        Returns: the name of the algorithm used, or None when the plan is empty or none of
+        `algorithms` is supported for it (only possible without the DEFAULT fallback).
+        """
+        if not self.clauses:
+            return None
+        engine = engine or get_db_connection()
+        if not engine:
+            raise RuntimeError("Database connection failed")
+        for name, options in algorithms:
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(self.statement(options)), self.params)
+            except Exception as e:
+                if options and _unsupported(e):
+                    logger.debug(f"ALGORITHM {name} not supported for {self.describe()}: {str(e)}")
+                    continue
+                raise
+            logger.info(f"{self.describe()} (ALGORITHM {name})")
+            invalidate(self.table_name)
+            return name
+        return None
+
+
+def alter_job(plan, message, invalidate=schema_catalog.invalidate, progress=None):
+    """Job function around AlterPlan.apply(). Returns the (category, message) result."""
+    if progress is not None:
+        progress(stage=f"Altering {plan.table_name}: {'; '.join(plan.descriptions)}")
+    algorithm = plan.apply(invalidate=invalidate)
+    return [("success", f"{message} (ALGORITHM {algorithm})")]
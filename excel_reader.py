@@ -0,0 +1,195 @@
+import os
+import pandas as pd
+from utils import logger
+
+# Rows per DataFrame yielded by iter_chunks() (and per CSV chunk in the uploader); peak memory
+# of an Excel ingest is about one chunk rather than the whole sheet
+CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', 20000))
+
+
+def excel_engine(file_name):
+    """pandas engine for an Excel file: pyxlsb for .xlsb, pandas' default otherwise."""
+    return 'pyxlsb' if str(file_name).lower().endswith('.xlsb') else None
+
+
+def _cell_value(value):
+    # pandas' Excel readers turn whole floats into ints; cells and header labels follow suit
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _header_labels(values):
+    """Column labels pd.read_excel(header=0) gives for a header row: 'Unnamed: n' for blanks, '.n' on repeats."""
+    values = list(values)
+    while values and (values[-1] is None or values[-1] == ''):
+        values.pop()
+    labels = []
+    seen = {}
+    for i, value in enumerate(values):
+        label = f"Unnamed: {i}" if value is None or value == '' else str(_cell_value(value))
+        if label in seen:
+            seen[label] += 1
+            label = f"{label}.{seen[label]}"
+        else:
+            seen[label] = 0
+        labels.append(label)
+    return labels
+
+
+def _file_name(source):
+    # Uploaded files (werkzeug FileStorage) are read in place; their name gives the format
+    return str(getattr(source, 'filename', source)).lower()
+
+
+def _is_xlsb(source):
+    return _file_name(source).endswith('.xlsb')
+
+
+def _is_xls(source):
+    return _file_name(source).endswith('.xls')
+
+
+def sheet_names(file_path):
+    """Sheet names of a workbook, without loading any cells."""
+    if _is_xlsb(file_path):
+        from pyxlsb import open_workbook
+        with open_workbook(file_path) as workbook:
+            return list(workbook.sheets)
+    if _is_xls(file_path):
+        return pd.ExcelFile(file_path).sheet_names
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def iter_sheet_headers(file_path, sheets):
+    """
+    Yield (sheet_name, header labels) for each of `sheets` in order, reading only the first
+    row of each (openpyxl read-only mode / pyxlsb's row stream). The workbook stays open
+    until the generator is exhausted or closed, so stopping at the first match is cheap.
+    Sheets that can't be read yield None for their headers.
+    """
+    if _is_xls(file_path):
+        # xlrd has no streaming mode; nrows=0 still skips building the DataFrame
+        for sheet in sheets:
+            try:
+                headers = [str(c) for c in pd.read_excel(file_path, sheet_name=sheet, nrows=0).columns]
+            except Exception as e:
+                logger.warning(f"Error reading header of sheet {sheet} in {file_path}: {str(e)}")
+                headers = None
+            yield sheet, headers
+        return
+
+    if _is_xlsb(file_path):
+        from pyxlsb import open_workbook
+        with open_workbook(file_path) as workbook:
+            for sheet in sheets:
+                try:
+                    with workbook.get_sheet(sheet) as worksheet:
+                        first_row = next(iter(worksheet.rows()), [])
+                        headers = _header_labels(cell.v for cell in first_row)
+                except Exception as e:
+                    logger.warning(f"Error reading header of sheet {sheet} in {file_path}: {str(e)}")
+                    headers = None
+                yield sheet, headers
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in sheets:
+            try:
+                first_row = next(workbook[sheet].iter_rows(min_row=1, max_row=1, values_only=True), ())
+                headers = _header_labels(first_row)
+            except Exception as e:
+                logger.warning(f"Error reading header of sheet {sheet} in {file_path}: {str(e)}")
+                headers = None
+            yield sheet, headers
+    finally:
+        workbook.close()
+
+
+def _iter_rows(source, sheet_name=None):
+    """Raw cell values of a sheet (the first sheet by default), one list per row, streamed."""
+    if _is_xls(source):
+        # xlrd has no streaming mode: the sheet is parsed in one go, then handed out row by row
+        frame = pd.read_excel(source, sheet_name=sheet_name or 0, header=None, keep_default_na=False)
+        for row in frame.itertuples(index=False, name=None):
+            yield list(row)
+        return
+
+    if _is_xlsb(source):
+        from pyxlsb import open_workbook
+        with open_workbook(source) as workbook:
+            with workbook.get_sheet(sheet_name or 1) as worksheet:
+                for row in worksheet.rows(sparse=True):
+                    values = [None] * (max((cell.c for cell in row), default=-1) + 1)
+                    for cell in row:
+                        values[cell.c] = cell.v
+                    yield values
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        for row in worksheet.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _frame(rows, labels, width):
+    columns = list(labels) + [f"Unnamed: {i}" for i in range(len(labels), width)]
+    return pd.DataFrame([row + [''] * (width - len(row)) for row in rows], columns=columns)
+
+
+def iter_chunks(source, sheet_name=None, chunk_rows=CHUNK_ROWS, columns=None):
+    """
+    Stream a sheet (the first by default) of an .xlsx (openpyxl read-only), .xlsb (pyxlsb) or
+    .xls workbook as DataFrames of at most `chunk_rows` rows, so no more than one chunk of cells
+    is held at a time. `source` is a path or an uploaded file. The first row is the header,
+    labelled as pd.read_excel(header=0) would; cells keep their workbook types (numbers,
+    datetimes, text), blank cells are '' and blank rows are skipped, as the uploader's
+    read_excel(keep_default_na=False) gave them. With `columns`, only those labels (of the
+    ones present) are kept. At least one DataFrame is always yielded.
+    """
+    rows = _iter_rows(source, sheet_name)
+    try:
+        labels = _header_labels(next(rows, []))
+        keep = None
+        if columns is not None:
+            wanted = set(columns)
+            keep = [i for i, label in enumerate(labels) if label in wanted]
+            labels = [labels[i] for i in keep]
+        width = len(labels)
+        chunk = []
+        yielded = False
+        for row in rows:
+            values = ['' if value is None else _cell_value(value) for value in row]
+            if all(value == '' for value in values):
+                continue
+            if keep is not None:
+                values = [values[i] if i < len(values) else '' for i in keep]
+            else:
+                while values and values[-1] == '':
+                    values.pop()
+                width = max(width, len(values))
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                yield _frame(chunk, labels, width)
+                yielded = True
+                chunk = []
+        if chunk or not yielded:
+            yield _frame(chunk, labels, width)
+    finally:
+        rows.close()
+
+
+def read_frame(source, sheet_name=None, columns=None):
+    """A whole sheet as one DataFrame, built chunk by chunk from iter_chunks()."""
+    return pd.concat(list(iter_chunks(source, sheet_name, columns=columns)), ignore_index=True)
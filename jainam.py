@@ -7,8 +7,13 @@ import logging
 from io import StringIO
 import csv
 import math
+import hashlib
 from utils import get_db_connection, logger
-from auth import Auth
+from queries import attach_round_trip_counter, get_round_trips, QueryBuilder, explain_plan, cached_text
+from migrations import migration, apply_migrations, column_exists, create_index, index_exists
+from search_index import search_condition
+from batch_writer import coerce_frame, frame_to_records, insert_records, summarize_warnings
+import excel_reader
 from sqlalchemy import text
 # from dotenv import load_dotenv
 # import os
@@ -32,6 +37,13 @@ if not hasattr(jainam_bp, 'registered'):
     if not db_engine:
         logger.error("Failed to initialize database connection. Exiting...")
         raise RuntimeError("Database connection failed")
+    attach_round_trip_counter(db_engine)
+
+    # Column types for bulk jainam uploads
+    JAINAM_COLUMN_TYPES = {
+        'user_id': 'str', 'alias': 'str', 'MTM': 'float', 'allocation': 'float', 'max_loss': 'float',
+        'server': 'str', 'date': 'date', 'broker': 'str', 'algo': 'str'
+    }
 
     # Admin access decorator
     def admin_required(f):
@@ -48,186 +60,179 @@ if not hasattr(jainam_bp, 'registered'):
             return f(*args, **kwargs)
         return decorated_function
 
-    # Check and update schema
-    def check_and_update_schema():
-        connection = None
-        try:
-            connection = db_engine.connect()
-            trans = connection.begin()
+    # Versioned schema migrations for the jainam blueprint (tracked in schema_version)
+    @migration('jainam', 1, 'Base jainam, partner_distributions and user_partner_data schema')
+    def migrate_base_schema(connection):
+        # Step 1: Create jainam table first (required for foreign key references)
+        result = connection.execute(text("SHOW TABLES LIKE 'jainam'")).fetchone()
+        if not result:
+            logger.info("Creating jainam table")
+            connection.execute(text("""
+                CREATE TABLE jainam (
+                    row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    user_id VARCHAR(255) NOT NULL,
+                    alias VARCHAR(50),
+                    MTM DECIMAL(15,2),
+                    allocation DECIMAL(15,2),
+                    max_loss DECIMAL(15,2),
+                    server VARCHAR(255),
+                    date DATE,
+                    broker VARCHAR(50),
+                    algo VARCHAR(255),
+                    INDEX idx_jainam_user_id (user_id)
+                ) ENGINE=InnoDB
+            """))
+            logger.info("Jainam table created successfully")
+
+        # Step 2: Create partner_distributions table
+        result = connection.execute(text("SHOW TABLES LIKE 'partner_distributions'")).fetchone()
+        if not result:
+            logger.info("Creating partner_distributions table")
+            connection.execute(text("""
+                CREATE TABLE partner_distributions (
+                    row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    user_id VARCHAR(255),
+                    alias VARCHAR(50),
+                    allocation DECIMAL(15,2),
+                    calculated_mtm DECIMAL(15,2),
+                    max_loss DECIMAL(15,2),
+                    FOREIGN KEY fk_user_id (user_id) REFERENCES jainam(user_id)
+                ) ENGINE=InnoDB
+            """))
+            logger.info("Partner_distributions table created successfully")
+
+        # Step 3: Create user_partner_data table
+        result = connection.execute(text("SHOW TABLES LIKE 'user_partner_data'")).fetchone()
+        if not result:
+            logger.info("Creating user_partner_data table")
+            connection.execute(text("""
+                CREATE TABLE user_partner_data (
+                    row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                    user_id VARCHAR(255),
+                    alias VARCHAR(50),
+                    allocation DECIMAL(15,2),
+                    mtm DECIMAL(15,2),
+                    max_loss DECIMAL(15,2),
+                    is_main BOOLEAN NOT NULL DEFAULT FALSE,
+                    date DATE,
+                    broker VARCHAR(50),
+                    algo VARCHAR(255),
+                    FOREIGN KEY fk_user_id (user_id) REFERENCES jainam(user_id)
+                ) ENGINE=InnoDB
+            """))
+            logger.info("User_partner_data table created successfully")
+
+        # Step 4: Check and update columns for all tables
+        tables = ['jainam', 'partner_distributions', 'user_partner_data']
+        for table_name in tables:
+            columns_result = connection.execute(text(f"SHOW COLUMNS FROM {table_name}")).fetchall()
+            columns = {col[0]: col for col in columns_result}
             
-            # Step 1: Create jainam table first (required for foreign key references)
-            result = connection.execute(text("SHOW TABLES LIKE 'jainam'")).fetchone()
-            if not result:
-                logger.info("Creating jainam table")
-                connection.execute(text("""
-                    CREATE TABLE jainam (
-                        row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                        user_id VARCHAR(255) NOT NULL,
-                        alias VARCHAR(50),
-                        MTM DECIMAL(15,2),
-                        allocation DECIMAL(15,2),
-                        max_loss DECIMAL(15,2),
-                        server VARCHAR(255),
-                        date DATE,
-                        broker VARCHAR(50),
-                        algo VARCHAR(255),
-                        INDEX idx_jainam_user_id (user_id)
-                    ) ENGINE=InnoDB
+            if 'row_id' not in columns:
+                logger.info(f"Adding row_id column to {table_name}")
+                try:
+                    connection.execute(text(f"ALTER TABLE {table_name} DROP PRIMARY KEY"))
+                except Exception as e:
+                    logger.warning(f"No primary key to drop in {table_name}: {e}")
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST"))
+
+            elif 'id' in columns:
+                logger.info(f"Renaming id to row_id in {table_name}")
+                connection.execute(text(f"ALTER TABLE {table_name} CHANGE id row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY"))
+
+            connection.execute(text(f"ALTER TABLE {table_name} AUTO_INCREMENT = 1"))
+
+            if table_name == 'jainam':
+                # Drop old unique constraint if it exists
+                result = connection.execute(text("SHOW INDEX FROM jainam WHERE Key_name = 'uq_user_id_date'")).fetchone()
+                if result:
+                    logger.info("Dropping unique constraint uq_user_id_date from jainam")
+                    connection.execute(text("ALTER TABLE jainam DROP INDEX uq_user_id_date"))
+
+                # Ensure non-unique index on user_id
+                result = connection.execute(text("SHOW INDEX FROM jainam WHERE Key_name = 'idx_jainam_user_id'")).fetchone()
+                if not result:
+                    logger.info("Adding non-unique index on user_id in jainam")
+                    connection.execute(text("CREATE INDEX idx_jainam_user_id ON jainam (user_id)"))
+
+                # Add algo column if missing
+                if 'algo' not in columns:
+                    logger.info("Adding algo column to jainam")
+                    connection.execute(text("ALTER TABLE jainam ADD COLUMN algo VARCHAR(255)"))
+
+                # Add max_loss column if missing
+                if 'max_loss' not in columns:
+                    logger.info("Adding max_loss column to jainam")
+                    connection.execute(text("ALTER TABLE jainam ADD COLUMN max_loss DECIMAL(15,2)"))
+
+            if table_name == 'partner_distributions':
+                # Add max_loss column if missing
+                if 'max_loss' not in columns:
+                    logger.info("Adding max_loss column to partner_distributions")
+                    connection.execute(text("ALTER TABLE partner_distributions ADD COLUMN max_loss DECIMAL(15,2)"))
+
+                # Ensure foreign key constraint
+                create_table = connection.execute(text(f"SHOW CREATE TABLE {table_name}")).fetchone()[1]
+                has_user_id_fk = any('FOREIGN KEY' in line and 'user_id' in line for line in create_table.split('\n'))
+                if not has_user_id_fk:
+                    logger.info(f"Adding foreign key on user_id in {table_name}")
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_user_id FOREIGN KEY (user_id) REFERENCES jainam(user_id)"))
+
+            if table_name == 'user_partner_data':
+                # Rename algorithm to algo if it exists
+                if 'algorithm' in columns and 'algo' not in columns:
+                    logger.info("Renaming algorithm to algo in user_partner_data")
+                    connection.execute(text("ALTER TABLE user_partner_data CHANGE algorithm algo VARCHAR(255)"))
+
+                # Add algo column if missing
+                if 'algo' not in columns:
+                    logger.info("Adding algo column to user_partner_data")
+                    connection.execute(text("ALTER TABLE user_partner_data ADD COLUMN algo VARCHAR(255)"))
+
+                # Ensure foreign key constraint
+                create_table = connection.execute(text(f"SHOW CREATE TABLE {table_name}")).fetchone()[1]
+                has_user_id_fk = any('FOREIGN KEY' in line and 'user_id' in line for line in create_table.split('\n'))
+                if not has_user_id_fk:
+                    logger.info(f"Adding foreign key on user_id in {table_name}")
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_user_id FOREIGN KEY (user_id) REFERENCES jainam(user_id)"))
+
+    @migration('jainam', 2, 'is_jainam flag and composite indexes for the jainam/partner access paths')
+    def migrate_access_path_indexes(connection):
+        brokers_sql = ", ".join(f"'{broker}'" for broker in JAINAM_BROKERS)
+        scope_query = f"SELECT user_id, date FROM jainam WHERE (broker IN ({brokers_sql}) OR user_id LIKE '%MEGASERV%') AND date = CURDATE()"
+        for row in explain_plan(connection, scope_query):
+            logger.info(f"EXPLAIN before (jainam scope): type={row.get('type')} key={row.get('key')} rows={row.get('rows')}")
+
+        # Persisted flag for the broker/MEGASERV scope so it becomes an indexed equality
+        for table_name in ['jainam', 'user_partner_data']:
+            if not column_exists(connection, table_name, 'is_jainam'):
+                logger.info(f"Adding generated is_jainam column to {table_name}")
+                connection.execute(text(f"""
+                    ALTER TABLE {table_name} ADD COLUMN is_jainam TINYINT(1)
+                    AS (COALESCE(broker IN ({brokers_sql}), 0) OR COALESCE(user_id LIKE '%MEGASERV%', 0)) STORED NOT NULL
                 """))
-                trans.commit()
-                logger.info("Jainam table created successfully")
-                trans = connection.begin()
 
-            # Step 2: Create partner_distributions table
-            result = connection.execute(text("SHOW TABLES LIKE 'partner_distributions'")).fetchone()
-            if not result:
-                logger.info("Creating partner_distributions table")
-                connection.execute(text("""
-                    CREATE TABLE partner_distributions (
-                        row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                        user_id VARCHAR(255),
-                        alias VARCHAR(50),
-                        allocation DECIMAL(15,2),
-                        calculated_mtm DECIMAL(15,2),
-                        max_loss DECIMAL(15,2),
-                        FOREIGN KEY fk_user_id (user_id) REFERENCES jainam(user_id)
-                    ) ENGINE=InnoDB
-                """))
-                trans.commit()
-                logger.info("Partner_distributions table created successfully")
-                trans = connection.begin()
+        create_index(connection, 'jainam', 'idx_jainam_scope_date_user', ['is_jainam', 'date', 'user_id'])
+        create_index(connection, 'jainam', 'idx_jainam_user_date', ['user_id', 'date'])
+        create_index(connection, 'user_partner_data', 'idx_upd_user_date_main_broker', ['user_id', 'date', 'is_main', 'broker'])
+        create_index(connection, 'user_partner_data', 'idx_upd_main_broker_date', ['is_main', 'broker', 'date'])
+        create_index(connection, 'user_partner_data', 'idx_upd_alias_scope_date', ['alias', 'is_jainam', 'date'])
+        create_index(connection, 'partner_distributions', 'idx_pd_user_alias', ['user_id', 'alias'])
 
-            # Step 3: Create user_partner_data table
-            result = connection.execute(text("SHOW TABLES LIKE 'user_partner_data'")).fetchone()
-            if not result:
-                logger.info("Creating user_partner_data table")
-                connection.execute(text("""
-                    CREATE TABLE user_partner_data (
-                        row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                        user_id VARCHAR(255),
-                        alias VARCHAR(50),
-                        allocation DECIMAL(15,2),
-                        mtm DECIMAL(15,2),
-                        max_loss DECIMAL(15,2),
-                        is_main BOOLEAN NOT NULL DEFAULT FALSE,
-                        date DATE,
-                        broker VARCHAR(50),
-                        algo VARCHAR(255),
-                        FOREIGN KEY fk_user_id (user_id) REFERENCES jainam(user_id)
-                    ) ENGINE=InnoDB
-                """))
-                trans.commit()
-                logger.info("User_partner_data table created successfully")
-                trans = connection.begin()
-
-            # Step 4: Check and update columns for all tables
-            tables = ['jainam', 'partner_distributions', 'user_partner_data']
-            for table_name in tables:
-                columns_result = connection.execute(text(f"SHOW COLUMNS FROM {table_name}")).fetchall()
-                columns = {col[0]: col for col in columns_result}
-                
-                if 'row_id' not in columns:
-                    logger.info(f"Adding row_id column to {table_name}")
-                    try:
-                        connection.execute(text(f"ALTER TABLE {table_name} DROP PRIMARY KEY"))
-                    except Exception as e:
-                        logger.warning(f"No primary key to drop in {table_name}: {e}")
-                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST"))
-                    trans.commit()
-                    trans = connection.begin()
-
-                elif 'id' in columns:
-                    logger.info(f"Renaming id to row_id in {table_name}")
-                    connection.execute(text(f"ALTER TABLE {table_name} CHANGE id row_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY"))
-                    trans.commit()
-                    trans = connection.begin()
-
-                connection.execute(text(f"ALTER TABLE {table_name} AUTO_INCREMENT = 1"))
-                trans.commit()
-                trans = connection.begin()
-
-                if table_name == 'jainam':
-                    # Drop old unique constraint if it exists
-                    result = connection.execute(text("SHOW INDEX FROM jainam WHERE Key_name = 'uq_user_id_date'")).fetchone()
-                    if result:
-                        logger.info("Dropping unique constraint uq_user_id_date from jainam")
-                        connection.execute(text("ALTER TABLE jainam DROP INDEX uq_user_id_date"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Ensure non-unique index on user_id
-                    result = connection.execute(text("SHOW INDEX FROM jainam WHERE Key_name = 'idx_jainam_user_id'")).fetchone()
-                    if not result:
-                        logger.info("Adding non-unique index on user_id in jainam")
-                        connection.execute(text("CREATE INDEX idx_jainam_user_id ON jainam (user_id)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Add algo column if missing
-                    if 'algo' not in columns:
-                        logger.info("Adding algo column to jainam")
-                        connection.execute(text("ALTER TABLE jainam ADD COLUMN algo VARCHAR(255)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Add max_loss column if missing
-                    if 'max_loss' not in columns:
-                        logger.info("Adding max_loss column to jainam")
-                        connection.execute(text("ALTER TABLE jainam ADD COLUMN max_loss DECIMAL(15,2)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                if table_name == 'partner_distributions':
-                    # Add max_loss column if missing
-                    if 'max_loss' not in columns:
-                        logger.info("Adding max_loss column to partner_distributions")
-                        connection.execute(text("ALTER TABLE partner_distributions ADD COLUMN max_loss DECIMAL(15,2)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Ensure foreign key constraint
-                    create_table = connection.execute(text(f"SHOW CREATE TABLE {table_name}")).fetchone()[1]
-                    has_user_id_fk = any('FOREIGN KEY' in line and 'user_id' in line for line in create_table.split('\n'))
-                    if not has_user_id_fk:
-                        logger.info(f"Adding foreign key on user_id in {table_name}")
-                        connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_user_id FOREIGN KEY (user_id) REFERENCES jainam(user_id)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                if table_name == 'user_partner_data':
-                    # Rename algorithm to algo if it exists
-                    if 'algorithm' in columns and 'algo' not in columns:
-                        logger.info("Renaming algorithm to algo in user_partner_data")
-                        connection.execute(text("ALTER TABLE user_partner_data CHANGE algorithm algo VARCHAR(255)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Add algo column if missing
-                    if 'algo' not in columns:
-                        logger.info("Adding algo column to user_partner_data")
-                        connection.execute(text("ALTER TABLE user_partner_data ADD COLUMN algo VARCHAR(255)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-                    # Ensure foreign key constraint
-                    create_table = connection.execute(text(f"SHOW CREATE TABLE {table_name}")).fetchone()[1]
-                    has_user_id_fk = any('FOREIGN KEY' in line and 'user_id' in line for line in create_table.split('\n'))
-                    if not has_user_id_fk:
-                        logger.info(f"Adding foreign key on user_id in {table_name}")
-                        connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT fk_{table_name}_user_id FOREIGN KEY (user_id) REFERENCES jainam(user_id)"))
-                        trans.commit()
-                        trans = connection.begin()
-
-            logger.info("Schema update completed successfully")
-            trans.commit()
-        except Exception as e:
-            logger.error(f"Error in check_and_update_schema: {e}")
-            if connection:
-                trans.rollback()
-            raise
-        finally:
-            if connection:
-                connection.close()
+        scope_query = "SELECT user_id, date FROM jainam WHERE is_jainam = 1 AND date = CURDATE()"
+        for row in explain_plan(connection, scope_query):
+            logger.info(f"EXPLAIN after (jainam scope): type={row.get('type')} key={row.get('key')} rows={row.get('rows')}")
+
+    @migration('jainam', 3, 'ngram FULLTEXT index for the jainam user_id/alias search')
+    def migrate_search_index(connection):
+        if not index_exists(connection, 'jainam', 'ft_search_user_alias'):
+            connection.execute(text("ALTER TABLE jainam ADD FULLTEXT INDEX ft_search_user_alias (user_id, alias) WITH PARSER ngram"))
+            logger.info("Created FULLTEXT index ft_search_user_alias on jainam (user_id, alias)")
+
+    # Check and update schema
+    def check_and_update_schema():
+        applied = apply_migrations(db_engine, 'jainam')
+        logger.info(f"Schema update completed successfully ({len(applied)} migration(s) applied)")
 
     # Error handler for 405
     @jainam_bp.errorhandler(405)
@@ -236,13 +241,64 @@ if not hasattr(jainam_bp, 'registered'):
         flash(f"Method {request.method} not allowed.", 'error')
         return render_template('jainam/index.html', jainam=(), default_start_date='', default_end_date='', page=1, total_pages=1, rows_per_page=50), 405
 
+    # Jainam rows are those booked with one of the Jainam brokers or belonging to a MEGASERV user
+    JAINAM_BROKERS = ['JAINAM_CTRADE_DL', 'SREDJAINAM_CTRADE', 'SREDJAINAM_103', 'SREDJAINAM2_P', 'ACHINTYA']
+
+    def jainam_scope(table='jainam'):
+        """
+        QueryBuilder over `table` restricted to the Jainam brokers or MEGASERV user ids,
+        via the persisted is_jainam flag (see migration jainam v2).
+        """
+        return QueryBuilder(table).where("is_jainam = 1")
+
+    def apply_filters(builder, filters):
+        """Apply (condition, params) pairs from parse_jainam_filters to a builder."""
+        for condition, params in filters:
+            builder.where(condition, **params)
+        return builder
+
+    def parse_jainam_filters(user_id='', date_filter='', start_date='', end_date='', search=''):
+        """
+        Validate the request filters once for every query of a route.
+        Returns: (filters, errors, date_filter, start_date, end_date) where filters are
+        (condition, params) pairs for apply_filters() and invalid dates are cleared.
+        """
+        filters = []
+        errors = []
+        if search:
+            filters.append(search_condition('jainam', ['user_id', 'alias'], 'search', search))
+        if user_id:
+            filters.append(("user_id = :user_id", {'user_id': user_id}))
+        if date_filter:
+            try:
+                datetime.strptime(date_filter, '%Y-%m-%d')
+                filters.append(("date = :date_filter", {'date_filter': date_filter}))
+            except ValueError:
+                logger.error(f"Invalid date filter: {date_filter}")
+                errors.append('Invalid date format for single date. Please use YYYY-MM-DD.')
+                date_filter = None
+        if start_date and end_date and not date_filter:
+            try:
+                start_date_dt = datetime.strptime(str(start_date), '%Y-%m-%d').date()
+                end_date_dt = datetime.strptime(str(end_date), '%Y-%m-%d').date()
+                if start_date_dt > end_date_dt:
+                    errors.append('Start date cannot be after end date.')
+                    start_date, end_date = None, None
+                else:
+                    filters.append(("date BETWEEN :start_date AND :end_date", {'start_date': start_date_dt, 'end_date': end_date_dt}))
+                    logger.info(f"Applied date range filter: {start_date} to {end_date}")
+            except ValueError:
+                logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
+                errors.append('Invalid date format for range. Please use YYYY-MM-DD.')
+                start_date, end_date = None, None
+        return filters, errors, date_filter, start_date, end_date
+
     def get_latest_date_range():
         connection = None
         try:
             connection = db_engine.connect()
-            query = text("SELECT MIN(date), MAX(date) FROM jainam WHERE broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-            date_range = connection.execute(query, params).fetchone()
+            builder = jainam_scope()
+            date_range = connection.execute(builder.select("MIN(date), MAX(date)"), builder.bind()).fetchone()
             min_date, max_date = date_range[0], date_range[1]
             if max_date:
                 logger.info(f"Date range found: min={min_date}, max={max_date}")
@@ -256,15 +312,41 @@ if not hasattr(jainam_bp, 'registered'):
             if connection:
                 connection.close()
 
+    # Cached COUNT(*) results for the dashboard. Keys carry a generation number that is
+    # bumped on every write to jainam/user_partner_data, so stale counts are never reused.
+    COUNT_CACHE_TIMEOUT = 300
+
+    def invalidate_dashboard_counts():
+        cache = getattr(jainam_bp, 'cache', None)
+        if cache is None:
+            return
+        try:
+            # Atomic on the shared backend, so concurrent uploads in other workers can't lose a bump
+            cache.cache.inc('jainam_count_generation')
+        except Exception as e:
+            logger.warning(f"Failed to invalidate dashboard counts: {e}")
+
+    def get_cached_count(connection, count_query, params):
+        cache = getattr(jainam_bp, 'cache', None)
+        if cache is None:
+            return connection.execute(count_query, params).fetchone()._mapping['total']
+        generation = cache.get('jainam_count_generation') or 0
+        digest = hashlib.md5(f"{count_query}|{sorted((k, str(v)) for k, v in params.items())}".encode()).hexdigest()
+        cache_key = f"jainam_count:{generation}:{digest}"
+        total = cache.get(cache_key)
+        if total is None:
+            total = connection.execute(count_query, params).fetchone()._mapping['total']
+            cache.set(cache_key, total, timeout=COUNT_CACHE_TIMEOUT)
+        return total
+
     @jainam_bp.route('/user_ids', methods=['GET'])
     @admin_required
     def get_user_ids():
         connection = None
         try:
             connection = db_engine.connect()
-            query = text("SELECT DISTINCT user_id FROM jainam WHERE broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u ORDER BY user_id")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-            result = connection.execute(query, params).fetchall()
+            builder = jainam_scope()
+            result = connection.execute(builder.distinct("user_id", order_by="user_id"), builder.bind()).fetchall()
             user_ids = [row._mapping['user_id'] for row in result]
             return jsonify({'user_ids': user_ids})
         except Exception as e:
@@ -311,55 +393,48 @@ if not hasattr(jainam_bp, 'registered'):
                 flash('Please upload an Excel file (.xlsx or .xls)', 'error')
                 return redirect(url_for('jainam.index', start_date=start_date or default_start_date, end_date=end_date or default_end_date, date=date_filter, rows_per_page=rows_per_page, page=1))
             connection = None
+            trans = None
             try:
-                df = pd.read_excel(file)
                 allowed_columns = ['user_id', 'alias', 'MTM', 'allocation', 'max_loss', 'server', 'date', 'broker', 'algo']
-                existing_columns = [col for col in allowed_columns if col in df.columns]
-                if not existing_columns:
-                    flash('No valid columns found in the uploaded file', 'error')
-                    return redirect(url_for('jainam.index', start_date=start_date or default_start_date, end_date=end_date or default_end_date, date=date_filter, rows_per_page=rows_per_page, page=1))
-                df = df[existing_columns]
-                
-                connection = db_engine.connect()
-                trans = connection.begin()
-                for _, row in df.iterrows():
-                    date_val = None
-                    if 'date' in row and pd.notna(row['date']):
-                        try:
-                            date_val = pd.to_datetime(row['date'], errors='coerce').date()
-                            if date_val is None:
-                                logger.warning(f"Invalid date format in row: {row.to_dict()}")
-                                continue
-                        except Exception as e:
-                            logger.warning(f"Error parsing date {row['date']}: {e}")
+                # Streamed in chunks of the allowed columns; all chunks go in one transaction
+                chunks = excel_reader.iter_chunks(file, columns=allowed_columns)
+                inserted = 0
+                row_warnings = []
+                first_row_number = 2
+                try:
+                    for df in chunks:
+                        if not len(df.columns):
+                            flash('No valid columns found in the uploaded file', 'error')
+                            return redirect(url_for('jainam.index', start_date=start_date or default_start_date, end_date=end_date or default_end_date, date=date_filter, rows_per_page=rows_per_page, page=1))
+                        rows = len(df)
+                        df, chunk_warnings = coerce_frame(df, JAINAM_COLUMN_TYPES, required=['user_id'], first_row_number=first_row_number)
+                        first_row_number += rows
+                        for warning in chunk_warnings:
+                            logger.warning(f"Jainam upload {file.filename}: {warning}")
+                        row_warnings.extend(chunk_warnings)
+                        if df.empty:
                             continue
-                    user_id_val = str(row.get('user_id', '')).strip()
-                    if not user_id_val:
-                        logger.warning(f"Skipping row with empty user_id: {row.to_dict()}")
-                        continue
 
-                    insert_query = text("""
-                        INSERT INTO jainam (user_id, alias, MTM, allocation, max_loss, server, date, broker, algo)
-                        VALUES (:user_id, :alias, :MTM, :allocation, :max_loss, :server, :date, :broker, :algo)
-                    """)
-                    values = {
-                        'user_id': user_id_val,
-                        'alias': row.get('alias', '') or None,
-                        'MTM': float(row.get('MTM', 0)) if pd.notna(row.get('MTM')) else None,
-                        'allocation': float(row.get('allocation', 0)) if pd.notna(row.get('allocation')) else None,
-                        'max_loss': float(row.get('max_loss', 0)) if pd.notna(row.get('max_loss')) else None,
-                        'server': row.get('server', '') or None,
-                        'date': date_val,
-                        'broker': row.get('broker', '') or None,
-                        'algo': str(row.get('algo', '')) or None
-                    }
-                    connection.execute(insert_query, values)
-                
+                        if connection is None:
+                            connection = db_engine.connect()
+                            trans = connection.begin()
+                        inserted += insert_records(connection, 'jainam', allowed_columns, frame_to_records(df, allowed_columns))
+                finally:
+                    chunks.close()
+                if connection is None:
+                    if row_warnings:
+                        flash(summarize_warnings(row_warnings), 'warning')
+                    flash('No rows to import in the uploaded file', 'warning')
+                    return redirect(url_for('jainam.index', start_date=start_date or default_start_date, end_date=end_date or default_end_date, date=date_filter, rows_per_page=rows_per_page, page=1))
                 trans.commit()
+                invalidate_dashboard_counts()
+                logger.info(f"Jainam upload {file.filename}: inserted {inserted} rows, {len(row_warnings)} warnings")
+                if row_warnings:
+                    flash(summarize_warnings(row_warnings), 'warning')
                 flash('File uploaded successfully, data appended', 'success')
                 return redirect(url_for('jainam.index', start_date=start_date or default_start_date, end_date=end_date or default_end_date, date=date_filter, rows_per_page=rows_per_page, page=1))
             except Exception as e:
-                if connection:
+                if trans is not None and trans.is_active:
                     trans.rollback()
                 logger.error(f"Error saving to database: {e}")
                 flash(f'Error saving to database: {str(e)}', 'error')
@@ -371,45 +446,13 @@ if not hasattr(jainam_bp, 'registered'):
         connection = None
         try:
             connection = db_engine.connect()
-            query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-            
-            if search:
-                query = text(str(query) + " AND (user_id LIKE :s1 OR alias LIKE :s2)")
-                params['s1'] = f"%{search}%"
-                params['s2'] = f"%{search}%"
-            if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    query = text(str(query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            elif start_date and end_date:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                        logger.info(f"Applied date range filter: {start_date} to {end_date}")
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
+            filters, errors, date_filter, start_date, end_date = parse_jainam_filters(user_id, date_filter, start_date, end_date, search)
+            for error in errors:
+                flash(error, 'error')
+            builder = apply_filters(jainam_scope(), filters)
             
             # Count total records for pagination
-            count_query = text(str(query).replace("SELECT *", "SELECT COUNT(*) as total"))
-            total_records = connection.execute(count_query, params).fetchone()._mapping['total']
+            total_records = connection.execute(builder.count(), builder.bind()).fetchone()._mapping['total']
             total_pages = math.ceil(total_records / rows_per_page) if rows_per_page > 0 else 1
             
             if page < 1:
@@ -417,10 +460,8 @@ if not hasattr(jainam_bp, 'registered'):
             if page > total_pages:
                 page = total_pages if total_pages > 0 else 1
             
-            query = text(str(query) + " ORDER BY date DESC LIMIT :limit OFFSET :offset")
-            params['limit'] = rows_per_page
-            params['offset'] = (page - 1) * rows_per_page
-            result = connection.execute(query, params).fetchall()
+            query = builder.select(order_by="date DESC", paginate=True)
+            result = connection.execute(query, builder.bind(limit=rows_per_page, offset=(page - 1) * rows_per_page)).fetchall()
             
             for u in result:
                 u_dict = u._mapping
@@ -438,47 +479,8 @@ if not hasattr(jainam_bp, 'registered'):
                 })
             logger.info(f"Retrieved {len(jainam_records)} records for page {page}")
 
-            # Fallback query if no records
             if not jainam_records:
-                logger.warning(f"No records found for brokers {jainam_brokers} or MEGASERV with filters. Trying fallback query.")
-                query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-                params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-                if search:
-                    query = text(str(query) + " AND (user_id LIKE :s1 OR alias LIKE :s2)")
-                    params['s1'] = f"%{search}%"
-                    params['s2'] = f"%{search}%"
-                if user_id:
-                    query = text(str(query) + " AND user_id = :user_id")
-                    params['user_id'] = user_id
-                if date_filter:
-                    query = text(str(query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                elif start_date and end_date:
-                    query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                    params['start_date'] = start_date
-                    params['end_date'] = end_date
-                count_query = text(str(query).replace("SELECT *", "SELECT COUNT(*) as total"))
-                total_records = connection.execute(count_query, params).fetchone()._mapping['total']
-                total_pages = math.ceil(total_records / rows_per_page) if rows_per_page > 0 else 1
-                query = text(str(query) + " ORDER BY date DESC LIMIT :limit OFFSET :offset")
-                params['limit'] = rows_per_page
-                params['offset'] = (page - 1) * rows_per_page
-                result = connection.execute(query, params).fetchall()
-                for u in result:
-                    u_dict = u._mapping
-                    jainam_records.append({
-                        'row_id': u_dict['row_id'],
-                        'date': u_dict['date'].strftime("%Y-%m-%d") if u_dict['date'] else '',
-                        'user_id': u_dict['user_id'],
-                        'alias': u_dict['alias'] or '',
-                        'allocation': float(u_dict['allocation'] or 0),
-                        'MTM': float(u_dict['MTM'] or 0),
-                        'max_loss': float(u_dict['max_loss'] or 0),
-                        'algo': str(u_dict['algo'] or ''),
-                        'broker': u_dict['broker'] or '',
-                        'user_details_url': url_for('jainam.user_details', row_id=u_dict['row_id'])
-                    })
-                logger.info(f"Fallback query retrieved {len(jainam_records)} records")
+                logger.warning(f"No records found for brokers {jainam_brokers} or MEGASERV with filters.")
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({
@@ -537,44 +539,12 @@ if not hasattr(jainam_bp, 'registered'):
         connection = None
         try:
             connection = db_engine.connect()
-            query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-            
-            if search:
-                query = text(str(query) + " AND (user_id LIKE :s1 OR alias LIKE :s2)")
-                params['s1'] = f"%{search}%"
-                params['s2'] = f"%{search}%"
-            if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    query = text(str(query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            elif start_date and end_date:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                        logger.info(f"Applied date range filter: {start_date} to {end_date}")
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
+            filters, errors, date_filter, start_date, end_date = parse_jainam_filters(user_id, date_filter, start_date, end_date, search)
+            for error in errors:
+                flash(error, 'error')
+            builder = apply_filters(jainam_scope(), filters)
             
-            count_query = text(str(query).replace("SELECT *", "SELECT COUNT(*) as total"))
-            total_records = connection.execute(count_query, params).fetchone()._mapping['total']
+            total_records = connection.execute(builder.count(), builder.bind()).fetchone()._mapping['total']
             logger.info(f"Total Jainam records for brokers {jainam_brokers} or MEGASERV: {total_records}")
             total_pages = math.ceil(total_records / rows_per_page) if rows_per_page > 0 else 1
             
@@ -583,10 +553,8 @@ if not hasattr(jainam_bp, 'registered'):
             if page > total_pages:
                 page = total_pages if total_pages > 0 else 1
             
-            query = text(str(query) + " ORDER BY date DESC LIMIT :limit OFFSET :offset")
-            params['limit'] = rows_per_page
-            params['offset'] = (page - 1) * rows_per_page
-            result = connection.execute(query, params).fetchall()
+            query = builder.select(order_by="date DESC", paginate=True)
+            result = connection.execute(query, builder.bind(limit=rows_per_page, offset=(page - 1) * rows_per_page)).fetchall()
             
             for u in result:
                 u_dict = u._mapping
@@ -729,6 +697,8 @@ if not hasattr(jainam_bp, 'registered'):
                               {'user_id': jainam_record['user_id']})
 
             valid_aliases = {'PS', 'VT', 'GB', 'RD', 'RM'}
+            distribution_rows = []
+            partner_rows = []
             for row in partners:
                 alias = row.get('alias', '').strip()
                 if not alias or alias not in valid_aliases:
@@ -747,21 +717,14 @@ if not hasattr(jainam_bp, 'registered'):
                 calculated_mtm = alloc * mtm_ratio if alloc else 0
                 max_loss = alloc * max_loss_ratio if alloc else 0
 
-                connection.execute(text("""
-                    INSERT INTO partner_distributions (user_id, alias, allocation, calculated_mtm, max_loss)
-                    VALUES (:user_id, :alias, :allocation, :calculated_mtm, :max_loss)
-                """), {
+                distribution_rows.append({
                     'user_id': jainam_record['user_id'],
                     'alias': alias,
                     'allocation': alloc,
                     'calculated_mtm': calculated_mtm,
                     'max_loss': max_loss
                 })
-                
-                connection.execute(text("""
-                    INSERT INTO user_partner_data (user_id, alias, allocation, mtm, max_loss, date, broker, algo, is_main)
-                    VALUES (:user_id, :alias, :allocation, :mtm, :max_loss, :date, :broker, :algo, :is_main)
-                """), {
+                partner_rows.append({
                     'user_id': jainam_record['user_id'],
                     'alias': alias,
                     'allocation': alloc,
@@ -772,8 +735,12 @@ if not hasattr(jainam_bp, 'registered'):
                     'algo': jainam_record['algo'],
                     'is_main': False
                 })
+
+            insert_records(connection, 'partner_distributions', ['user_id', 'alias', 'allocation', 'calculated_mtm', 'max_loss'], distribution_rows)
+            insert_records(connection, 'user_partner_data', ['user_id', 'alias', 'allocation', 'mtm', 'max_loss', 'date', 'broker', 'algo', 'is_main'], partner_rows)
             
             trans.commit()
+            invalidate_dashboard_counts()
             
             result = connection.execute(text("SELECT * FROM user_partner_data WHERE user_id = :user_id AND date = :date AND is_main = :is_main"), 
                                       {'user_id': jainam_record['user_id'], 'date': jainam_record['date'], 'is_main': False}).fetchall()
@@ -821,6 +788,47 @@ if not hasattr(jainam_bp, 'registered'):
 
 
 
+    def aggregate_partner_stats(df):
+        """
+        Build partner_stats and algo_wise_data from the partner rows in one vectorised pass.
+        Row dicts keep the shape the dashboard JS expects; values are formatted per column.
+        """
+        partner_stats = {}
+        algo_wise_data = {}
+        if df.empty:
+            return partner_stats, algo_wise_data
+
+        for col in ['mtm', 'allocation', 'max_loss']:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+        df['algo'] = df['algo'].fillna('').astype(str)
+        df['date_str'] = pd.to_datetime(df['date'], errors='coerce').dt.strftime('%Y-%m-%d').fillna('')
+        row_columns = ['user_id', 'algo', 'mtm', 'allocation', 'max_loss', 'date']
+
+        # Partner totals: sum of each user's average allocation, and total MTM
+        user_avg_allocation = df.groupby(['alias', 'user_id'])['allocation'].mean()
+        partner_total_allocation = user_avg_allocation.groupby(level='alias').sum()
+        partner_total_mtm = df.groupby('alias')['mtm'].sum()
+
+        user_rows = df.assign(
+            mtm=df['mtm'].fillna(0), allocation=df['allocation'].fillna(0), max_loss=df['max_loss'].fillna(0)
+        )
+        positive_rows = user_rows[user_rows['allocation'] > 0].drop(columns=['date']).rename(columns={'date_str': 'date'})
+        users_by_alias = {alias: group[row_columns].to_dict('records') for alias, group in positive_rows.groupby('alias')}
+        for alias in partner_total_mtm.index:
+            partner_stats[alias] = {
+                'users': users_by_alias.get(alias, []),
+                'total_allocation': float(partner_total_allocation.get(alias, 0)),
+                'total_mtm': float(partner_total_mtm.get(alias, 0))
+            }
+
+        # Algo-wise sums per (algo, user_id, date), newest first
+        algo_sums = (user_rows.groupby(['algo', 'user_id', 'date_str'], sort=False)[['mtm', 'allocation', 'max_loss']]
+                     .sum().reset_index().rename(columns={'date_str': 'date'})
+                     .sort_values('date', ascending=False, kind='stable'))
+        for algo_name, group in algo_sums.groupby('algo', sort=False):
+            algo_wise_data[algo_name] = {'users': group[group['allocation'] > 0][row_columns].to_dict('records')}
+        return partner_stats, algo_wise_data
+
     @jainam_bp.route('/dashboard', methods=['GET'])
     @admin_required
     def dashboard():
@@ -844,41 +852,15 @@ if not hasattr(jainam_bp, 'registered'):
             default_end_date = default_end_date.strftime('%Y-%m-%d') if default_end_date else ''
 
             connection = db_engine.connect()
-            jainam_brokers = ['JAINAM_CTRADE_DL', 'SREDJAINAM_CTRADE', 'SREDJAINAM_103', 'SREDJAINAM2_P', 'ACHINTYA']
-            query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
 
-            if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    query = text(str(query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            if start_date and end_date and not date_filter:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                        logger.info(f"Applied date range filter: {start_date} to {end_date}")
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
+            # Parse the filters once; the same conditions apply to jainam and user_partner_data
+            filters, errors, date_filter, start_date, end_date = parse_jainam_filters(user_id, date_filter, start_date, end_date)
+            for error in errors:
+                flash(error, 'error')
+            builder = apply_filters(jainam_scope(), filters)
 
-            count_query = text(str(query).replace("SELECT *", "SELECT COUNT(*) as total"))
-            total_records = connection.execute(count_query, params).fetchone()._mapping['total']
+            # The grouped view has one entry per distinct (user_id, date), so count and page those keys in SQL
+            total_records = get_cached_count(connection, builder.count_distinct("user_id, date"), builder.bind())
             total_pages = math.ceil(total_records / rows_per_page) if rows_per_page > 0 else 1
 
             if page < 1:
@@ -886,185 +868,91 @@ if not hasattr(jainam_bp, 'registered'):
             if page > total_pages:
                 page = total_pages if total_pages > 0 else 1
 
-            query = text(str(query) + " ORDER BY date DESC")
-            result = connection.execute(query, params).fetchall()
-            
-            grouped_data = []
-            unique_keys = set()
-            unique_dates = set()
-            for jainam_record in result:
-                jainam_record_dict = jainam_record._mapping
-                jainam_key = (jainam_record_dict['user_id'], jainam_record_dict['date'].strftime('%Y-%m-%d') if jainam_record_dict['date'] else '')
-                if jainam_key not in unique_keys:
-                    unique_keys.add(jainam_key)
-                    if jainam_record_dict['date']:
-                        unique_dates.add(jainam_record_dict['date'].strftime('%Y-%m-%d'))
-                    main_data = {
-                        'row_id': jainam_record_dict['row_id'],
-                        'user_id': jainam_record_dict['user_id'],
-                        'alias': jainam_record_dict['alias'] or '',
-                        'allocation': float(jainam_record_dict['allocation'] or 0),
-                        'mtm': float(jainam_record_dict['MTM'] or 0),
-                        'max_loss': float(jainam_record_dict['max_loss'] or 0),
-                        'partner_alias': '',
-                        'partner_allocation': 0,
-                        'partner_mtm': 0,
-                        'partner_max_loss': 0,
-                        'is_main': True,
-                        'date': jainam_record_dict['date'].strftime('%Y-%m-%d') if jainam_record_dict['date'] else '',
-                        'broker': jainam_record_dict['broker'] or '',
-                        'algo': str(jainam_record_dict['algo'] or ''),
-                        'user_details_url': url_for('jainam.user_details', row_id=jainam_record_dict['row_id'])
-                    }
-                    partner_query = text("SELECT * FROM user_partner_data WHERE user_id = :user_id AND date = :date AND is_main = :is_main AND broker IN (:b1, :b2, :b3, :b4, :b5)")
-                    partner_params = {'user_id': jainam_record_dict['user_id'], 'date': jainam_record_dict['date'], 'is_main': False, 
-                                    'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA'}
-                    if partner:
-                        partner_query = text(str(partner_query) + " AND alias = :partner")
-                        partner_params['partner'] = partner
-                    partner_query = text(str(partner_query) + " ORDER BY alias")
-                    partners_data = [
-                        {
-                            'row_id': partner._mapping['row_id'],
-                            'user_id': partner._mapping['user_id'],
-                            'alias': partner._mapping['alias'] or '',
-                            'allocation': float(partner._mapping['allocation'] or 0),
-                            'mtm': float(partner._mapping['mtm'] or 0),
-                            'max_loss': float(partner._mapping['max_loss'] or 0),
-                            'partner_alias': partner._mapping['alias'] or '',
-                            'partner_allocation': float(partner._mapping['allocation'] or 0),
-                            'partner_mtm': float(partner._mapping['mtm'] or 0),
-                            'partner_max_loss': float(partner._mapping['max_loss'] or 0),
-                            'is_main': False,
-                            'date': partner._mapping['date'].strftime('%Y-%m-%d') if partner._mapping['date'] else '',
-                            'broker': partner._mapping['broker'] or '',
-                            'algo': str(partner._mapping['algo'] or ''),
-                            'user_details_url': url_for('jainam.user_details', row_id=partner._mapping['row_id'])
-                        } for partner in connection.execute(partner_query, partner_params).fetchall() if float(partner._mapping['allocation'] or 0) > 0
-                    ]
-                    grouped_data.append({
-                        'main': main_data,
-                        'partners': partners_data
-                    })
-
-            unique_dates = sorted(list(unique_dates), reverse=True)
-
-            start_idx = (page - 1) * rows_per_page
-            end_idx = start_idx + rows_per_page
-            grouped_data = grouped_data[start_idx:end_idx]
-
-            # Partner stats query with average allocation per user_id
-            partner_query = text("""
-                SELECT alias, algo, user_id, date, mtm, allocation, max_loss
-                FROM user_partner_data 
-                WHERE is_main = :is_main AND broker IN (:b1, :b2, :b3, :b4, :b5)
+            unique_dates = [row[0].strftime('%Y-%m-%d') for row in connection.execute(builder.distinct("date", order_by="date DESC"), builder.bind()).fetchall() if row[0]]
+
+            # One representative jainam row per key for the requested page only
+            page_keys_query = builder.subquery("MIN(row_id) AS row_id, user_id, date", group_by="user_id, date",
+                                               order_by="date DESC, user_id", paginate=True)
+            page_params = builder.bind(limit=rows_per_page, offset=(page - 1) * rows_per_page, is_main=False)
+            page_query = builder.statement(f"""
+                SELECT j.* FROM jainam j
+                JOIN ({page_keys_query}) k ON j.row_id = k.row_id
+                ORDER BY j.date DESC, j.user_id
             """)
-            partner_params = {'is_main': False, 'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA'}
+            result = connection.execute(page_query, page_params).fetchall()
+
+            # Partner rows for the same page of keys in one round trip, grouped in memory
+            partner_page_sql = f"""
+                SELECT p.* FROM user_partner_data p
+                JOIN ({page_keys_query}) k ON p.user_id = k.user_id AND p.date = k.date
+                WHERE p.is_main = :is_main AND p.broker IN :brokers
+            """
+            partner_page_params = dict(page_params, brokers=JAINAM_BROKERS)
             if partner:
-                partner_query = text(str(partner_query) + " AND alias = :partner")
-                partner_params['partner'] = partner
-            if user_id:
-                partner_query = text(str(partner_query) + " AND user_id = :user_id")
-                partner_params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    partner_query = text(str(partner_query) + " AND date = :date_filter")
-                    partner_params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter for partner stats: {date_filter}")
-                    date_filter = None
-            if start_date and end_date and not date_filter:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt <= end_date_dt:
-                        partner_query = text(str(partner_query) + " AND date BETWEEN :start_date AND :end_date")
-                        partner_params['start_date'] = start_date_dt
-                        partner_params['end_date'] = end_date_dt
-                except ValueError:
-                    logger.error(f"Invalid date range for partner stats: start_date={start_date}, end_date={end_date}")
-                    start_date, end_date = None, None
+                partner_page_sql += " AND p.alias = :partner"
+                partner_page_params['partner'] = partner
+            partner_page_sql += " ORDER BY p.alias"
+            partner_page_query = cached_text(partner_page_sql, tuple(builder.expanding) + ('brokers',))
+            partners_by_key = {}
+            for partner_row in connection.execute(partner_page_query, partner_page_params).fetchall():
+                partner_dict = partner_row._mapping
+                partners_by_key.setdefault((partner_dict['user_id'], partner_dict['date']), []).append(partner_dict)
 
-            # Execute query and convert to DataFrame for processing
-            partner_data = connection.execute(partner_query, partner_params).fetchall()
-            df = pd.DataFrame([partner._mapping for partner in partner_data])
-
-            partner_stats = {}
-            if not df.empty:
-                # Group by alias (partner) and user_id to calculate average allocation
-                user_avg_allocation = df.groupby(['alias', 'user_id'])['allocation'].mean().reset_index()
-                # Sum average allocations per partner
-                partner_total_allocation = user_avg_allocation.groupby('alias')['allocation'].sum().to_dict()
-                # Sum MTM per partner
-                partner_total_mtm = df.groupby('alias')['mtm'].sum().to_dict()
-
-                # Build partner_stats with user-level data
-                for alias, group in df.groupby('alias'):
-                    partner_stats[alias] = {
-                        'users': [
-                            {
-                                'user_id': row['user_id'],
-                                'algo': str(row['algo'] or ''),
-                                'mtm': float(row['mtm'] or 0),
-                                'allocation': float(row['allocation'] or 0),
-                                'max_loss': float(row['max_loss'] or 0),
-                                'date': row['date'].strftime('%Y-%m-%d') if row['date'] else ''
-                            } for _, row in group.iterrows() if float(row['allocation'] or 0) > 0
-                        ],
-                        'total_allocation': partner_total_allocation.get(alias, 0),
-                        'total_mtm': partner_total_mtm.get(alias, 0)
-                    }
+            grouped_data = []
+            for jainam_record in result:
+                jainam_record_dict = jainam_record._mapping
+                main_data = {
+                    'row_id': jainam_record_dict['row_id'],
+                    'user_id': jainam_record_dict['user_id'],
+                    'alias': jainam_record_dict['alias'] or '',
+                    'allocation': float(jainam_record_dict['allocation'] or 0),
+                    'mtm': float(jainam_record_dict['MTM'] or 0),
+                    'max_loss': float(jainam_record_dict['max_loss'] or 0),
+                    'partner_alias': '',
+                    'partner_allocation': 0,
+                    'partner_mtm': 0,
+                    'partner_max_loss': 0,
+                    'is_main': True,
+                    'date': jainam_record_dict['date'].strftime('%Y-%m-%d') if jainam_record_dict['date'] else '',
+                    'broker': jainam_record_dict['broker'] or '',
+                    'algo': str(jainam_record_dict['algo'] or ''),
+                    'user_details_url': url_for('jainam.user_details', row_id=jainam_record_dict['row_id'])
+                }
+                partners_data = [
+                    {
+                        'row_id': partner['row_id'],
+                        'user_id': partner['user_id'],
+                        'alias': partner['alias'] or '',
+                        'allocation': float(partner['allocation'] or 0),
+                        'mtm': float(partner['mtm'] or 0),
+                        'max_loss': float(partner['max_loss'] or 0),
+                        'partner_alias': partner['alias'] or '',
+                        'partner_allocation': float(partner['allocation'] or 0),
+                        'partner_mtm': float(partner['mtm'] or 0),
+                        'partner_max_loss': float(partner['max_loss'] or 0),
+                        'is_main': False,
+                        'date': partner['date'].strftime('%Y-%m-%d') if partner['date'] else '',
+                        'broker': partner['broker'] or '',
+                        'algo': str(partner['algo'] or ''),
+                        'user_details_url': url_for('jainam.user_details', row_id=partner['row_id'])
+                    } for partner in partners_by_key.get((jainam_record_dict['user_id'], jainam_record_dict['date']), []) if float(partner['allocation'] or 0) > 0
+                ]
+                grouped_data.append({
+                    'main': main_data,
+                    'partners': partners_data
+                })
 
-            # Algo-wise stats query (unchanged)
-            algo_query = text("""
-                SELECT algo, user_id, date, SUM(mtm) as total_mtm, SUM(allocation) as total_allocation, SUM(max_loss) as total_max_loss
-                FROM user_partner_data 
-                WHERE is_main = :is_main AND broker IN (:b1, :b2, :b3, :b4, :b5)
-            """)
-            algo_params = {'is_main': False, 'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA'}
+            # One pass over the filtered partner rows yields partner totals, per-user rows and algo-wise sums
+            partner_builder = QueryBuilder('user_partner_data').where("is_main = :is_main", is_main=False)
+            partner_builder.where_in('broker', 'brokers', JAINAM_BROKERS)
             if partner:
-                algo_query = text(str(algo_query) + " AND alias = :partner")
-                algo_params['partner'] = partner
-            if user_id:
-                algo_query = text(str(algo_query) + " AND user_id = :user_id")
-                algo_params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    algo_query = text(str(algo_query) + " AND date = :date_filter")
-                    algo_params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter for algo stats: {date_filter}")
-                    date_filter = None
-            if start_date and end_date and not date_filter:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt <= end_date_dt:
-                        algo_query = text(str(algo_query) + " AND date BETWEEN :start_date AND :end_date")
-                        algo_params['start_date'] = start_date_dt
-                        algo_params['end_date'] = end_date_dt
-                except ValueError:
-                    logger.error(f"Invalid date range for algo stats: start_date={start_date}, end_date={end_date}")
-                    start_date, end_date = None, None
-            algo_query = text(str(algo_query) + " GROUP BY algo, user_id, date ORDER BY date DESC")
-            algo_wise_data = {}
-            for algo in connection.execute(algo_query, algo_params).fetchall():
-                algo_dict = algo._mapping
-                algo_name = str(algo_dict['algo'] or '')
-                if algo_name not in algo_wise_data:
-                    algo_wise_data[algo_name] = {'users': []}
-                if float(algo_dict['total_allocation'] or 0) > 0:
-                    algo_wise_data[algo_name]['users'].append({
-                        'user_id': algo_dict['user_id'],
-                        'algo': str(algo_dict['algo'] or ''),
-                        'mtm': float(algo_dict['total_mtm'] or 0),
-                        'allocation': float(algo_dict['total_allocation'] or 0),
-                        'max_loss': float(algo_dict['total_max_loss'] or 0),
-                        'date': algo_dict['date'].strftime('%Y-%m-%d') if algo_dict['date'] else ''
-                    })
+                partner_builder.where("alias = :partner", partner=partner)
+            apply_filters(partner_builder, filters)
+            partner_result = connection.execute(partner_builder.select("alias, algo, user_id, date, mtm, allocation, max_loss"), partner_builder.bind())
+            df = pd.DataFrame(partner_result.fetchall(), columns=list(partner_result.keys()))
+            partner_stats, algo_wise_data = aggregate_partner_stats(df)
 
+            logger.info(f"Dashboard served with {get_round_trips()} database round trips")
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({
                     'grouped_data': grouped_data,
@@ -1121,17 +1009,12 @@ if not hasattr(jainam_bp, 'registered'):
                     return Response("Invalid date format", status=400)
 
             connection = db_engine.connect()
-            query = text("SELECT * FROM user_partner_data WHERE is_main = :is_main")
-            params = {'is_main': False}
+            builder = QueryBuilder('user_partner_data').where("is_main = :is_main", is_main=False)
             if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
+                builder.where("user_id = :user_id", user_id=user_id)
             if start_date and end_date:
-                query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                params['start_date'] = start_date
-                params['end_date'] = end_date
-            query = text(str(query) + " ORDER BY date DESC")
-            result = connection.execute(query, params).fetchall()
+                builder.where("date BETWEEN :start_date AND :end_date", start_date=start_date, end_date=end_date)
+            result = connection.execute(builder.select(order_by="date DESC"), builder.bind()).fetchall()
 
             output = StringIO()
             writer = csv.writer(output)
@@ -1183,17 +1066,23 @@ if not hasattr(jainam_bp, 'registered'):
                     return Response("Invalid date format", status=400)
 
             connection = db_engine.connect()
-            query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
+            builder = jainam_scope()
             if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
+                builder.where("user_id = :user_id", user_id=user_id)
             if start_date and end_date:
-                query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                params['start_date'] = start_date
-                params['end_date'] = end_date
-            query = text(str(query) + " ORDER BY date DESC")
-            result = connection.execute(query, params).fetchall()
+                builder.where("date BETWEEN :start_date AND :end_date", start_date=start_date, end_date=end_date)
+            partner_query = builder.statement(f"""
+                SELECT p.* FROM user_partner_data p
+                JOIN ({builder.subquery("DISTINCT user_id, date")}) j ON p.user_id = j.user_id AND p.date = j.date
+                WHERE p.is_main = :is_main AND p.allocation > 0
+                ORDER BY p.alias
+            """)
+            partners_by_key = {}
+            for partner_row in connection.execute(partner_query, builder.bind(is_main=False)).fetchall():
+                partner_dict = partner_row._mapping
+                partners_by_key.setdefault((partner_dict['user_id'], partner_dict['date']), []).append(partner_dict)
+
+            result = connection.execute(builder.select(order_by="date DESC"), builder.bind()).fetchall()
 
             output = StringIO()
             writer = csv.writer(output)
@@ -1216,10 +1105,7 @@ if not hasattr(jainam_bp, 'registered'):
                         jainam_record_dict['broker'] or '',
                         jainam_record_dict['date'].strftime('%Y-%m-%d') if jainam_record_dict['date'] else ''
                     ])
-                    partner_result = connection.execute(text("SELECT * FROM user_partner_data WHERE user_id = :user_id AND date = :date AND is_main = :is_main AND allocation > 0 ORDER BY alias"), 
-                                                      {'user_id': jainam_record_dict['user_id'], 'date': jainam_record_dict['date'], 'is_main': False}).fetchall()
-                    for partner in partner_result:
-                        partner_dict = partner._mapping
+                    for partner_dict in partners_by_key.get((jainam_record_dict['user_id'], jainam_record_dict['date']), []):
                         writer.writerow([
                             partner_dict['user_id'],
                             partner_dict['alias'] or '',
@@ -1232,6 +1118,7 @@ if not hasattr(jainam_bp, 'registered'):
                             partner_dict['date'].strftime('%Y-%m-%d') if partner_dict['date'] else ''
                         ])
 
+            logger.info(f"User partner details export served with {get_round_trips()} database round trips")
             output.seek(0)
             return Response(
                 output,
@@ -1289,120 +1176,32 @@ if not hasattr(jainam_bp, 'registered'):
         try:
             connection = db_engine.connect()
             
+            # Validate the filters once for the algo, date and partner queries
+            filters, errors, date_filter, start_date, end_date = parse_jainam_filters(date_filter=date_filter, start_date=start_date, end_date=end_date)
+            if errors:
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return jsonify({'error': errors[0]}), 400
+                for error in errors:
+                    flash(error, 'error')
+
+            def partner_scope():
+                return apply_filters(jainam_scope('user_partner_data').where("alias = :partner_id", partner_id=partner_id), filters)
+
             # Fetch unique algos for the partner
-            algo_query = text("SELECT DISTINCT algo FROM user_partner_data WHERE alias = :partner_id AND algo IS NOT NULL AND (broker IN :brokers OR user_id LIKE :user_id)")
-            params = {'partner_id': partner_id, 'brokers': tuple(VALID_BROKERS), 'user_id': f'%{USER_ID_FILTER_KEYWORD}%'}
-            if start_date and end_date:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return jsonify({'error': 'Start date cannot be after end date.'}), 400
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        algo_query = text(str(algo_query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for range. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
-            elif date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    algo_query = text(str(algo_query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for single date. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            algo_result = connection.execute(algo_query, params).fetchall()
+            algo_builder = partner_scope().where("algo IS NOT NULL")
+            algo_result = connection.execute(algo_builder.distinct("algo"), algo_builder.bind()).fetchall()
             unique_algos = [row._mapping['algo'] for row in algo_result if row._mapping['algo']]
 
             # Fetch unique dates for the partner
-            date_query = text("SELECT DISTINCT date FROM user_partner_data WHERE alias = :partner_id AND date IS NOT NULL AND (broker IN :brokers OR user_id LIKE :user_id)")
-            params = {'partner_id': partner_id, 'brokers': tuple(VALID_BROKERS), 'user_id': f'%{USER_ID_FILTER_KEYWORD}%'}
-            if start_date and end_date:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return jsonify({'error': 'Start date cannot be after end date.'}), 400
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        date_query = text(str(date_query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for range. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
-            elif date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    date_query = text(str(date_query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for single date. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            date_result = connection.execute(date_query, params).fetchall()
+            date_builder = partner_scope().where("date IS NOT NULL")
+            date_result = connection.execute(date_builder.distinct("date"), date_builder.bind()).fetchall()
             unique_dates = sorted([row._mapping['date'].strftime('%Y-%m-%d') for row in date_result], reverse=True)
 
             # Fetch partner data grouped by algo
-            partner_query = text("""
-                SELECT algo, user_id, date, allocation, mtm, max_loss, broker
-                FROM user_partner_data
-                WHERE alias = :partner_id AND is_main = :is_main AND (broker IN :brokers OR user_id LIKE :user_id)
-            """)
-            params = {'partner_id': partner_id, 'is_main': False, 'brokers': tuple(VALID_BROKERS), 'user_id': f'%{USER_ID_FILTER_KEYWORD}%'}
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    partner_query = text(str(partner_query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for single date. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for single date. Please use YYYY-MM-DD.', 'error')
-                    date_filter = None
-            elif start_date and end_date:
-                try:
-                    start_date_dt = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date_dt = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date_dt > end_date_dt:
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return jsonify({'error': 'Start date cannot be after end date.'}), 400
-                        flash('Start date cannot be after end date.', 'error')
-                        start_date, end_date = None, None
-                    else:
-                        partner_query = text(str(partner_query) + " AND date BETWEEN :start_date AND :end_date")
-                        params['start_date'] = start_date_dt
-                        params['end_date'] = end_date_dt
-                        logger.info(f"Applied date range filter: {start_date} to {end_date}")
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return jsonify({'error': 'Invalid date format for range. Please use YYYY-MM-DD.'}), 400
-                    flash('Invalid date format for range. Please use YYYY-MM-DD.', 'error')
-                    start_date, end_date = None, None
+            partner_builder = partner_scope().where("is_main = :is_main", is_main=False)
             
             # Count total records for pagination
-            count_query = text(str(partner_query).replace("SELECT algo, user_id, date, allocation, mtm, max_loss, broker", "SELECT COUNT(*) as total"))
-            total_records = connection.execute(count_query, params).fetchone()._mapping['total']
+            total_records = connection.execute(partner_builder.count(), partner_builder.bind()).fetchone()._mapping['total']
             total_pages = math.ceil(total_records / rows_per_page) if rows_per_page > 0 else 1
             
             if page < 1:
@@ -1410,10 +1209,8 @@ if not hasattr(jainam_bp, 'registered'):
             if page > total_pages:
                 page = total_pages if total_pages > 0 else 1
             
-            partner_query = text(str(partner_query) + " ORDER BY algo, date DESC LIMIT :limit OFFSET :offset")
-            params['limit'] = rows_per_page
-            params['offset'] = (page - 1) * rows_per_page
-            partner_result = connection.execute(partner_query, params).fetchall()
+            partner_query = partner_builder.select("algo, user_id, date, allocation, mtm, max_loss, broker", order_by="algo, date DESC", paginate=True)
+            partner_result = connection.execute(partner_query, partner_builder.bind(limit=rows_per_page, offset=(page - 1) * rows_per_page)).fetchall()
 
             # Organize data by algo
             algo_stats = {}
@@ -1513,43 +1310,14 @@ if not hasattr(jainam_bp, 'registered'):
         connection = None
         try:
             connection = db_engine.connect()
-            query = text("SELECT * FROM jainam WHERE (broker IN (:b1, :b2, :b3, :b4, :b5) OR user_id LIKE :u)")
-            params = {'b1': 'JAINAM_CTRADE_DL', 'b2': 'SREDJAINAM_CTRADE', 'b3': 'SREDJAINAM_103', 'b4': 'SREDJAINAM2_P', 'b5': 'ACHINTYA', 'u': '%MEGASERV%'}
-            
-            if search:
-                query = text(str(query) + " AND (user_id LIKE :s1 OR alias LIKE :s2)")
-                params['s1'] = f"%{search}%"
-                params['s2'] = f"%{search}%"
-            if user_id:
-                query = text(str(query) + " AND user_id = :user_id")
-                params['user_id'] = user_id
-            if date_filter:
-                try:
-                    datetime.strptime(date_filter, '%Y-%m-%d')
-                    query = text(str(query) + " AND date = :date_filter")
-                    params['date_filter'] = date_filter
-                except ValueError:
-                    logger.error(f"Invalid date filter: {date_filter}")
-                    return Response("Invalid date format", status=400)
-            elif start_date and end_date:
-                try:
-                    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    if start_date > end_date:
-                        return Response("Start date cannot be after end date", status=400)
-                    query = text(str(query) + " AND date BETWEEN :start_date AND :end_date")
-                    params['start_date'] = start_date
-                    params['end_date'] = end_date
-                except ValueError:
-                    logger.error(f"Invalid date range: start_date={start_date}, end_date={end_date}")
-                    return Response("Invalid date format", status=400)
+            filters, errors, date_filter, start_date, end_date = parse_jainam_filters(user_id, date_filter, start_date, end_date, search)
+            if errors:
+                return Response(errors[0], status=400)
+            builder = apply_filters(jainam_scope(), filters)
 
             # Apply pagination for export
-            query = text(str(query) + " ORDER BY date DESC LIMIT :limit OFFSET :offset")
-            params['limit'] = rows_per_page
-            params['offset'] = (page - 1) * rows_per_page
-            
-            result = connection.execute(query, params).fetchall()
+            query = builder.select(order_by="date DESC", paginate=True)
+            result = connection.execute(query, builder.bind(limit=rows_per_page, offset=(page - 1) * rows_per_page)).fetchall()
 
             output = StringIO()
             writer = csv.writer(output)
@@ -1581,16 +1349,11 @@ if not hasattr(jainam_bp, 'registered'):
             if connection:
                 connection.close()
 
-    # Initialize database tables
+    # Initialize the blueprint. Tables are created by the jainam and auth migrations,
+    # which app.py applies through migrate_on_startup (or `python migrate.py`).
     def init_app(app):
         with app.app_context():
-            logger.info("Creating database tables for jainam blueprint")
-            try:
-                check_and_update_schema()
-                Auth.init_db()
-            except Exception as e:
-                logger.error(f"Failed to initialize database: {str(e)}")
-                raise
+            logger.info("Jainam blueprint initialized; schema managed by migrations")
 
 # Log blueprint registration
 logger.info("Jainam blueprint defined")
\ No newline at end of file
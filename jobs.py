@@ -0,0 +1,485 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from sqlalchemy import text, bindparam
+from utils import get_db_connection, logger
+from migrations import migration, column_exists, create_index
+
+# Worker threads per process and the number of jobs allowed to wait for one
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 20))
+# Finished jobs kept in memory; older ones are still reported from the jobs table
+JOB_HISTORY = 200
+# Minimum seconds between progress writes to the jobs table (state changes always write)
+PROGRESS_FLUSH_INTERVAL = 1.0
+# A running job holds the MySQL named lock job:<key>, so jobs on one table are serialised across
+# worker processes too; a job waiting for it re-checks its cancel flag this often (seconds)
+JOB_LOCK_POLL = 5
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the bounded queue has no room for another job."""
+
+
+class JobCancelled(Exception):
+    """Raised by Job.progress() inside a cancellable job once cancellation was requested."""
+
+
+@migration('jobs', 1, 'jobs table for background uploads')
+def migrate_jobs_table(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id VARCHAR(36) NOT NULL PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            table_name VARCHAR(255),
+            status VARCHAR(20) NOT NULL,
+            stage VARCHAR(255),
+            rows_written BIGINT NOT NULL DEFAULT 0,
+            files TEXT,
+            messages MEDIUMTEXT,
+            created_by VARCHAR(255),
+            created_at DATETIME NOT NULL,
+            started_at DATETIME NULL,
+            finished_at DATETIME NULL,
+            INDEX idx_jobs_created_at (created_at)
+        ) ENGINE=InnoDB
+    """))
+
+
+@migration('jobs', 2, 'Cancellation flags on jobs')
+def migrate_jobs_cancellation(connection):
+    if not column_exists(connection, 'jobs', 'cancellable'):
+        connection.execute(text("ALTER TABLE jobs ADD COLUMN cancellable TINYINT NOT NULL DEFAULT 0"))
+    if not column_exists(connection, 'jobs', 'cancel_requested'):
+        connection.execute(text("ALTER TABLE jobs ADD COLUMN cancel_requested TINYINT NOT NULL DEFAULT 0"))
+
+
+@migration('jobs', 3, 'Owner process and key lock connection of jobs, for stale job recovery')
+def migrate_jobs_owner(connection):
+    if not column_exists(connection, 'jobs', 'owner'):
+        connection.execute(text("ALTER TABLE jobs ADD COLUMN owner VARCHAR(255) NULL"))
+    if not column_exists(connection, 'jobs', 'lock_connection'):
+        connection.execute(text("ALTER TABLE jobs ADD COLUMN lock_connection BIGINT NULL"))
+    create_index(connection, 'jobs', 'idx_jobs_status', ['status'])
+
+
+def job_lock_name(key):
+    """MySQL named lock serialising the jobs on `key` (names are limited to 64 characters)."""
+    return f"job:{key}"[:64]
+
+
+class Job:
+    """In-memory state of one job; mirrored to the jobs table so any process can report it."""
+
+    def __init__(self, kind, table_name, created_by, func, args, kwargs, cancellable=False):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.table_name = table_name
+        self.created_by = created_by
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancellable = cancellable
+        self.cancel_requested = False
+        self.status = 'queued'
+        self.stage = 'Queued'
+        self.rows_written = 0
+        self.files = {}
+        self.messages = []
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # host:pid of the process whose queue holds the job (see recover_stale_jobs)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock_connection = None
+        self.lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def progress(self, stage=None, rows=0, file=None, file_status=None, message=None):
+        """
+        Progress callback handed to the job function.
+        Args:
+            stage (str): Human-readable current step.
+            rows (int): Rows written since the last call (added to rows_written).
+            file (str) / file_status (str): Per-file status, e.g. 'processing', 'done', 'error'.
+            message (tuple): (category, msg) to append to the job's result messages.
+        Raises JobCancelled in a cancellable job once cancellation is requested (from any
+        process; the flag is read back from the jobs table when progress is flushed).
+        """
+        with self.lock:
+            if stage:
+                self.stage = stage
+            self.rows_written += rows
+            if file:
+                self.files[file] = file_status or self.files.get(file, 'processing')
+            if message:
+                self.messages.append(tuple(message))
+        force = bool(file or message)
+        if force or time.monotonic() - self._last_flush >= PROGRESS_FLUSH_INTERVAL:
+            self.save()
+            if self.cancellable and not self.cancel_requested:
+                self.cancel_requested = self._cancel_requested_in_db()
+        if self.cancellable and self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def _cancel_requested_in_db(self):
+        engine = get_db_connection()
+        if not engine:
+            return False
+        try:
+            with engine.connect() as connection:
+                return bool(connection.execute(text("SELECT cancel_requested FROM jobs WHERE id = :id"), {'id': self.id}).scalar())
+        except Exception as e:
+            logger.error(f"Error reading cancel flag of job {self.id}: {type(e).__name__} - {str(e)}")
+            return False
+
+    def to_dict(self):
+        with self.lock:
+            elapsed = ((self.finished_at or datetime.now()) - self.started_at).total_seconds() if self.started_at else 0
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'table_name': self.table_name,
+                'status': self.status,
+                'stage': self.stage,
+                'cancellable': self.cancellable,
+                'rows_written': self.rows_written,
+                'rows_per_second': round(self.rows_written / elapsed, 1) if elapsed > 0 else 0.0,
+                'files': dict(self.files),
+                'messages': [list(m) for m in self.messages],
+                'created_by': self.created_by,
+                'created_at': self.created_at.isoformat(),
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            }
+
+    def save(self, insert=False):
+        """Write the job's state to the jobs table; failures are logged, never raised into the job."""
+        self._last_flush = time.monotonic()
+        state = self.to_dict()
+        params = {
+            'id': self.id, 'kind': self.kind, 'table_name': self.table_name, 'status': state['status'],
+            'stage': (state['stage'] or '')[:255], 'rows_written': state['rows_written'],
+            'files': json.dumps(state['files']), 'messages': json.dumps(state['messages']),
+            'created_by': self.created_by, 'created_at': self.created_at,
+            'started_at': self.started_at, 'finished_at': self.finished_at, 'cancellable': int(self.cancellable),
+            'owner': self.owner, 'lock_connection': self.lock_connection,
+        }
+        engine = get_db_connection()
+        if not engine:
+            return
+        try:
+            with engine.begin() as connection:
+                if insert:
+                    connection.execute(text("""
+                        INSERT INTO jobs (id, kind, table_name, status, stage, rows_written, files, messages, created_by, created_at, cancellable, owner)
+                        VALUES (:id, :kind, :table_name, :status, :stage, :rows_written, :files, :messages, :created_by, :created_at, :cancellable, :owner)
+                    """), params)
+                else:
+                    connection.execute(text("""
+                        UPDATE jobs SET status = :status, stage = :stage, rows_written = :rows_written, files = :files,
+                               messages = :messages, started_at = :started_at, finished_at = :finished_at,
+                               lock_connection = :lock_connection
+                        WHERE id = :id
+                    """), params)
+        except Exception as e:
+            logger.error(f"Error saving job {self.id}: {type(e).__name__} - {str(e)}")
+
+
+class JobRunner:
+    """
+    Worker pool over a bounded queue. Jobs with the same key (the target table) run one
+    at a time in submission order; jobs for different keys run in parallel. Across worker
+    processes, the MySQL named lock job_lock_name(key) keeps two jobs on a key from overlapping.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ready = queue.Queue()
+        self.jobs = {}
+        self.waiting = {}  # key -> deque of jobs blocked behind the running job for that key
+        self.busy_keys = set()
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+
+    def _ensure_workers(self):
+        # Threads don't survive a fork; pre-forked workers start their own pool on first use
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, kind, key, func, *args, created_by=None, cancellable=False, **kwargs):
+        """
+        Queue func(*args, progress=job.progress, **kwargs) and return the job id.
+        func returns a list of (category, msg) results. Raises JobQueueFull when full.
+        With cancellable=True, cancel() stops the job at its next progress() call.
+        """
+        job = Job(kind, key, created_by, func, args, kwargs, cancellable)
+        with self.lock:
+            self._ensure_workers()
+            if self.queued >= self.max_queued:
+                raise JobQueueFull(f"Too many queued jobs ({self.queued}); try again shortly")
+            self.queued += 1
+            self._prune()
+            self.jobs[job.id] = job
+            if key in self.busy_keys:
+                self.waiting.setdefault(key, deque()).append(job)
+                job.stage = f"Waiting for another job on {key}"
+            else:
+                self.busy_keys.add(key)
+                self.ready.put(job)
+        job.save(insert=True)
+        logger.info(f"Queued job {job.id} ({kind}) for {key}")
+        return job.id
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j.finished_at]
+        for old in sorted(finished, key=lambda j: j.finished_at)[:max(len(finished) - JOB_HISTORY, 0)]:
+            del self.jobs[old.id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self.ready.get()
+            with self.lock:
+                self.queued -= 1
+            self._run(job)
+            with self.lock:
+                pending = self.waiting.get(job.table_name)
+                if pending:
+                    self.ready.put(pending.popleft())
+                    if not pending:
+                        del self.waiting[job.table_name]
+                else:
+                    self.busy_keys.discard(job.table_name)
+            self.ready.task_done()
+
+    def cancel(self, job_id):
+        """Request cancellation of a job run by this process. Returns False if it isn't cancellable."""
+        job = self.jobs.get(job_id)
+        if not job or not job.cancellable or job.finished_at:
+            return False
+        job.cancel_requested = True
+        return True
+
+    def _cancelled_before_start(self, job):
+        if not job.cancel_requested and job.cancellable:
+            job.cancel_requested = job._cancel_requested_in_db()
+        if not job.cancel_requested:
+            return False
+        with job.lock:
+            job.status = 'cancelled'
+            job.stage = 'Cancelled before it started'
+            job.finished_at = datetime.now()
+        job.save()
+        return True
+
+    def _acquire_key_lock(self, job):
+        """
+        Wait for job_lock_name(job.table_name) on a connection of its own, which is returned
+        (the lock lasts as long as it does). Returns None when the job was cancelled while it
+        waited, and False (run without the lock) when the database can't be reached.
+        """
+        engine = get_db_connection()
+        if not engine:
+            logger.warning(f"Job {job.id} runs without the {job.table_name} lock: Database connection failed")
+            return False
+        connection = engine.connect()
+        name = job_lock_name(job.table_name)
+        try:
+            while True:
+                if connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                      {'name': name, 'timeout': JOB_LOCK_POLL}).scalar() == 1:
+                    job.lock_connection = connection.execute(text("SELECT CONNECTION_ID()")).scalar()
+                    return connection
+                if self._cancelled_before_start(job):
+                    connection.close()
+                    return None
+                with job.lock:
+                    job.stage = f"Waiting for another process's job on {job.table_name}"
+                job.save()
+        except Exception:
+            connection.close()
+            raise
+
+    def _release_key_lock(self, job, connection):
+        try:
+            connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': job_lock_name(job.table_name)})
+        except Exception as e:
+            # Closing the connection releases it anyway
+            logger.error(f"Error releasing the lock of job {job.id}: {type(e).__name__} - {str(e)}")
+        finally:
+            connection.close()
+
+    def _run(self, job):
+        if self._cancelled_before_start(job):
+            return
+        try:
+            lock_connection = self._acquire_key_lock(job)
+        except Exception as e:
+            logger.error(f"Job {job.id} could not take the {job.table_name} lock: {type(e).__name__} - {str(e)}")
+            lock_connection = False
+        if lock_connection is None:
+            return
+        try:
+            self._execute(job)
+        finally:
+            if lock_connection:
+                self._release_key_lock(job, lock_connection)
+
+    def _execute(self, job):
+        with job.lock:
+            job.status = 'running'
+            job.stage = 'Starting'
+            job.started_at = datetime.now()
+        job.save()
+        try:
+            results = job.func(*job.args, progress=job.progress, **job.kwargs) or []
+            with job.lock:
+                job.messages.extend(tuple(r) for r in results)
+                job.status = 'failed' if results and all(category == 'error' for category, _ in results) else 'done'
+                job.stage = 'Finished'
+        except JobCancelled:
+            logger.info(f"Job {job.id} cancelled after {job.rows_written} rows")
+            with job.lock:
+                job.messages.append(('warning', f"Cancelled after {job.rows_written} rows; completed chunks are kept"))
+                job.status = 'cancelled'
+                job.stage = 'Cancelled'
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {type(e).__name__} - {str(e)}")
+            with job.lock:
+                job.messages.append(('error', f"Job failed: {type(e).__name__} - {str(e)}"))
+                job.status = 'failed'
+                job.stage = 'Failed'
+        with job.lock:
+            job.finished_at = datetime.now()
+        job.save()
+        logger.info(f"Job {job.id} {job.status}: {job.rows_written} rows")
+
+
+runner = JobRunner()
+
+
+def submit_job(kind, key, func, *args, created_by=None, cancellable=False, **kwargs):
+    return runner.submit(kind, key, func, *args, created_by=created_by, cancellable=cancellable, **kwargs)
+
+
+def cancel_job(job_id):
+    """
+    Request cancellation of a cancellable job, whichever worker process runs it: the flag is
+    set in memory here and in the jobs table for the others. Returns False when the job is
+    unknown, finished or not cancellable.
+    """
+    local = runner.cancel(job_id)
+    engine = get_db_connection()
+    if not engine:
+        return local
+    with engine.begin() as connection:
+        result = connection.execute(text("""
+            UPDATE jobs SET cancel_requested = 1
+            WHERE id = :id AND cancellable = 1 AND finished_at IS NULL
+        """), {'id': job_id})
+    return local or result.rowcount > 0
+
+
+def _owner_is_dead(owner):
+    """True when `owner` (host:pid) is a process on this host that no longer exists."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def recover_stale_jobs():
+    """
+    Mark jobs left 'queued' or 'running' by a process that went away as failed. A running job
+    is stale once nobody holds its key lock on the connection it recorded (on any host); a
+    queued job when the process that queued it on this host no longer exists.
+    Called on startup. Returns the number of jobs marked failed.
+    """
+    engine = get_db_connection()
+    if not engine:
+        return 0
+    try:
+        with engine.begin() as connection:
+            rows = connection.execute(text("""
+                SELECT id, table_name, status, owner, lock_connection FROM jobs
+                WHERE status IN ('queued', 'running')
+            """)).mappings().fetchall()
+            stale = []
+            for row in rows:
+                if row['status'] == 'running':
+                    holder = connection.execute(text("SELECT IS_USED_LOCK(:name)"),
+                                                {'name': job_lock_name(row['table_name'])}).scalar()
+                    if row['lock_connection'] is None or holder != row['lock_connection']:
+                        stale.append(row['id'])
+                elif _owner_is_dead(row['owner']):
+                    stale.append(row['id'])
+            if stale:
+                connection.execute(text("""
+                    UPDATE jobs SET status = 'failed', stage = 'Interrupted', finished_at = :finished_at
+                    WHERE id IN :ids AND status IN ('queued', 'running')
+                """).bindparams(bindparam('ids', expanding=True)), {'ids': stale, 'finished_at': datetime.now()})
+    except Exception as e:
+        logger.error(f"Error recovering stale jobs: {type(e).__name__} - {str(e)}")
+        return 0
+    if stale:
+        logger.warning(f"Marked {len(stale)} interrupted job(s) as failed: {', '.join(stale)}")
+    return len(stale)
+
+
+def get_job_status(job_id):
+    """
+    Job state as a dict: from memory when this process runs the job, otherwise from the
+    jobs table (another worker process, or a finished job). Returns None if unknown.
+    """
+    job = runner.get(job_id)
+    if job:
+        return job.to_dict()
+    engine = get_db_connection()
+    if not engine:
+        return None
+    with engine.connect() as connection:
+        row = connection.execute(text("SELECT * FROM jobs WHERE id = :id"), {'id': job_id}).mappings().fetchone()
+    if not row:
+        return None
+    started_at, finished_at = row['started_at'], row['finished_at']
+    elapsed = ((finished_at or datetime.now()) - started_at).total_seconds() if started_at else 0
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'table_name': row['table_name'],
+        'status': row['status'],
+        'stage': row['stage'],
+        'cancellable': bool(row.get('cancellable')),
+        'rows_written': row['rows_written'],
+        'rows_per_second': round(row['rows_written'] / elapsed, 1) if elapsed > 0 else 0.0,
+        'files': json.loads(row['files'] or '{}'),
+        'messages': json.loads(row['messages'] or '[]'),
+        'created_by': row['created_by'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'started_at': started_at.isoformat() if started_at else None,
+        'finished_at': finished_at.isoformat() if finished_at else None,
+    }
@@ -1,19 +1,77 @@
 import re
 from datetime import datetime
 
+# Header spellings differ only in case, spacing and punctuation; only letters are compared
+_NON_ALPHA = re.compile(r'[^a-z]')
+# Distinct header rows memoised per mapping before the memo is reset
+MAX_RESOLVED_HEADERS = 256
+
+
+def clean_column_name(column_name):
+    """Lowercase letters of a column name, the form aliases are matched in."""
+    return _NON_ALPHA.sub('', str(column_name).lower())
+
+
+def _aliases(info):
+    if isinstance(info, dict):
+        return info.get("aliases", [])
+    return info if isinstance(info, list) else []
+
+
+class AliasIndex:
+    """
+    Cleaned alias -> standard column name for one column mapping, built once. Whole header
+    rows are resolved in one lookup after the first time a header signature is seen.
+    """
+
+    def __init__(self, column_mapping):
+        self.column_mapping = column_mapping
+        self.standard_names = {}
+        # Lowercased standard names and aliases, as matched by check_unmapped_columns
+        self.valid_names = set()
+        for standard_name, info in column_mapping.items():
+            self.valid_names.add(standard_name.lower())
+            for alias in _aliases(info):
+                # The first standard name listing an alias wins
+                self.standard_names.setdefault(clean_column_name(alias), standard_name)
+                self.valid_names.add(str(alias).strip().lower())
+        self._resolved = {}
+
+    def resolve(self, column_name):
+        return self.standard_names.get(clean_column_name(column_name), column_name)
+
+    def resolve_headers(self, headers):
+        signature = tuple(headers)
+        resolved = self._resolved.get(signature)
+        if resolved is None:
+            if len(self._resolved) >= MAX_RESOLVED_HEADERS:
+                self._resolved.clear()
+            resolved = tuple(self.resolve(header) for header in signature)
+            self._resolved[signature] = resolved
+        return resolved
+
+
+_alias_indexes = {}
+
+
+def alias_index(column_mapping):
+    """The AliasIndex of a column mapping (one of table_mappings, or any mapping dict)."""
+    index = _alias_indexes.get(id(column_mapping))
+    # The index keeps its mapping alive, so a matching id always means the same mapping
+    if index is None or index.column_mapping is not column_mapping:
+        index = AliasIndex(column_mapping)
+        _alias_indexes[id(column_mapping)] = index
+    return index
+
+
 def normalize_column_name(column_name, column_mapping):
     """Normalize column names by keeping only alphabetic characters and ignoring case."""
-    # Convert to lowercase and keep only alphabetic characters
-    column_name_cleaned = re.sub(r'[^a-z]', '', str(column_name).lower())
-    
-    for standard_name, info in column_mapping.items():
-        # Normalize each alias: keep only alphabetic characters, lowercase
-        aliases_cleaned = [re.sub(r'[^a-z]', '', alias.lower()) for alias in info["aliases"]]
-        
-        # Check if the cleaned column name matches any cleaned alias
-        if column_name_cleaned in aliases_cleaned:
-            return standard_name
-    return column_name
+    return alias_index(column_mapping).resolve(column_name)
+
+
+def resolve_headers(headers, column_mapping):
+    """normalize_column_name() for a whole header row, memoised per header signature. Returns a tuple."""
+    return alias_index(column_mapping).resolve_headers(headers)
 
 # Existing column mappings (unchanged)
 portfolios_column_mapping = {
@@ -52,8 +110,8 @@ ob_column_mapping = {
     "trigger_price": {"aliases": ["trigger price", "Trigger_Price", "TRIGGER PRICE", "triggerprice"], "datatype": "FLOAT"},
     "server": {"aliases": ["server", "Server", "SERVER"], "datatype": "VARCHAR(255)"},
     "date": {"aliases": ["date", "Date", "DATE"], "datatype": "DATE"},
-    "order_time": {"aliases": ["order time", "Order_Time", "ORDER TIME", "ordertime"], "datatype": "VARCHAR(255)"},
-    "exchange_time": {"aliases": ["exchange time", "Exchange_Time", "EXCHANGE TIME", "exchangetime"], "datatype": "VARCHAR(255)"},
+    "order_time": {"aliases": ["order time", "Order_Time", "ORDER TIME", "ordertime"], "datatype": "DATETIME(3)"},
+    "exchange_time": {"aliases": ["exchange time", "Exchange_Time", "EXCHANGE TIME", "exchangetime"], "datatype": "DATETIME(3)"},
     "exchg_order_id": {"aliases": ["exchg order id", "Exchg_Order_ID", "EXCHG ORDER ID", "exchgorderid"], "datatype": "VARCHAR(255)"},
     "transaction": {"aliases": ["transaction", "Transaction", "TRANSACTION"], "datatype": "VARCHAR(255)"},
     "order_type": {"aliases": ["order type", "Order_Type", "ORDER TYPE", "ordertype"], "datatype": "VARCHAR(255)"},
@@ -218,7 +276,7 @@ positions_column_mapping = {
 }
 
 gridlog_column_mapping = {
-    "timestamp": {"aliases": ["timestamp", "Timestamp", "TIMESTAMP", "timestam"], "datatype": "TEXT"},
+    "timestamp": {"aliases": ["timestamp", "Timestamp", "TIMESTAMP", "timestam"], "datatype": "DATETIME(3)"},
     "user_id": {"aliases": ["user id", "UserID", "USER ID", "userid", "User_Id"], "datatype": "VARCHAR(255)"},
     "strategy_tag": {"aliases": ["strategy tag", "Strategy_Tag", "STRATEGY TAG", "strategytag", "strategy t."], "datatype": "VARCHAR(255)"},
     "option_portfolio": {"aliases": ["option portfolio", "Option_Portfolio", "OPTION PORTFOLIO", "optionportfolio", "option portfolio"], "datatype": "VARCHAR(255)"},
@@ -230,6 +288,14 @@ gridlog_column_mapping = {
 }
 
 
+# Timestamp columns parsed into DATETIME(3) at ingest. Values that don't parse are kept as
+# text in `<column>_raw`, of the type given here (the column's type before it was parsed).
+datetime_columns = {
+    "ob": {"order_time": "VARCHAR(255)", "exchange_time": "VARCHAR(255)"},
+    "gridlog": {"timestamp": "TEXT"},
+}
+
+
 table_mappings = {
     "users": user_column_variations,
     "orderbook": order_book_column_variations,
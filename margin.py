@@ -1,15 +1,24 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response, send_file
 from functools import wraps
-from utils import get_db_connection, get_table_columns, logger
+from utils import get_db_connection, logger
+import schema_catalog
+import archive
 import pandas as pd
 import numpy as np
 import io
 import re
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime
+from queries import date_equals, date_between
+from datetime import datetime, date
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import tempfile
+import os
 import uuid
 import json
+import xlsxwriter
 
 margin_bp = Blueprint('margin', __name__, template_folder='templates')
 
@@ -53,246 +62,447 @@ def extract_shortfall(msg):
         return None
     return None
 
-def analyze_margin_shortfalls(trade_date):
+def load_users_frame(engine):
+    """
+    Load and clean the users table for margin analysis.
+    Returns: (users_df, messages) where messages is a list of (category, message) tuples.
+    """
+    user_query = """
+        SELECT user_id, alias, broker, mtm_all, allocation, max_loss, available_margin, algo, server
+        FROM users
+    """
+    logger.debug("Executing users query")
     try:
-        # Validate trade_date format
-        try:
-            datetime.strptime(trade_date, '%Y-%m-%d')
-        except ValueError:
-            raise ValueError("Invalid date format. Please use YYYY-MM-DD.")
-
-        engine = get_db_connection()
-        if not engine:
-            raise ValueError("Failed to establish database connection")
-
-        # Check if required tables exist
-        available_tables = get_table_columns('users') or get_table_columns('ob')
-        if not available_tables:
-            with engine.connect() as connection:
-                result = connection.execute(text("SHOW TABLES"))
-                available_tables = [row[0] for row in result.fetchall()]
-                logger.error(f"Tables 'users' or 'ob' not found. Available tables: {available_tables}")
-                flash(f"Required tables 'users' or 'ob' not found in database. Available tables: {available_tables}", "error")
-                return pd.DataFrame(), pd.DataFrame()
-
-        # Debug: Check available dates in ob table
         with engine.connect() as connection:
-            result = connection.execute(text("SELECT DISTINCT DATE(date) AS trade_date FROM ob"))
-            available_dates = [row.trade_date.strftime('%Y-%m-%d') for row in result.fetchall()]
-            logger.debug(f"Available dates in ob table: {available_dates}")
-            if trade_date not in available_dates:
-                logger.warning(f"No data found for trade_date: {trade_date}")
-                flash(f"No data found for selected date: {trade_date}", "error")
-                return pd.DataFrame(), pd.DataFrame()
-
-        # Raw SQL queries
-        user_query = """
-            SELECT user_id, alias, broker, mtm_all, allocation, max_loss, available_margin, algo, server
-            FROM users
-        """
-        orderbook_query = """
-            SELECT user_id, user_alias, exchange, date AS order_date, order_time, status_message, status
-            FROM ob
-            WHERE DATE(date) = :trade_date
-        """
-
-        # Execute queries
-        logger.debug("Executing users query")
-        try:
-            with engine.connect() as connection:
-                result = connection.execute(text(user_query))
-                users_df = pd.DataFrame(result.fetchall(), columns=result.keys())
-        except SQLAlchemyError as e:
-            logger.error(f"Users query failed: {str(e)}")
-            flash(f"Users query failed: {str(e)}", "error")
-            return pd.DataFrame(), pd.DataFrame()
-
-        logger.debug(f"Executing orderbook query with trade_date: {trade_date}")
-        try:
-            with engine.connect() as connection:
-                result = connection.execute(text(orderbook_query), {"trade_date": trade_date})
-                orderbook_df = pd.DataFrame(result.fetchall(), columns=result.keys())
-                logger.debug(f"Orderbook query returned {len(orderbook_df)} rows for trade_date: {trade_date}")
-        except SQLAlchemyError as e:
-            logger.error(f"Orderbook query failed: {str(e)}")
-            flash(f"Orderbook query failed: {str(e)}", "error")
-            return pd.DataFrame(), pd.DataFrame()
-
-        # Check if dataframes are empty
+            result = connection.execute(text(user_query))
+            users_df = pd.DataFrame(result.fetchall(), columns=result.keys())
+    except SQLAlchemyError as e:
+        logger.error(f"Users query failed: {str(e)}")
+        return pd.DataFrame(), [("error", f"Users query failed: {str(e)}")]
+
+    if users_df.empty:
+        logger.info("Users DataFrame is empty")
+        return pd.DataFrame(), [("error", "No user data found in the database.")]
+
+    required_user_columns = ['user_id', 'alias', 'broker', 'mtm_all', 'allocation', 'max_loss', 'available_margin']
+    missing_user_columns = [col for col in required_user_columns if col not in users_df.columns]
+    if missing_user_columns:
+        logger.error(f"Missing columns: users: {missing_user_columns}")
+        return pd.DataFrame(), [("error", f"Missing columns in database: ob: [], users: {missing_user_columns}")]
+
+    # Multiply allocation by 100
+    users_df['allocation'] = pd.to_numeric(users_df['allocation'], errors='coerce') * 100
+    users_df['allocation'] = users_df['allocation'].where(pd.notna(users_df['allocation']), None)
+
+    # Rename columns
+    users_df = users_df.rename(columns={
+        'mtm_all': 'MTM (All)',
+        'max_loss': 'MAXLOSS',
+        'allocation': 'ALLOCATION'
+    })
+
+    # Convert and clean User ID, remove duplicates
+    users_df['user_id'] = users_df['user_id'].astype(str).str.strip().str.upper()
+    users_df = users_df.drop_duplicates(subset=['user_id'])
+    return users_df, []
+
+def compute_margin_shortfalls(trade_date, engine, users_df=None):
+    """
+    Compute the margin shortfall details and pivot for one trade date without touching the
+    request context, so it can run in worker threads.
+    Args:
+        trade_date (str): Trade date as YYYY-MM-DD.
+        engine: SQLAlchemy engine.
+        users_df (DataFrame, optional): Pre-loaded frame from load_users_frame, shared across dates.
+    Returns: (result_df, pivot_df, messages) where messages is a list of (category, message) tuples.
+    """
+    try:
+        datetime.strptime(trade_date, '%Y-%m-%d')
+    except ValueError:
+        return pd.DataFrame(), pd.DataFrame(), [("error", "Margin Shortfall Calculation: Invalid date format. Please use YYYY-MM-DD.")]
+
+    # Check the ob table has rows for trade_date (index range probe instead of a DISTINCT scan)
+    date_clause, date_params = date_equals('date', 'trade_date', trade_date)
+    with engine.connect() as connection:
+        result = connection.execute(text(f"SELECT 1 FROM ob WHERE {date_clause} LIMIT 1"), date_params)
+        if result.fetchone() is None and not archive.archived_parts('ob', trade_date, trade_date):
+            logger.warning(f"No data found for trade_date: {trade_date}")
+            return pd.DataFrame(), pd.DataFrame(), [("error", f"No data found for selected date: {trade_date}")]
+
+    if users_df is None:
+        users_df, messages = load_users_frame(engine)
         if users_df.empty:
-            flash("No user data found in the database.", "error")
-            logger.info("Users DataFrame is empty")
-            return pd.DataFrame(), pd.DataFrame()
-        if orderbook_df.empty:
-            flash(f"No orderbook data found for date {trade_date}.", "error")
-            logger.info(f"Orderbook DataFrame is empty for trade_date: {trade_date}")
-            return pd.DataFrame(), pd.DataFrame()
+            return pd.DataFrame(), pd.DataFrame(), messages
 
-        # Verify required columns
-        required_ob_columns = ['user_id', 'user_alias', 'exchange', 'order_date', 'order_time', 'status_message', 'status']
-        required_user_columns = ['user_id', 'alias', 'broker', 'mtm_all', 'allocation', 'max_loss', 'available_margin']
-        missing_ob_columns = [col for col in required_ob_columns if col not in orderbook_df.columns]
-        missing_user_columns = [col for col in required_user_columns if col not in users_df.columns]
-        if missing_ob_columns or missing_user_columns:
-            logger.error(f"Missing columns: ob: {missing_ob_columns}, users: {missing_user_columns}")
-            flash(f"Missing columns in database: ob: {missing_ob_columns}, users: {missing_user_columns}", "error")
-            return pd.DataFrame(), pd.DataFrame()
+    orderbook_query = f"""
+        SELECT user_id, user_alias, exchange, date AS order_date, order_time, status_message, status
+        FROM ob
+        WHERE {date_clause}
+        ORDER BY user_id, order_time
+    """
 
-        # Multiply allocation by 100
-        if 'allocation' in users_df.columns:
-            users_df['allocation'] = pd.to_numeric(users_df['allocation'], errors='coerce') * 100
-            users_df['allocation'] = users_df['allocation'].where(pd.notna(users_df['allocation']), None)
-        else:
-            logger.warning("Allocation column not found in users_df")
-            flash("Allocation column not found in users table", "error")
-            return pd.DataFrame(), pd.DataFrame()
-
-        # Rename columns
-        users_df = users_df.rename(columns={
-            'mtm_all': 'MTM (All)',
-            'max_loss': 'MAXLOSS',
-            'allocation': 'ALLOCATION'
-        })
-        orderbook_df = orderbook_df.rename(columns={
-            'user_alias': 'User Alias',
-            'order_date': 'Order Date',
-            'order_time': 'Order Time'
-        })
-
-        # Convert and clean User ID
-        users_df['user_id'] = users_df['user_id'].astype(str).str.strip().str.upper()
-        orderbook_df['user_id'] = orderbook_df['user_id'].astype(str).str.strip().str.upper()
-
-        # Remove duplicates in users_df
-        users_df = users_df.drop_duplicates(subset=['user_id'])
-
-        # Exclude specific users
-        excluded_users = ["CC_SISL_GS_DEALER", "GSPLDEAL", "GSPLDEALER"]
-        orderbook_df = orderbook_df[~orderbook_df["User Alias"].isin(excluded_users)]
-
-        # Convert datetime fields
-        orderbook_df['Order Date'] = pd.to_datetime(orderbook_df['Order Date'], errors='coerce').dt.date
+    logger.debug(f"Executing orderbook query with trade_date: {trade_date}")
+    try:
+        with engine.connect() as connection:
+            # Live rows from MySQL, archived months from Parquet (archive.py)
+            orderbook_df = archive.read_range(connection, 'ob', orderbook_query, date_params, trade_date, trade_date,
+                                              columns=['user_id', 'user_alias', 'exchange', 'date', 'order_time', 'status_message', 'status'],
+                                              rename={'date': 'order_date'}, order_by=['user_id', 'order_time'])
+            logger.debug(f"Orderbook query returned {len(orderbook_df)} rows for trade_date: {trade_date}")
+    except SQLAlchemyError as e:
+        logger.error(f"Orderbook query failed: {str(e)}")
+        return pd.DataFrame(), pd.DataFrame(), [("error", f"Orderbook query failed: {str(e)}")]
+
+    if orderbook_df.empty:
+        logger.info(f"Orderbook DataFrame is empty for trade_date: {trade_date}")
+        return pd.DataFrame(), pd.DataFrame(), [("error", f"No orderbook data found for date {trade_date}.")]
+
+    # Verify required columns
+    required_ob_columns = ['user_id', 'user_alias', 'exchange', 'order_date', 'order_time', 'status_message', 'status']
+    missing_ob_columns = [col for col in required_ob_columns if col not in orderbook_df.columns]
+    if missing_ob_columns:
+        logger.error(f"Missing columns: ob: {missing_ob_columns}")
+        return pd.DataFrame(), pd.DataFrame(), [("error", f"Missing columns in database: ob: {missing_ob_columns}, users: []")]
+
+    orderbook_df = orderbook_df.rename(columns={
+        'user_alias': 'User Alias',
+        'order_date': 'Order Date',
+        'order_time': 'Order Time'
+    })
+    orderbook_df['user_id'] = orderbook_df['user_id'].astype(str).str.strip().str.upper()
+
+    # Exclude specific users
+    excluded_users = ["CC_SISL_GS_DEALER", "GSPLDEAL", "GSPLDEALER"]
+    orderbook_df = orderbook_df[~orderbook_df["User Alias"].isin(excluded_users)]
+
+    # Convert datetime fields
+    orderbook_df['Order Date'] = pd.to_datetime(orderbook_df['Order Date'], errors='coerce').dt.date
+    # order_time is DATETIME(3), parsed at ingest; only a column of all NULLs needs converting
+    if not pd.api.types.is_datetime64_any_dtype(orderbook_df['Order Time']):
         orderbook_df['Order Time'] = pd.to_datetime(orderbook_df['Order Time'], errors='coerce')
-        if orderbook_df['Order Time'].isna().any():
-            min_valid_time = orderbook_df['Order Time'].min()
-            if pd.notna(min_valid_time):
-                orderbook_df['Order Time'] = orderbook_df['Order Time'].fillna(min_valid_time)
-            else:
-                orderbook_df['Order Time'] = orderbook_df['Order Time'].fillna(pd.Timestamp.now())
-
-        # Sort orderbook by user_id and Order Time
-        orderbook_df = orderbook_df.sort_values(['user_id', 'Order Time'])
-
-        # Extract shortfall
-        orderbook_df['Margin Shortfall'] = orderbook_df['status_message'].apply(extract_shortfall)
+    if orderbook_df['Order Time'].isna().any():
+        min_valid_time = orderbook_df['Order Time'].min()
+        if pd.notna(min_valid_time):
+            orderbook_df['Order Time'] = orderbook_df['Order Time'].fillna(min_valid_time)
+        else:
+            orderbook_df['Order Time'] = orderbook_df['Order Time'].fillna(pd.Timestamp.now())
+
+    # Already sorted by user_id and Order Time in SQL (NULL times sort first, as the fill above assumes)
+
+    # Extract shortfall
+    orderbook_df['Margin Shortfall'] = orderbook_df['status_message'].apply(extract_shortfall)
+
+    # Filter for orders with shortfall
+    shortfall_orders = orderbook_df[orderbook_df['Margin Shortfall'].notna()]
+
+    if len(shortfall_orders) == 0:
+        logger.info("No margin shortfall orders found")
+        return pd.DataFrame(), pd.DataFrame(), [("info", "No margin shortfall orders found.")]
+
+    # Get unique User IDs with shortfall
+    shortfall_users = shortfall_orders[['user_id']].drop_duplicates()
+
+    # Calculate total shortfall per user
+    total_shortfall = shortfall_orders.groupby('user_id')['Margin Shortfall'].sum().reset_index(name='Margin Shortfall_Total')
+
+    # Merge with shortfall orders
+    shortfall_users = shortfall_users.merge(
+        shortfall_orders[['user_id', 'Margin Shortfall', 'exchange', 'Order Date', 'Order Time']],
+        on='user_id',
+        how='left'
+    ).merge(
+        total_shortfall,
+        on='user_id',
+        how='left'
+    )
+
+    # Merge with user data
+    user_columns = ['user_id', 'alias', 'broker', 'MTM (All)', 'ALLOCATION', 'MAXLOSS', 'available_margin']
+    if 'algo' in users_df.columns:
+        user_columns.append('algo')
+    if 'server' in users_df.columns:
+        user_columns.append('server')
+    existing_columns = [col for col in user_columns if col in users_df.columns]
+    result_df = shortfall_users.merge(
+        users_df[existing_columns],
+        on='user_id',
+        how='left'
+    )
+
+    # Rename columns
+    result_df = result_df.rename(columns={
+        'user_id': 'User ID',
+        'alias': 'Alias',
+        'broker': 'Broker',
+        'available_margin': 'Available Margin',
+        'exchange': 'Exchange'
+    })
+
+    # Filter for specific exchanges
+    result_df = result_df[result_df['Exchange'].isin(['NFO', 'BFO'])]
+
+    # Calculate status counts
+    group_cols = ['user_id']
+    if 'algo' in users_df.columns:
+        group_cols.append('algo')
+    if 'server' in users_df.columns:
+        group_cols.append('server')
+    status_count = orderbook_df.merge(
+        users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
+        on='user_id',
+        how='left'
+    ).groupby(group_cols)['status'].value_counts().unstack(fill_value=0).reset_index()
+
+    # Calculate margin shortfall rejections
+    margin_shortfall = shortfall_orders[shortfall_orders['Margin Shortfall'] > 0]
+    rejections = margin_shortfall.merge(
+        users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
+        on='user_id',
+        how='left'
+    ).groupby(group_cols).size().reset_index(name='Margin Shortfall Rejections')
+
+    # Calculate total shortfall for pivot
+    shortfall_total_pivot = shortfall_orders.merge(
+        users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
+        on='user_id',
+        how='left'
+    ).groupby(group_cols)['Margin Shortfall'].sum().reset_index(name='Margin Shortfall_Total')
+
+    # Merge status counts with rejections and total shortfall
+    pivot_df = pd.merge(status_count, rejections, on=group_cols, how='left')
+    pivot_df = pd.merge(pivot_df, shortfall_total_pivot, on=group_cols, how='left')
+    pivot_df['Margin Shortfall Rejections'] = pivot_df['Margin Shortfall Rejections'].fillna(0).astype(int)
+    pivot_df['Margin Shortfall_Total'] = pivot_df['Margin Shortfall_Total'].fillna(0).round(2)
+
+    # Rename pivot_df columns
+    pivot_df = pivot_df.rename(columns={'user_id': 'User ID', 'algo': 'ALGO', 'server': 'SERVER'})
+
+    # Convert non-serializable types for JSON
+    result_df['Order Date'] = result_df['Order Date'].apply(
+        lambda x: x.strftime('%Y-%m-%d') if pd.notna(x) else ''
+    )
+    result_df['Order Time'] = result_df['Order Time'].apply(
+        lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else ''
+    )
+    # Convert numeric columns to Python float for JSON serialization
+    for col in result_df.select_dtypes(include=[np.integer, np.floating]).columns:
+        result_df[col] = result_df[col].astype(float).where(pd.notna(result_df[col]), None)
+    for col in pivot_df.select_dtypes(include=[np.integer, np.floating]).columns:
+        pivot_df[col] = pivot_df[col].astype(float).where(pd.notna(pivot_df[col]), None)
+
+    logger.info(f"Margin shortfall analysis completed for trade_date: {trade_date}")
+    logger.debug(f"Result_df rows: {len(result_df)}, Pivot_df rows: {len(pivot_df)}")
+    return result_df, pivot_df, []
 
-        # Filter for orders with shortfall
-        shortfall_orders = orderbook_df[orderbook_df['Margin Shortfall'].notna()]
+def analyze_margin_shortfalls(trade_date):
+    try:
+        engine = get_db_connection()
+        if not engine:
+            raise ValueError("Failed to establish database connection")
 
-        if len(shortfall_orders) == 0:
-            flash("No margin shortfall orders found.", "info")
-            logger.info("No margin shortfall orders found")
+        # Check if required tables exist
+        if not (schema_catalog.table_exists('users') or schema_catalog.table_exists('ob')):
+            available_tables = schema_catalog.get_tables()
+            logger.error(f"Tables 'users' or 'ob' not found. Available tables: {available_tables}")
+            flash(f"Required tables 'users' or 'ob' not found in database. Available tables: {available_tables}", "error")
             return pd.DataFrame(), pd.DataFrame()
 
-        # Get unique User IDs with shortfall
-        shortfall_users = shortfall_orders[['user_id']].drop_duplicates()
-
-        # Calculate total shortfall per user
-        total_shortfall = shortfall_orders.groupby('user_id')['Margin Shortfall'].sum().reset_index(name='Margin Shortfall_Total')
-
-        # Merge with shortfall orders
-        shortfall_users = shortfall_users.merge(
-            shortfall_orders[['user_id', 'Margin Shortfall', 'exchange', 'Order Date', 'Order Time']],
-            on='user_id',
-            how='left'
-        ).merge(
-            total_shortfall,
-            on='user_id',
-            how='left'
-        )
-
-        # Merge with user data
-        user_columns = ['user_id', 'alias', 'broker', 'MTM (All)', 'ALLOCATION', 'MAXLOSS', 'available_margin']
-        if 'algo' in users_df.columns:
-            user_columns.append('algo')
-        if 'server' in users_df.columns:
-            user_columns.append('server')
-        existing_columns = [col for col in user_columns if col in users_df.columns]
-        result_df = shortfall_users.merge(
-            users_df[existing_columns],
-            on='user_id',
-            how='left'
-        )
-
-        # Rename columns
-        result_df = result_df.rename(columns={
-            'user_id': 'User ID',
-            'alias': 'Alias',
-            'broker': 'Broker',
-            'available_margin': 'Available Margin',
-            'exchange': 'Exchange'
-        })
-
-        # Filter for specific exchanges
-        result_df = result_df[result_df['Exchange'].isin(['NFO', 'BFO'])]
-
-        # Calculate status counts
-        group_cols = ['user_id']
-        if 'algo' in users_df.columns:
-            group_cols.append('algo')
-        if 'server' in users_df.columns:
-            group_cols.append('server')
-        status_count = orderbook_df.merge(
-            users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
-            on='user_id',
-            how='left'
-        ).groupby(group_cols)['status'].value_counts().unstack(fill_value=0).reset_index()
-
-        # Calculate margin shortfall rejections
-        margin_shortfall = shortfall_orders[shortfall_orders['Margin Shortfall'] > 0]
-        rejections = margin_shortfall.merge(
-            users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
-            on='user_id',
-            how='left'
-        ).groupby(group_cols).size().reset_index(name='Margin Shortfall Rejections')
-
-        # Calculate total shortfall for pivot
-        shortfall_total_pivot = shortfall_orders.merge(
-            users_df[['user_id'] + [col for col in ['algo', 'server'] if col in users_df.columns]],
-            on='user_id',
-            how='left'
-        ).groupby(group_cols)['Margin Shortfall'].sum().reset_index(name='Margin Shortfall_Total')
-
-        # Merge status counts with rejections and total shortfall
-        pivot_df = pd.merge(status_count, rejections, on=group_cols, how='left')
-        pivot_df = pd.merge(pivot_df, shortfall_total_pivot, on=group_cols, how='left')
-        pivot_df['Margin Shortfall Rejections'] = pivot_df['Margin Shortfall Rejections'].fillna(0).astype(int)
-        pivot_df['Margin Shortfall_Total'] = pivot_df['Margin Shortfall_Total'].fillna(0).round(2)
-
-        # Rename pivot_df columns
-        pivot_df = pivot_df.rename(columns={'user_id': 'User ID', 'algo': 'ALGO', 'server': 'SERVER'})
-
-        # Convert non-serializable types for JSON
-        result_df['Order Date'] = result_df['Order Date'].apply(
-            lambda x: x.strftime('%Y-%m-%d') if pd.notna(x) else ''
-        )
-        result_df['Order Time'] = result_df['Order Time'].apply(
-            lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(x) else ''
-        )
-        # Convert numeric columns to Python float for JSON serialization
-        for col in result_df.select_dtypes(include=[np.integer, np.floating]).columns:
-            result_df[col] = result_df[col].astype(float).where(pd.notna(result_df[col]), None)
-        for col in pivot_df.select_dtypes(include=[np.integer, np.floating]).columns:
-            pivot_df[col] = pivot_df[col].astype(float).where(pd.notna(pivot_df[col]), None)
-
-        logger.info(f"Margin shortfall analysis completed for trade_date: {trade_date}")
-        logger.debug(f"Result_df rows: {len(result_df)}, Pivot_df rows: {len(pivot_df)}")
+        result_df, pivot_df, messages = compute_margin_shortfalls(trade_date, engine)
+        for category, msg in messages:
+            flash(msg, category)
         return result_df, pivot_df
 
     except Exception as e:
         handle_error(e, "Margin Shortfall Calculation")
         return pd.DataFrame(), pd.DataFrame()
 
+# Per-day pivot cache for range analysis. A day is cached only once it is closed
+# (before today). Pivots live in the cache backend shared by the worker processes, under a
+# generation number that every ob/users write path bumps through invalidate_shortfall_cache().
+MARGIN_RANGE_WORKERS = int(os.getenv('MARGIN_RANGE_WORKERS', 4))
+MARGIN_RANGE_MAX_DAYS = int(os.getenv('MARGIN_RANGE_MAX_DAYS', 92))
+MARGIN_PIVOT_CACHE_SIZE = 400
+MARGIN_PIVOT_TIMEOUT = int(os.getenv('MARGIN_PIVOT_TIMEOUT', 7 * 24 * 3600))
+PIVOT_GENERATION_KEY = 'margin_pivot_generation'
+_shared_cache = None
+# Used when no shared backend is attached
+_daily_pivot_cache = OrderedDict()
+_daily_pivot_cache_lock = threading.Lock()
+
+def attach_shared_cache(backend):
+    """Keep daily pivots in a flask-caching backend shared by all workers."""
+    global _shared_cache
+    _shared_cache = backend
+
+def _pivot_key(trade_date):
+    generation = _shared_cache.get(PIVOT_GENERATION_KEY) or 0
+    return f"margin_pivot:{generation}:{trade_date}"
+
+def invalidate_shortfall_cache(trade_date=None):
+    """Drop cached daily pivots after ob/users rows changed (uploads, edits, deletes, archiving), in every worker."""
+    with _daily_pivot_cache_lock:
+        _daily_pivot_cache.clear()
+    if _shared_cache is not None:
+        try:
+            # Entries of older generations are never read again and expire or get evicted
+            _shared_cache.inc(PIVOT_GENERATION_KEY)
+        except Exception as e:
+            logger.warning(f"Failed to invalidate margin pivot cache: {type(e).__name__} - {str(e)}")
+
+def _is_closed_day(trade_date):
+    return datetime.strptime(trade_date, '%Y-%m-%d').date() < date.today()
+
+def _cached_pivot(trade_date):
+    if _shared_cache is not None:
+        return _shared_cache.get(_pivot_key(trade_date))
+    with _daily_pivot_cache_lock:
+        cached = _daily_pivot_cache.get(trade_date)
+        if cached is not None:
+            _daily_pivot_cache.move_to_end(trade_date)
+        return cached
+
+def _store_pivot(trade_date, pivot_df):
+    if _shared_cache is not None:
+        _shared_cache.set(_pivot_key(trade_date), pivot_df, timeout=MARGIN_PIVOT_TIMEOUT)
+        return
+    with _daily_pivot_cache_lock:
+        _daily_pivot_cache[trade_date] = pivot_df.copy()
+        while len(_daily_pivot_cache) > MARGIN_PIVOT_CACHE_SIZE:
+            _daily_pivot_cache.popitem(last=False)
+
+def _store_closed_day_pivot(trade_date, pivot_df, messages):
+    if _is_closed_day(trade_date) and not any(category == 'error' for category, _ in messages):
+        _store_pivot(trade_date, pivot_df)
+
+def get_daily_shortfall_pivot(trade_date, engine, users_df):
+    """Return (pivot_df, messages) for one day, served from the closed-day cache when possible."""
+    cached = _cached_pivot(trade_date)
+    if cached is not None:
+        return cached.copy(), []
+
+    _, pivot_df, messages = compute_margin_shortfalls(trade_date, engine, users_df)
+    _store_closed_day_pivot(trade_date, pivot_df, messages)
+    return pivot_df, messages
+
+def get_trade_dates(engine, start_date, end_date):
+    """List the trade dates present in ob (live or archived) between start_date and end_date (inclusive)."""
+    date_clause, params = date_between('date', 'trade_date', start_date, end_date)
+    with engine.connect() as connection:
+        result = connection.execute(text(f"SELECT DISTINCT date FROM ob WHERE {date_clause} ORDER BY date"), params)
+        trade_dates = {row[0] for row in result.fetchall() if row[0]}
+    trade_dates |= archive.archived_dates('ob', start_date, end_date)
+    return [trade_date.strftime('%Y-%m-%d') for trade_date in sorted(trade_dates)]
+
+def merge_shortfall_pivots(pivots):
+    """Merge per-day pivots into a range summary keyed by User ID/ALGO/SERVER."""
+    frames = [pivot for pivot in pivots if not pivot.empty]
+    if not frames:
+        return pd.DataFrame()
+    combined = pd.concat(frames, ignore_index=True, sort=False)
+    group_cols = [col for col in ['User ID', 'ALGO', 'SERVER'] if col in combined.columns]
+    value_cols = [col for col in combined.columns if col not in group_cols]
+    combined[value_cols] = combined[value_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
+    merged = combined.groupby(group_cols, dropna=False)[value_cols].sum().reset_index()
+    merged['Margin Shortfall_Total'] = merged['Margin Shortfall_Total'].round(2)
+    for col in merged.select_dtypes(include=[np.integer, np.floating]).columns:
+        merged[col] = merged[col].astype(float).where(pd.notna(merged[col]), None)
+    return merged
+
+def analyze_margin_shortfall_range(start_date, end_date, max_workers=None):
+    """
+    Margin shortfall summary over a date range. Each trade date is computed by a worker
+    pool (or served from the closed-day cache) and the daily pivots are merged.
+    Returns: (pivot_df, trade_dates, messages)
+    """
+    engine = get_db_connection()
+    if not engine:
+        return pd.DataFrame(), [], [("error", "Failed to establish database connection")]
+
+    trade_dates = get_trade_dates(engine, start_date, end_date)
+    if not trade_dates:
+        return pd.DataFrame(), [], [("error", f"No data found between {start_date} and {end_date}")]
+
+    users_df, messages = load_users_frame(engine)
+    if users_df.empty:
+        return pd.DataFrame(), trade_dates, messages
+
+    workers = max(1, min(max_workers or MARGIN_RANGE_WORKERS, len(trade_dates)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='margin-range') as pool:
+        daily = list(pool.map(lambda d: get_daily_shortfall_pivot(d, engine, users_df), trade_dates))
+
+    errors = [(category, f"{trade_date}: {msg}") for trade_date, (_, day_messages) in zip(trade_dates, daily)
+              for category, msg in day_messages if category == 'error']
+    pivot_df = merge_shortfall_pivots([pivot for pivot, _ in daily])
+    logger.info(f"Margin shortfall range analysis {start_date}..{end_date}: {len(trade_dates)} days, {len(pivot_df)} pivot rows")
+    return pivot_df, trade_dates, errors
+
+def _xlsx_value(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def export_margin_shortfall_range(start_date, end_date, file_path, max_workers=None):
+    """
+    Stream a range export to file_path. Each trade date is computed once, one window of days
+    at a time: its detail rows are written row by row and its pivot is kept for the summary,
+    so only a few days of detail rows are held in memory at once.
+    """
+    engine = get_db_connection()
+    if not engine:
+        return False, [("error", "Failed to establish database connection")]
+
+    trade_dates = get_trade_dates(engine, start_date, end_date)
+    if not trade_dates:
+        return False, [("error", f"No data found between {start_date} and {end_date}")]
+
+    users_df, messages = load_users_frame(engine)
+    if users_df.empty:
+        return False, messages
+
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+    try:
+        # Worksheet order follows add_worksheet; constant_memory only needs each sheet written top-down
+        summary = workbook.add_worksheet('Summary')
+        details = workbook.add_worksheet('Details')
+        pivots = []
+        errors = []
+        detail_columns = None
+        row_idx = 0
+        workers = max(1, min(max_workers or MARGIN_RANGE_WORKERS, len(trade_dates)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='margin-export') as pool:
+            for window_start in range(0, len(trade_dates), workers):
+                window = trade_dates[window_start:window_start + workers]
+                daily = pool.map(lambda d: compute_margin_shortfalls(d, engine, users_df), window)
+                for trade_date, (result_df, pivot_df, day_messages) in zip(window, daily):
+                    _store_closed_day_pivot(trade_date, pivot_df, day_messages)
+                    pivots.append(pivot_df)
+                    errors.extend((category, f"{trade_date}: {msg}") for category, msg in day_messages
+                                  if category == 'error')
+                    if result_df.empty:
+                        continue
+                    if detail_columns is None:
+                        detail_columns = list(result_df.columns)
+                        details.write_row(row_idx, 0, detail_columns)
+                        row_idx += 1
+                    for row in result_df.reindex(columns=detail_columns).itertuples(index=False):
+                        details.write_row(row_idx, 0, [_xlsx_value(v) for v in row])
+                        row_idx += 1
+
+        pivot_df = merge_shortfall_pivots(pivots)
+        if pivot_df.empty:
+            return False, errors
+        summary.write_row(0, 0, list(pivot_df.columns))
+        for summary_idx, row in enumerate(pivot_df.itertuples(index=False), start=1):
+            summary.write_row(summary_idx, 0, [_xlsx_value(v) for v in row])
+    finally:
+        workbook.close()
+    logger.info(f"Exported margin shortfall range {start_date}..{end_date} to {file_path}: {len(trade_dates)} days, {len(pivot_df)} pivot rows")
+    return True, errors
+
 @margin_bp.route('/margin', methods=['GET', 'POST'])
 @require_role(['admin', 'user'])
 def margin_shortfall_page():
@@ -303,6 +513,7 @@ def margin_shortfall_page():
             session.modified = True
         session_id = session['session_id']
         trade_date = session.get('margin_trade_date', None)
+        end_date = session.get('margin_end_date', None)
         
         # Retrieve existing data from session
         result_data = session.get('margin_result_data', None)
@@ -310,21 +521,40 @@ def margin_shortfall_page():
 
         if request.method == 'POST':
             trade_date = request.form.get('trade_date')
+            end_date = request.form.get('end_date') or None
+            if end_date == trade_date:
+                end_date = None
             if not trade_date:
                 flash("Please select a date", "error")
                 logger.warning("No trade date provided in POST request")
                 return render_template('margin_shortfall.html', role=session.get('role'),
                                       result_data=result_data, pivot_data=pivot_data,
-                                      trade_date=trade_date)
+                                      trade_date=trade_date, end_date=end_date)
 
-            # Validate trade_date format
+            # Validate trade_date/end_date format
             try:
                 datetime.strptime(trade_date, '%Y-%m-%d')
+                if end_date:
+                    datetime.strptime(end_date, '%Y-%m-%d')
             except ValueError:
                 flash("Invalid date format. Please use YYYY-MM-DD.", "error")
                 return render_template('margin_shortfall.html', role=session.get('role'),
                                       result_data=result_data, pivot_data=pivot_data,
-                                      trade_date=trade_date)
+                                      trade_date=trade_date, end_date=end_date)
+
+            if end_date:
+                if end_date < trade_date:
+                    flash("End date must be on or after the start date.", "error")
+                    return render_template('margin_shortfall.html', role=session.get('role'),
+                                          result_data=result_data, pivot_data=pivot_data,
+                                          trade_date=trade_date, end_date=end_date)
+                day_count = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(trade_date, '%Y-%m-%d')).days + 1
+                if day_count > MARGIN_RANGE_MAX_DAYS:
+                    flash(f"Date range is limited to {MARGIN_RANGE_MAX_DAYS} days.", "error")
+                    return render_template('margin_shortfall.html', role=session.get('role'),
+                                          result_data=result_data, pivot_data=pivot_data,
+                                          trade_date=trade_date, end_date=end_date)
+                return margin_shortfall_range(trade_date, end_date, request.form.get('export') == 'xlsx')
 
             if request.form.get('export') == 'xlsx':
                 try:
@@ -334,7 +564,7 @@ def margin_shortfall_page():
                         flash("Session ID missing. Please analyze data first.", "error")
                         return render_template('margin_shortfall.html', role=session.get('role'),
                                               result_data=result_data, pivot_data=pivot_data,
-                                              trade_date=trade_date)
+                                              trade_date=trade_date, end_date=end_date)
 
                     result_data = session.get('margin_result_data', None)
                     pivot_data = session.get('margin_pivot_data', None)
@@ -343,7 +573,7 @@ def margin_shortfall_page():
                         flash("No margin shortfall data available to export.", "error")
                         return render_template('margin_shortfall.html', role=session.get('role'),
                                               result_data=result_data, pivot_data=pivot_data,
-                                              trade_date=trade_date)
+                                              trade_date=trade_date, end_date=end_date)
 
                     result_df = pd.DataFrame(result_data)
                     pivot_df = pd.DataFrame(pivot_data)
@@ -354,7 +584,7 @@ def margin_shortfall_page():
                         flash("No margin shortfall data available to export.", "error")
                         return render_template('margin_shortfall.html', role=session.get('role'),
                                               result_data=result_data, pivot_data=pivot_data,
-                                              trade_date=trade_date)
+                                              trade_date=trade_date, end_date=end_date)
 
                     # Ensure numeric columns are floats
                     for col in result_df.select_dtypes(include=['object']).columns:
@@ -381,7 +611,7 @@ def margin_shortfall_page():
                     flash(f"Failed to export data: {str(e)}", "error")
                     return render_template('margin_shortfall.html', role=session.get('role'),
                                           result_data=result_data, pivot_data=pivot_data,
-                                          trade_date=trade_date)
+                                          trade_date=trade_date, end_date=end_date)
 
             logger.debug(f"Calling analyze_margin_shortfalls with trade_date: {trade_date}")
             result_df, pivot_df = analyze_margin_shortfalls(trade_date)
@@ -390,7 +620,7 @@ def margin_shortfall_page():
                 flash("No margin shortfall data found for the selected date.", "error")
                 return render_template('margin_shortfall.html', role=session.get('role'),
                                       result_data=result_data, pivot_data=pivot_data,
-                                      trade_date=trade_date)
+                                      trade_date=trade_date, end_date=end_date)
 
             result_data = result_df.to_dict('records')
             pivot_data = pivot_df.to_dict('records')
@@ -398,16 +628,69 @@ def margin_shortfall_page():
             session['margin_result_data'] = result_data
             session['margin_pivot_data'] = pivot_data
             session['margin_trade_date'] = trade_date
+            session.pop('margin_end_date', None)
             session.modified = True
             flash(f"Margin shortfall calculated for {trade_date}", "success")
             logger.info(f"Margin shortfall data stored in session for session_id: {session_id}, trade_date: {trade_date}")
 
         return render_template('margin_shortfall.html', role=session.get('role'),
                               result_data=result_data, pivot_data=pivot_data,
-                              trade_date=trade_date)
+                              trade_date=trade_date, end_date=end_date)
 
     except Exception as e:
         handle_error(e, "Margin Shortfall Page")
         return render_template('margin_shortfall.html', role=session.get('role'),
                               result_data=result_data, pivot_data=pivot_data,
-                              trade_date=trade_date)
\ No newline at end of file
+                              trade_date=trade_date, end_date=end_date)
+
+def margin_shortfall_range(start_date, end_date, export):
+    """
+    Range mode for the margin page. Only the merged summary is kept in the session; details
+    are recomputed day by day and streamed straight into the export workbook.
+    """
+    if export:
+        fd, file_path = tempfile.mkstemp(suffix='.xlsx', prefix='margin_shortfall_')
+        os.close(fd)
+        try:
+            success, messages = export_margin_shortfall_range(start_date, end_date, file_path)
+        except Exception:
+            os.remove(file_path)
+            raise
+        if not success:
+            os.remove(file_path)
+            for category, msg in messages:
+                flash(msg, category)
+            flash("No margin shortfall data available to export.", "error")
+            return render_template('margin_shortfall.html', role=session.get('role'),
+                                  result_data=None, pivot_data=session.get('margin_pivot_data'),
+                                  trade_date=start_date, end_date=end_date)
+
+        response = send_file(
+            file_path,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'margin_shortfall_{start_date.replace("-", "")}_{end_date.replace("-", "")}.xlsx'
+        )
+        response.call_on_close(lambda: os.path.exists(file_path) and os.remove(file_path))
+        logger.info(f"Exporting margin shortfall range {start_date}..{end_date}")
+        return response
+
+    pivot_df, trade_dates, messages = analyze_margin_shortfall_range(start_date, end_date)
+    for category, msg in messages:
+        flash(msg, category)
+    if pivot_df.empty:
+        flash("No margin shortfall data found for the selected date range.", "error")
+        return render_template('margin_shortfall.html', role=session.get('role'),
+                              result_data=None, pivot_data=None,
+                              trade_date=start_date, end_date=end_date)
+
+    pivot_data = pivot_df.to_dict('records')
+    session['margin_result_data'] = None
+    session['margin_pivot_data'] = pivot_data
+    session['margin_trade_date'] = start_date
+    session['margin_end_date'] = end_date
+    session.modified = True
+    flash(f"Margin shortfall calculated for {len(trade_dates)} trade dates from {start_date} to {end_date}", "success")
+    return render_template('margin_shortfall.html', role=session.get('role'),
+                          result_data=None, pivot_data=pivot_data,
+                          trade_date=start_date, end_date=end_date)
@@ -0,0 +1,53 @@
+# migrate.py - apply schema migrations out of band, so web workers only check the version
+import argparse
+import os
+import sys
+
+# Importing app registers every component's migrations; don't let the import apply them.
+os.environ['MIGRATE_ON_STARTUP'] = 'false'
+
+from app import app
+from utils import get_db_connection, logger
+from migrations import migration_status, run_pending_migrations
+from partitions import maintain_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending MegaserveDB schema migrations")
+    parser.add_argument('--status', action='store_true', help="show schema versions without applying anything")
+    parser.add_argument('--component', action='append', help="limit to a component (core, jainam, auth); repeatable")
+    parser.add_argument('--partitions', action='store_true',
+                        help="partition ob/gridlog/users by month if needed and pre-create future partitions")
+    args = parser.parse_args()
+
+    engine = get_db_connection()
+    if engine is None:
+        print("Database connection failed", file=sys.stderr)
+        return 1
+
+    status = migration_status(engine)
+    for component, (version, latest) in sorted(status.items()):
+        state = "up to date" if version >= latest else f"{latest - version} pending"
+        print(f"{component}: v{version} (latest v{latest}, {state})")
+    if args.status:
+        return 0
+
+    try:
+        with app.app_context():
+            applied = run_pending_migrations(engine, args.component)
+    except Exception as e:
+        logger.error(f"Migration failed: {type(e).__name__} - {str(e)}")
+        return 1
+    for component, versions in applied.items():
+        for version, description in versions:
+            print(f"Applied {component} v{version}: {description}")
+    if not applied:
+        print("Nothing to apply")
+    if args.partitions:
+        for table_name, result in maintain_partitions(engine).items():
+            print(f"Partitions for {table_name}: {result}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
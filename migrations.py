@@ -0,0 +1,173 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import text
+from utils import logger
+import schema_catalog
+
+# Registered migrations per component: {component: {version: (description, function)}}
+MIGRATIONS = {}
+
+# Named MySQL lock held while migrations run, so workers starting together apply each one once
+MIGRATION_LOCK = 'schema_migrations'
+MIGRATION_LOCK_TIMEOUT = int(os.getenv('MIGRATION_LOCK_TIMEOUT', 600))
+
+
+def migration(component, version, description):
+    """
+    Register a schema migration. The function receives a connection inside a transaction
+    and is applied once per database; applied versions are recorded in schema_version.
+    """
+    def decorator(func):
+        registered = MIGRATIONS.setdefault(component, {})
+        if version in registered:
+            raise ValueError(f"Duplicate migration {component} v{version}")
+        registered[version] = (description, func)
+        return func
+    return decorator
+
+
+def ensure_version_table(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            component VARCHAR(64) NOT NULL,
+            version INT NOT NULL,
+            description VARCHAR(255),
+            applied_at DATETIME NOT NULL,
+            PRIMARY KEY (component, version)
+        ) ENGINE=InnoDB
+    """))
+
+
+def current_version(connection, component):
+    result = connection.execute(text("SELECT MAX(version) FROM schema_version WHERE component = :component"),
+                                {'component': component}).scalar()
+    return result or 0
+
+
+def pending_migrations(connection, component):
+    """Registered migrations newer than the database's version, in order."""
+    version = current_version(connection, component)
+    registered = MIGRATIONS.get(component, {})
+    return [(v, registered[v][0], registered[v][1]) for v in sorted(registered) if v > version]
+
+
+@contextmanager
+def migration_lock(engine, timeout=MIGRATION_LOCK_TIMEOUT):
+    """
+    Hold the MIGRATION_LOCK named lock (GET_LOCK) on a connection of its own for the block.
+    Raises RuntimeError when another process keeps it for longer than `timeout` seconds.
+    """
+    with engine.connect() as lock_connection:
+        acquired = lock_connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                           {'name': MIGRATION_LOCK, 'timeout': timeout}).scalar()
+        if acquired != 1:
+            raise RuntimeError(f"Timed out after {timeout}s waiting for the {MIGRATION_LOCK} lock")
+        try:
+            yield
+        finally:
+            lock_connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': MIGRATION_LOCK})
+
+
+def apply_migrations(engine, component):
+    """
+    Apply pending migrations for a component, each in its own transaction, under
+    migration_lock(). Pending versions are read once the lock is held, so a process that
+    waited for another one's migrations finds them applied.
+    Returns: list of (version, description) applied. Raises on the first failure,
+    leaving later migrations pending.
+    """
+    with migration_lock(engine):
+        return _apply_pending(engine, component)
+
+
+def _apply_pending(engine, component):
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        pending = pending_migrations(connection, component)
+
+    applied = []
+    for version, description, func in pending:
+        logger.info(f"Applying migration {component} v{version}: {description}")
+        try:
+            with engine.begin() as connection:
+                func(connection)
+                connection.execute(
+                    text("INSERT INTO schema_version (component, version, description, applied_at) VALUES (:component, :version, :description, :applied_at)"),
+                    {'component': component, 'version': version, 'description': description, 'applied_at': datetime.now()}
+                )
+        except Exception as e:
+            logger.error(f"Migration {component} v{version} failed: {type(e).__name__} - {str(e)}")
+            # MySQL DDL commits implicitly, so a failed migration may still have changed the schema
+            schema_catalog.invalidate()
+            raise
+        applied.append((version, description))
+    if applied:
+        logger.info(f"Applied {len(applied)} migration(s) for {component}")
+        schema_catalog.invalidate()
+    return applied
+
+
+def migration_status(engine):
+    """
+    Database version and latest registered version per component, read with a single query.
+    Returns: {component: (database_version, latest_version)}
+    """
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        rows = connection.execute(text("SELECT component, MAX(version) FROM schema_version GROUP BY component")).fetchall()
+    applied = {row[0]: row[1] for row in rows}
+    return {component: (applied.get(component, 0), max(registered))
+            for component, registered in MIGRATIONS.items() if registered}
+
+
+def run_pending_migrations(engine, components=None):
+    """Apply pending migrations for every registered component (or just `components`)."""
+    status = migration_status(engine)
+    applied = {}
+    for component, (version, latest) in sorted(status.items()):
+        if components and component not in components:
+            continue
+        if version < latest:
+            applied[component] = apply_migrations(engine, component)
+    return applied
+
+
+def migrate_on_startup(engine):
+    """
+    Startup hook: one version check, and migrations only when something is pending.
+    Set MIGRATE_ON_STARTUP=false to leave migrations to `python migrate.py`.
+    """
+    if not engine:
+        logger.error("Database connection failed; skipping the schema migration check")
+        return {}
+    status = migration_status(engine)
+    pending = {component: (version, latest) for component, (version, latest) in status.items() if version < latest}
+    if not pending:
+        logger.info("Database schema is up to date")
+        return {}
+    if os.environ.get('MIGRATE_ON_STARTUP', 'true').lower() in ('0', 'false', 'no'):
+        for component, (version, latest) in pending.items():
+            logger.warning(f"Schema for {component} is at v{version}, v{latest} available; run `python migrate.py`")
+        return {}
+    return {component: apply_migrations(engine, component) for component in sorted(pending)}
+
+
+def index_exists(connection, table_name, index_name):
+    return connection.execute(text(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = :index_name"),
+                              {'index_name': index_name}).fetchone() is not None
+
+
+def column_exists(connection, table_name, column_name):
+    return connection.execute(text(f"SHOW COLUMNS FROM `{table_name}` LIKE :column_name"),
+                              {'column_name': column_name}).fetchone() is not None
+
+
+def create_index(connection, table_name, index_name, columns):
+    """Create an index unless one with the same name already exists."""
+    if index_exists(connection, table_name, index_name):
+        return False
+    columns_sql = ", ".join(f"`{col}`" for col in columns)
+    connection.execute(text(f"CREATE INDEX `{index_name}` ON `{table_name}` ({columns_sql})"))
+    logger.info(f"Created index {index_name} on `{table_name}` ({columns_sql})")
+    return True
@@ -0,0 +1,279 @@
+import os
+import re
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from utils import get_db_connection, logger
+import schema_catalog
+
+# Tables that receive one server-day of rows per upload and are queried by `date`. Converting
+# them rebuilds each table, so it is not a startup migration: `python migrate.py --partitions`
+# (or maintain_partitions()) does it when the operator chooses.
+PARTITIONED_TABLES = ('ob', 'gridlog', 'users')
+PARTITION_COLUMN = 'date'
+# Monthly partitions kept ahead of the current month, so uploads never land in the catch-all
+FUTURE_MONTHS = int(os.getenv('PARTITION_FUTURE_MONTHS', 3))
+CATCH_ALL = 'pmax'
+_MONTH_PARTITION = re.compile(r'^p(\d{4})(\d{2})$')
+
+
+def _to_days(day):
+    """MySQL TO_DAYS() of a date."""
+    return day.toordinal() + 365
+
+
+def _from_days(days):
+    return date.fromordinal(int(days) - 365)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_sql(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ({_to_days(add_months(month, 1))})"
+
+
+def list_partitions(connection, table_name):
+    """
+    Partitions of a table in order, with the date range each one holds.
+    Returns: [{'name', 'start', 'end', 'rows'}]; start is None for the first partition
+    (which also holds older and NULL dates), end is None for the MAXVALUE catch-all.
+    Empty for a table that isn't partitioned.
+    """
+    rows = connection.execute(text("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """), {'table_name': table_name}).fetchall()
+    partitions = []
+    start = None
+    for name, description, table_rows in rows:
+        end = None if description == 'MAXVALUE' else _from_days(description)
+        partitions.append({'name': name, 'start': start, 'end': end, 'rows': table_rows or 0})
+        start = end
+    return partitions
+
+
+def partition_table(connection, table_name, future_months=FUTURE_MONTHS):
+    """
+    Convert a table to monthly RANGE partitions on TO_DAYS(date), from its oldest month to
+    `future_months` ahead, plus a MAXVALUE catch-all. MySQL requires the partition column in
+    every unique key, so the primary key becomes (row_id, date) and date becomes NOT NULL.
+    Partitioned InnoDB tables can't carry FULLTEXT indexes; those are dropped and searches
+    on the table use LIKE. Already partitioned tables just get their future partitions.
+    Returns: True when the table was converted.
+    """
+    if list_partitions(connection, table_name):
+        ensure_future_partitions(connection, table_name, future_months)
+        return False
+    columns = {row[0].lower(): row for row in connection.execute(text(f"SHOW COLUMNS FROM `{table_name}`")).fetchall()}
+    if PARTITION_COLUMN not in columns:
+        raise ValueError(f"`{table_name}` has no {PARTITION_COLUMN} column")
+    if not str(columns[PARTITION_COLUMN][1]).lower().startswith('date'):
+        raise ValueError(f"`{table_name}`.{PARTITION_COLUMN} is {columns[PARTITION_COLUMN][1]}, not DATE")
+    nulls = connection.execute(text(f"SELECT COUNT(*) FROM `{table_name}` WHERE `{PARTITION_COLUMN}` IS NULL")).scalar()
+    if nulls:
+        raise ValueError(f"`{table_name}` has {nulls} rows without a {PARTITION_COLUMN}; fix or delete them first")
+
+    primary_key = [row[4] for row in connection.execute(text(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = 'PRIMARY'")).fetchall()]
+    for key_name, non_unique in {(row[2], row[1]) for row in connection.execute(text(f"SHOW INDEX FROM `{table_name}`")).fetchall()}:
+        if key_name != 'PRIMARY' and not non_unique:
+            raise ValueError(f"`{table_name}` has unique index {key_name} without {PARTITION_COLUMN}")
+
+    oldest = connection.execute(text(f"SELECT MIN(`{PARTITION_COLUMN}`) FROM `{table_name}`")).scalar()
+    current = month_start(date.today())
+    month = month_start(oldest) if oldest and oldest < current else current
+    months = []
+    while month <= add_months(current, future_months):
+        months.append(month)
+        month = add_months(month, 1)
+
+    alterations = []
+    for row in connection.execute(text(f"SHOW INDEX FROM `{table_name}` WHERE Index_type = 'FULLTEXT'")).fetchall():
+        if f"DROP INDEX `{row[2]}`" not in alterations:
+            alterations.append(f"DROP INDEX `{row[2]}`")
+    alterations.append(f"MODIFY `{PARTITION_COLUMN}` {columns[PARTITION_COLUMN][1]} NOT NULL")
+    if PARTITION_COLUMN not in [col.lower() for col in primary_key]:
+        if primary_key:
+            alterations.append("DROP PRIMARY KEY")
+        key_columns = ", ".join(f"`{col}`" for col in primary_key + [PARTITION_COLUMN])
+        alterations.append(f"ADD PRIMARY KEY ({key_columns})")
+    partitions_sql = ",\n".join([_partition_sql(m) for m in months] + [f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE"])
+    # One ALTER, so the table is rebuilt once
+    connection.execute(text(f"""
+        ALTER TABLE `{table_name}` {', '.join(alterations)}
+        PARTITION BY RANGE (TO_DAYS(`{PARTITION_COLUMN}`)) (
+        {partitions_sql}
+        )
+    """))
+    logger.info(f"Partitioned `{table_name}` by month: {partition_name(months[0])} to {partition_name(months[-1])}")
+    schema_catalog.invalidate(table_name)
+    return True
+
+
+def ensure_future_partitions(connection, table_name, future_months=FUTURE_MONTHS):
+    """
+    Split the catch-all so monthly partitions exist up to `future_months` ahead.
+    Returns the names of the partitions created.
+    """
+    partitions = list_partitions(connection, table_name)
+    if not partitions or partitions[-1]['name'] != CATCH_ALL:
+        return []
+    last_end = partitions[-1]['start'] or month_start(date.today())
+    target = add_months(month_start(date.today()), future_months + 1)
+    months = []
+    month = last_end
+    while month < target:
+        months.append(month)
+        month = add_months(month, 1)
+    if not months:
+        return []
+    partitions_sql = ", ".join([_partition_sql(m) for m in months] + [f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE"])
+    connection.execute(text(f"ALTER TABLE `{table_name}` REORGANIZE PARTITION {CATCH_ALL} INTO ({partitions_sql})"))
+    created = [partition_name(m) for m in months]
+    logger.info(f"Added partitions to `{table_name}`: {', '.join(created)}")
+    return created
+
+
+def _month_partition(connection, table_name, month):
+    name = partition_name(month_start(month))
+    if name not in {p['name'] for p in list_partitions(connection, table_name)}:
+        raise ValueError(f"`{table_name}` has no partition {name}")
+    return name
+
+
+def drop_partition(connection, table_name, month):
+    """Drop the partition holding `month`, and its rows, in one metadata operation."""
+    name = _month_partition(connection, table_name, month)
+    connection.execute(text(f"ALTER TABLE `{table_name}` DROP PARTITION {name}"))
+    logger.info(f"Dropped partition {name} of `{table_name}`")
+    return name
+
+
+def truncate_partition(connection, table_name, name):
+    connection.execute(text(f"ALTER TABLE `{table_name}` TRUNCATE PARTITION {name}"))
+    logger.info(f"Truncated partition {name} of `{table_name}`")
+
+
+def create_exchange_table(connection, table_name, exchange_table):
+    """Empty, unpartitioned copy of a partitioned table's structure, for exchange_partition()."""
+    connection.execute(text(f"CREATE TABLE `{exchange_table}` LIKE `{table_name}`"))
+    connection.execute(text(f"ALTER TABLE `{exchange_table}` REMOVE PARTITIONING"))
+    schema_catalog.invalidate(exchange_table)
+
+
+def exchange_partition(connection, table_name, month, exchange_table, validate=True):
+    """
+    Swap the rows of the partition holding `month` with those of `exchange_table`, which
+    must have the same structure and no partitioning (see create_exchange_table()).
+    validate=False skips MySQL's check that the incoming rows belong to the month.
+    """
+    name = _month_partition(connection, table_name, month)
+    validation = "WITH VALIDATION" if validate else "WITHOUT VALIDATION"
+    connection.execute(text(f"ALTER TABLE `{table_name}` EXCHANGE PARTITION {name} WITH TABLE `{exchange_table}` {validation}"))
+    logger.info(f"Exchanged partition {name} of `{table_name}` with `{exchange_table}`")
+    return name
+
+
+def truncate_covered_partitions(connection, table_name, start, end):
+    """
+    Truncate the partitions whose rows all have start <= date < end (covered by the range, or
+    whose only rows are in it). Partition DDL commits implicitly.
+    Returns: (rows removed, names of the partitions that also hold rows outside the range).
+    """
+    removed = 0
+    partial = []
+    params = {'start': start, 'end': end}
+    in_range = f"`{PARTITION_COLUMN}` >= :start AND `{PARTITION_COLUMN}` < :end"
+    for partition in list_partitions(connection, table_name):
+        if (partition['end'] is not None and partition['end'] <= start) or \
+                (partition['start'] is not None and partition['start'] >= end):
+            continue
+        name = partition['name']
+        covered = partition['start'] is not None and partition['start'] >= start and \
+            partition['end'] is not None and partition['end'] <= end
+        if not covered:
+            outside = connection.execute(text(
+                f"SELECT 1 FROM `{table_name}` PARTITION ({name}) WHERE NOT ({in_range}) LIMIT 1"
+            ), params).fetchone()
+            covered = outside is None
+        if covered:
+            removed += connection.execute(text(f"SELECT COUNT(*) FROM `{table_name}` PARTITION ({name})")).scalar() or 0
+            truncate_partition(connection, table_name, name)
+        else:
+            partial.append(name)
+    return removed, partial
+
+
+def delete_date_range(connection, table_name, start, end):
+    """
+    Delete rows with start <= date < end. Partitions the range covers entirely (or whose only
+    rows are in it) are truncated; the rest get a DELETE restricted to the overlapping partitions.
+    Returns: number of rows removed.
+    """
+    removed, partial = truncate_covered_partitions(connection, table_name, start, end)
+    in_range = f"`{PARTITION_COLUMN}` >= :start AND `{PARTITION_COLUMN}` < :end"
+    for name in partial:
+        removed += connection.execute(text(f"DELETE FROM `{table_name}` PARTITION ({name}) WHERE {in_range}"),
+                                      {'start': start, 'end': end}).rowcount
+    return removed
+
+
+def date_range_for_match(match_type, value):
+    """
+    The [start, end) date range a manage_database bulk delete on `date` selects, when it selects
+    whole days: an exact YYYY-MM-DD, or a prefix of YYYY, YYYY-MM or YYYY-MM-DD. None otherwise.
+    """
+    value = (value or '').strip()
+    try:
+        if match_type == 'exact' or (match_type == 'starts' and len(value) == 10):
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+            return day, day + timedelta(days=1)
+        if match_type == 'starts' and len(value) == 7:
+            month = datetime.strptime(value, '%Y-%m').date()
+            return month, add_months(month, 1)
+        if match_type == 'starts' and len(value) == 4:
+            year = datetime.strptime(value, '%Y').date()
+            return year, date(year.year + 1, 1, 1)
+    except ValueError:
+        return None
+    return None
+
+
+def maintain_partitions(engine=None, tables=PARTITIONED_TABLES, future_months=FUTURE_MONTHS):
+    """
+    Convert any of `tables` not yet partitioned and keep future partitions ahead of today.
+    Run from `python migrate.py --partitions` (e.g. daily from cron) and after uploads.
+    Returns: {table: 'partitioned' | [created partitions] | 'error: ...'}
+    """
+    engine = engine or get_db_connection()
+    if not engine:
+        logger.error("Partition maintenance skipped: Database connection failed")
+        return {}
+    results = {}
+    for table_name in tables:
+        if not schema_catalog.table_exists(table_name):
+            continue
+        try:
+            with engine.begin() as connection:
+                if schema_catalog.is_partitioned(table_name):
+                    results[table_name] = ensure_future_partitions(connection, table_name, future_months)
+                elif partition_table(connection, table_name, future_months):
+                    results[table_name] = 'partitioned'
+        except Exception as e:
+            logger.error(f"Partition maintenance failed for `{table_name}`: {type(e).__name__} - {str(e)}")
+            results[table_name] = f"error: {type(e).__name__} - {str(e)}"
+        finally:
+            if results.get(table_name):
+                schema_catalog.invalidate(table_name)
+    return results
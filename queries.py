@@ -0,0 +1,217 @@
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+from flask import g, has_request_context
+from sqlalchemy import text, event, bindparam
+from utils import logger
+
+
+def _to_date(value):
+    """Coerce a 'YYYY-MM-DD' string, date or datetime to a date object."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').date()
+
+
+def date_equals(column, param, value):
+    """
+    Sargable replacement for `DATE(column) = :param`.
+    Returns the SQL fragment and the bind params for a half-open range on the raw column,
+    so an index whose leading column is `column` can be used for a range scan.
+    """
+    day = _to_date(value)
+    clause = f"`{column}` >= :{param}_start AND `{column}` < :{param}_end"
+    return clause, {f"{param}_start": day, f"{param}_end": day + timedelta(days=1)}
+
+
+def date_between(column, param, start, end):
+    """Sargable replacement for `DATE(column) BETWEEN :start AND :end` (both ends inclusive)."""
+    start_day = _to_date(start)
+    end_day = _to_date(end)
+    clause = f"`{column}` >= :{param}_start AND `{column}` < :{param}_end"
+    return clause, {f"{param}_start": start_day, f"{param}_end": end_day + timedelta(days=1)}
+
+
+def status_equals(column, param, value):
+    """
+    Sargable replacement for `UPPER(column) = 'VALUE'`.
+    The status columns use the server's default case-insensitive collation, so a plain
+    equality already matches 'COMPLETE', 'Complete' and 'complete' and can use the index.
+    """
+    return f"`{column}` = :{param}", {param: str(value).upper()}
+
+
+# Composite indexes backing the analytics queries in analysis.py and margin.py.
+# (table, index name, column list)
+ANALYTICS_INDEXES = [
+    ('ob', 'idx_ob_date_status_user', ['date', 'status', 'user_id']),
+]
+
+
+def ensure_analytics_indexes(connection):
+    """Create the composite indexes used by the orderbook analytics if they are missing."""
+    created = []
+    for table_name, index_name, index_columns in ANALYTICS_INDEXES:
+        try:
+            existing_columns = {row[0].lower() for row in connection.execute(text(f"SHOW COLUMNS FROM `{table_name}`")).fetchall()}
+            if not all(col.lower() in existing_columns for col in index_columns):
+                logger.warning(f"Skipping index {index_name}: `{table_name}` is missing one of {index_columns}")
+                continue
+            result = connection.execute(text(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = :index_name"), {"index_name": index_name})
+            if result.fetchone() is not None:
+                continue
+            columns_sql = ", ".join(f"`{col}`" for col in index_columns)
+            connection.execute(text(f"CREATE INDEX `{index_name}` ON `{table_name}` ({columns_sql})"))
+            created.append(index_name)
+            logger.info(f"Created index {index_name} on `{table_name}` ({columns_sql})")
+        except Exception as e:
+            logger.error(f"Error creating index {index_name} on `{table_name}`: {type(e).__name__} - {str(e)}")
+    return created
+
+
+def explain_plan(connection, query, params=None):
+    """Run EXPLAIN for a query and return the plan rows as dicts."""
+    result = connection.execute(text(f"EXPLAIN {query}"), params or {})
+    return [dict(row._mapping) for row in result.fetchall()]
+
+
+def uses_index(connection, query, params=None, index_name=None):
+    """
+    Check whether MySQL picks an index for the query.
+    With index_name, the plan must choose that index; otherwise any index (non-ALL access) counts.
+    """
+    plan = explain_plan(connection, query, params)
+    for row in plan:
+        key = row.get('key')
+        logger.debug(f"EXPLAIN table={row.get('table')} type={row.get('type')} key={key} rows={row.get('rows')}")
+        if index_name and key == index_name:
+            return True
+        if not index_name and key and row.get('type') != 'ALL':
+            return True
+    return False
+
+
+def attach_round_trip_counter(engine):
+    """
+    Count statements sent to the database per request (stored on flask.g), so N+1 query
+    patterns show up in the logs. Statements issued outside a request are not counted.
+    """
+    if getattr(engine, '_round_trip_counter', False):
+        return
+    engine._round_trip_counter = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count_round_trip(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.db_round_trips = g.get('db_round_trips', 0) + 1
+
+
+def get_round_trips():
+    """Number of statements executed so far in the current request."""
+    return g.get('db_round_trips', 0) if has_request_context() else 0
+
+
+@lru_cache(maxsize=1024)
+def cached_text(sql, expanding=()):
+    """
+    Return a shared text() construct for an SQL string. Parameters named in `expanding`
+    are bound as expanding IN lists, so `col IN :values` keeps one statement shape
+    regardless of how many values are passed.
+    """
+    statement = text(sql)
+    if expanding:
+        statement = statement.bindparams(*[bindparam(name, expanding=True) for name in expanding])
+    return statement
+
+
+class QueryBuilder:
+    """
+    Parameterised SELECT builder for one table.
+    Every filter is a bind parameter with a name that depends only on the filter's role,
+    so a given filter combination always renders the same SQL text. The SELECT, COUNT and
+    DISTINCT variants share the WHERE clause and are served from cached_text(), which keeps
+    SQLAlchemy's compiled cache warm across requests.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.conditions = []
+        self.params = {}
+        self.expanding = []
+
+    def where(self, condition, expanding=(), **params):
+        """Add a raw condition with its bind params; names in `expanding` are bound as IN lists."""
+        self.conditions.append(condition)
+        self.params.update(params)
+        for name in expanding:
+            if name not in self.expanding:
+                self.expanding.append(name)
+        return self
+
+    def where_in(self, column, param, values):
+        """`column IN :param` as an expanding bind parameter."""
+        self.conditions.append(f"{quote_column(column)} IN :{param}")
+        self.params[param] = list(values)
+        if param not in self.expanding:
+            self.expanding.append(param)
+        return self
+
+    def where_like_any(self, columns, param, value):
+        """Substring search across columns with a single bind parameter."""
+        if columns:
+            self.conditions.append("(" + " OR ".join(f"{quote_column(col)} LIKE :{param}" for col in columns) + ")")
+            self.params[param] = f"%{value}%"
+        return self
+
+    @property
+    def where_sql(self):
+        return " WHERE " + " AND ".join(self.conditions) if self.conditions else ""
+
+    def statement(self, sql):
+        """Cached text() for a statement built around this builder (keeps its expanding params)."""
+        return cached_text(sql, tuple(self.expanding))
+
+    def select(self, columns="*", order_by=None, paginate=False):
+        """SELECT statement; with paginate=True the caller binds :limit and :offset."""
+        sql = f"SELECT {columns} FROM {self.table}{self.where_sql}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if paginate:
+            sql += " LIMIT :limit OFFSET :offset"
+        return self.statement(sql)
+
+    def count(self):
+        return self.statement(f"SELECT COUNT(*) AS total FROM {self.table}{self.where_sql}")
+
+    def count_distinct(self, columns):
+        """Number of distinct combinations of `columns` matching the filters."""
+        return self.statement(f"SELECT COUNT(*) AS total FROM (SELECT DISTINCT {columns} FROM {self.table}{self.where_sql}) k")
+
+    def distinct(self, columns, order_by=None):
+        sql = f"SELECT DISTINCT {columns} FROM {self.table}{self.where_sql}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        return self.statement(sql)
+
+    def subquery(self, columns, group_by=None, order_by=None, paginate=False):
+        """SQL text for embedding this filtered set in a JOIN; uses the same params."""
+        sql = f"SELECT {columns} FROM {self.table}{self.where_sql}"
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if paginate:
+            sql += " LIMIT :limit OFFSET :offset"
+        return sql
+
+    def bind(self, **extra):
+        """Params for executing a statement from this builder, plus any extra binds."""
+        return dict(self.params, **extra)
+
+
+def quote_column(column):
+    """Backtick-quote a bare column name; leave expressions and qualified names alone."""
+    if column.startswith('`') or '.' in column or '(' in column:
+        return column
+    return f"`{column}`"
@@ -0,0 +1,177 @@
+import threading
+import time
+from sqlalchemy import text
+from utils import get_db_connection, logger
+
+# Safety net for DDL run outside this process (other workers, manual changes); DDL paths
+# in this app call invalidate() so their own changes are visible immediately.
+CATALOG_TTL = 300
+
+_catalog = None
+_loaded_at = 0.0
+_catalog_lock = threading.Lock()
+
+# Cache backend shared by the worker processes (see shared_cache.py). invalidate() bumps a
+# generation counter there, and every process reloads once it sees a new generation.
+GENERATION_KEY = 'schema_catalog_generation'
+_shared_cache = None
+_generation = None
+
+CATALOG_QUERY = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.EXTRA, s.INDEX_NAME, s.SEQ_IN_INDEX, s.NON_UNIQUE, s.INDEX_TYPE,
+           t.CREATE_OPTIONS
+    FROM information_schema.COLUMNS c
+    JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    LEFT JOIN information_schema.STATISTICS s
+           ON s.TABLE_SCHEMA = c.TABLE_SCHEMA AND s.TABLE_NAME = c.TABLE_NAME AND s.COLUMN_NAME = c.COLUMN_NAME
+    WHERE c.TABLE_SCHEMA = DATABASE()
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+
+def _load():
+    """
+    Read tables, columns, types, primary keys, indexes and partitioning for the current database in one query.
+    Returns: {table: {'columns': [...], 'types': {col: type}, 'generated': [...], 'primary_key': [...], 'partitioned': bool,
+                      'indexes': {name: {'columns': [...], 'unique': bool, 'type': 'BTREE' | 'FULLTEXT' | ...}}}}
+    """
+    engine = get_db_connection()
+    if not engine:
+        raise RuntimeError("Database connection failed")
+    with engine.connect() as connection:
+        rows = connection.execute(text(CATALOG_QUERY)).fetchall()
+
+    catalog = {}
+    for table_name, column_name, column_type, extra, index_name, seq_in_index, non_unique, index_type, create_options in rows:
+        table = catalog.setdefault(table_name, {'columns': [], 'types': {}, 'generated': [], 'primary_key': [], 'indexes': {},
+                                                'partitioned': 'partitioned' in (create_options or '').lower()})
+        if column_name not in table['types']:
+            table['columns'].append(column_name)
+            table['types'][column_name] = column_type
+            # 'VIRTUAL GENERATED' / 'STORED GENERATED'; not 'DEFAULT_GENERATED' (an expression default)
+            if (extra or '').upper() in ('VIRTUAL GENERATED', 'STORED GENERATED'):
+                table['generated'].append(column_name)
+        if index_name:
+            index = table['indexes'].setdefault(index_name, {'columns': [], 'unique': not non_unique, 'type': index_type})
+            index['columns'].append((seq_in_index, column_name))
+    for table in catalog.values():
+        # Rows arrive in column order; put each index's columns back in index order
+        for index in table['indexes'].values():
+            index['columns'] = [column for _, column in sorted(index['columns'])]
+        primary = table['indexes'].get('PRIMARY')
+        table['primary_key'] = list(primary['columns']) if primary else []
+    logger.info(f"Schema catalog loaded: {len(catalog)} tables")
+    return catalog
+
+
+def attach_shared_cache(backend):
+    """Broadcast invalidations through a flask-caching backend shared by all workers."""
+    global _shared_cache
+    _shared_cache = backend
+
+
+def _shared_generation():
+    if _shared_cache is None:
+        return None
+    try:
+        return _shared_cache.get(GENERATION_KEY) or 0
+    except Exception as e:
+        logger.warning(f"Error reading schema catalog generation: {type(e).__name__} - {str(e)}")
+        return None
+
+
+def get_catalog():
+    """The cached catalog, reloaded after invalidate() (in any process) or once CATALOG_TTL has passed."""
+    global _catalog, _loaded_at, _generation
+    generation = _shared_generation()
+    with _catalog_lock:
+        stale = generation is not None and generation != _generation
+        if _catalog is None or stale or time.monotonic() - _loaded_at > CATALOG_TTL:
+            try:
+                _catalog = _load()
+                _loaded_at = time.monotonic()
+                _generation = generation
+            except Exception as e:
+                logger.error(f"Error loading schema catalog: {type(e).__name__} - {str(e)}")
+                return _catalog or {}
+        return _catalog
+
+
+def invalidate(table=None):
+    """
+    Drop the cached catalog after DDL; the next lookup reloads it. Other worker processes
+    reload on their next lookup too, via the shared generation. `table` is for logging only.
+    """
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+    if _shared_cache is not None:
+        try:
+            _shared_cache.inc(GENERATION_KEY)
+        except Exception as e:
+            logger.warning(f"Error broadcasting schema catalog invalidation: {type(e).__name__} - {str(e)}")
+    logger.debug(f"Schema catalog invalidated{f' for {table}' if table else ''}")
+
+
+def _table(table_name):
+    catalog = get_catalog()
+    return catalog.get(table_name) or catalog.get(str(table_name).lower())
+
+
+def get_tables(prefix=None):
+    tables = sorted(get_catalog().keys())
+    if prefix:
+        tables = [table for table in tables if table.startswith(prefix)]
+    return tables
+
+
+def table_exists(table_name):
+    return _table(table_name) is not None
+
+
+def get_columns(table_name):
+    table = _table(table_name)
+    return list(table['columns']) if table else []
+
+
+def get_writable_columns(table_name):
+    """Columns an INSERT or UPDATE may set: get_columns() without generated columns, which MySQL rejects (error 3105)."""
+    table = _table(table_name)
+    return [column for column in table['columns'] if column not in table['generated']] if table else []
+
+
+def is_generated_column(table_name, column_name):
+    table = _table(table_name)
+    return bool(table) and any(column.lower() == str(column_name).lower() for column in table['generated'])
+
+
+def get_column_type(table_name, column_name):
+    table = _table(table_name)
+    if not table:
+        return None
+    for column, column_type in table['types'].items():
+        if column.lower() == str(column_name).lower():
+            return column_type
+    return None
+
+
+def get_primary_key(table_name, default=None):
+    """First primary key column of the table, or `default` when it has none."""
+    table = _table(table_name)
+    return table['primary_key'][0] if table and table['primary_key'] else default
+
+
+def index_exists(table_name, index_name):
+    table = _table(table_name)
+    return bool(table) and index_name in table['indexes']
+
+
+def get_indexes(table_name):
+    """{index name: {'columns': [...], 'unique': bool, 'type': str}} for the table."""
+    table = _table(table_name)
+    return dict(table['indexes']) if table else {}
+
+
+def is_partitioned(table_name):
+    table = _table(table_name)
+    return bool(table) and table['partitioned']
@@ -0,0 +1,125 @@
+import re
+from sqlalchemy import text
+from utils import get_db_connection, logger
+from queries import quote_column
+import schema_catalog
+
+# FULLTEXT indexes built by ensure_search_index() are named ft_search_<n>
+SEARCH_INDEX_PREFIX = 'ft_search_'
+# InnoDB allows at most 16 columns in one index
+MAX_FULLTEXT_COLUMNS = 16
+# Server default for the ngram parser; shorter search terms produce no tokens
+NGRAM_TOKEN_SIZE = 2
+TEXT_TYPES = ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext')
+# LIKE wildcards, quotes and the boolean-mode operators can't be expressed as an ngram phrase
+_EXOTIC_PATTERN = re.compile(r'[%_"\\*@<>()~+\-]')
+
+
+def text_columns(table_name, columns=None):
+    """Columns of the table (optionally limited to `columns`) that a FULLTEXT index can cover."""
+    wanted = {c.lower() for c in columns} if columns is not None else None
+    result = []
+    for column in schema_catalog.get_columns(table_name):
+        if wanted is not None and column.lower() not in wanted:
+            continue
+        column_type = (schema_catalog.get_column_type(table_name, column) or '').lower()
+        if column_type.split('(')[0] in TEXT_TYPES:
+            result.append(column)
+    return result
+
+
+def fulltext_indexes(table_name):
+    """Column lists of every FULLTEXT index on the table."""
+    return [index['columns'] for index in schema_catalog.get_indexes(table_name).values()
+            if index.get('type') == 'FULLTEXT']
+
+
+def ensure_search_index(table_name, engine=None):
+    """
+    Add ngram FULLTEXT indexes covering every text column not yet in one, in groups of at
+    most 16 columns. Run at ingest (upload jobs), not per request: the first FULLTEXT index
+    on an InnoDB table rebuilds it. Partitioned tables can't have FULLTEXT indexes and are
+    skipped (searches on them use LIKE). Returns the names of the indexes created.
+    """
+    if schema_catalog.is_partitioned(table_name):
+        return []
+    covered = {column.lower() for columns in fulltext_indexes(table_name) for column in columns}
+    uncovered = [column for column in text_columns(table_name) if column.lower() not in covered]
+    if not uncovered:
+        return []
+
+    engine = engine or get_db_connection()
+    if not engine:
+        logger.error(f"Cannot build search index on {table_name}: Database connection failed")
+        return []
+
+    existing = set(schema_catalog.get_indexes(table_name))
+    number = 1
+    created = []
+    try:
+        with engine.begin() as connection:
+            for i in range(0, len(uncovered), MAX_FULLTEXT_COLUMNS):
+                group = uncovered[i:i + MAX_FULLTEXT_COLUMNS]
+                while f"{SEARCH_INDEX_PREFIX}{number}" in existing:
+                    number += 1
+                index_name = f"{SEARCH_INDEX_PREFIX}{number}"
+                existing.add(index_name)
+                columns_sql = ", ".join(quote_column(column) for column in group)
+                connection.execute(text(f"ALTER TABLE `{table_name}` ADD FULLTEXT INDEX `{index_name}` ({columns_sql}) WITH PARSER ngram"))
+                created.append(index_name)
+                logger.info(f"Created search index {index_name} on `{table_name}` ({columns_sql})")
+    except Exception as e:
+        logger.error(f"Error building search index on {table_name}: {type(e).__name__} - {str(e)}")
+    finally:
+        if created:
+            schema_catalog.invalidate(table_name)
+    return created
+
+
+def is_indexable(value):
+    """Whether a search term can be served from an ngram index rather than a LIKE scan."""
+    value = value.strip()
+    return len(value) >= NGRAM_TOKEN_SIZE and not _EXOTIC_PATTERN.search(value)
+
+
+def search_condition(table_name, columns, param, value, cast=False):
+    """
+    Substring search for `value` across `columns` of a table.
+    Columns covered by a FULLTEXT index are searched with MATCH ... AGAINST as an ngram
+    phrase in BOOLEAN MODE; every other column (text or not, so numbers and dates match as
+    they do in the archived rows) keeps its LIKE, with cast=True wrapping it in
+    CAST(... AS CHAR). Terms the index can't express (wildcards, quotes, terms under 2
+    characters) use LIKE on all columns.
+    Returns: (sql, params), or (None, {}) for no columns.
+    """
+    if not columns:
+        return None, {}
+    like_params = {param: f"%{value}%"}
+
+    def like_sql(cols):
+        return " OR ".join(
+            f"{f'CAST({quote_column(col)} AS CHAR)' if cast else quote_column(col)} LIKE :{param}" for col in cols
+        )
+
+    indexes = fulltext_indexes(table_name) if is_indexable(value) else []
+    wanted = {column.lower() for column in columns}
+    usable = [cols for cols in indexes if {c.lower() for c in cols} <= wanted]
+    if not usable:
+        return "(" + like_sql(columns) + ")", like_params
+
+    covered = {c.lower() for cols in usable for c in cols}
+    leftover = [col for col in columns if col.lower() not in covered]
+    clauses = [f"MATCH({', '.join(quote_column(c) for c in cols)}) AGAINST (:{param}_ft IN BOOLEAN MODE)" for cols in usable]
+    params = {f"{param}_ft": f'"{value.strip()}"'}
+    if leftover:
+        clauses.append(like_sql(leftover))
+        params.update(like_params)
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def apply_search(builder, table_name, columns, param, value, cast=False):
+    """Add search_condition() to a QueryBuilder."""
+    condition, params = search_condition(table_name, columns, param, value, cast)
+    if condition:
+        builder.where(condition, **params)
+    return builder
@@ -0,0 +1,115 @@
+# serve.py - production entry point: waitress with a tuned thread pool, optional pre-fork workers
+import os
+import signal
+import socket
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from configure import APP_CONFIG, SERVER_CONFIG
+
+# Debug is never on in production, whatever FLASK_DEBUG says
+os.environ['FLASK_DEBUG'] = 'False'
+APP_CONFIG['DEBUG'] = False
+
+# One pooled connection per request thread, with headroom for the upload worker threads
+os.environ.setdefault('DB_POOL_SIZE', str(SERVER_CONFIG['THREADS']))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(max(SERVER_CONFIG['THREADS'] // 2, 4)))
+
+from waitress import serve
+from app import app, logger
+from utils import dispose_engines
+
+app.config['DEBUG'] = False
+
+
+def waitress_options():
+    return {
+        'threads': SERVER_CONFIG['THREADS'],
+        'connection_limit': SERVER_CONFIG['CONNECTION_LIMIT'],
+        'channel_timeout': SERVER_CONFIG['CHANNEL_TIMEOUT'],
+        'backlog': SERVER_CONFIG['BACKLOG'],
+        'send_bytes': SERVER_CONFIG['SEND_BYTES'],
+        'outbuf_overflow': SERVER_CONFIG['OUTBUF_OVERFLOW'],
+        'ident': 'MegaserveDB',
+    }
+
+
+def serve_single(host, port):
+    logger.info(f"Serving on {host}:{port} with {SERVER_CONFIG['THREADS']} threads")
+    serve(app, host=host, port=port, **waitress_options())
+
+
+def serve_prefork(host, port, workers):
+    """
+    Bind once in the parent, then fork `workers` waitress processes that accept on the
+    shared socket. Migrations already ran when the parent imported app; children that
+    exit unexpectedly are replaced until the parent is asked to stop.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(SERVER_CONFIG['BACKLOG'])
+    dispose_engines()
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve(app, sockets=[sock], **waitress_options())
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                children.discard(pid)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info(f"Serving on {host}:{port} with {workers} workers x {SERVER_CONFIG['THREADS']} threads")
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            spawn()
+    sock.close()
+
+
+def main():
+    host = APP_CONFIG['HOST']
+    port = APP_CONFIG['PORT']
+    workers = SERVER_CONFIG['WORKERS']
+    if workers > 1 and hasattr(os, 'fork'):
+        serve_prefork(host, port, workers)
+    else:
+        if workers > 1:
+            logger.warning("WAITRESS_WORKERS > 1 needs os.fork; running a single process")
+        serve_single(host, port)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
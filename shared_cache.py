@@ -0,0 +1,184 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from flask_caching.backends.base import BaseCache
+from utils import logger
+
+# tmpfs on Linux, so the cache lives in shared memory; elsewhere the temp directory
+DEFAULT_CACHE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# A hit refreshes its entry's LRU timestamp at most this often (seconds), so reads rarely write
+ACCESS_UPDATE_INTERVAL = 30
+
+
+class SQLiteCache(BaseCache):
+    """
+    flask-caching backend shared by every worker process on the host.
+    Entries live in one SQLite database (WAL mode, normally on /dev/shm), so a delete or
+    delete_memoized in one process is seen by all of them on their next read. The cache
+    is bounded to `threshold` entries; the least recently used ones are evicted first.
+    Counters (inc/dec, e.g. the generation keys other caches are built on) live in a table
+    of their own and are never evicted or expired.
+
+    Config: CACHE_TYPE='shared_cache.SQLiteCache', CACHE_DIR, CACHE_THRESHOLD, CACHE_DEFAULT_TIMEOUT.
+    """
+
+    def __init__(self, path, threshold=5000, default_timeout=300):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+        logger.info(f"Shared cache at {path} (max {threshold} entries)")
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        name = os.getenv('CACHE_NAME', 'megaservedb_cache.sqlite')
+        path = os.path.join(config.get('CACHE_DIR') or DEFAULT_CACHE_DIR, name)
+        return cls(path, threshold=config.get('CACHE_THRESHOLD', 5000),
+                   default_timeout=config.get('CACHE_DEFAULT_TIMEOUT', 300))
+
+    def _connection(self):
+        # One connection per thread and process; SQLite connections must not cross a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else float('inf')
+
+    def get(self, key):
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, expires, accessed FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                counter = connection.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+                return counter[0] if counter else None
+            value, expires, accessed = row
+            now = time.time()
+            if expires <= now:
+                connection.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+                return None
+            if now - accessed >= ACCESS_UPDATE_INTERVAL:
+                connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return pickle.loads(value)
+        except Exception as e:
+            logger.warning(f"Shared cache get failed for {key}: {type(e).__name__} - {str(e)}")
+            return None
+
+    def _write(self, key, value, timeout, replace):
+        connection = self._connection()
+        now = time.time()
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if not replace:
+                # An expired entry doesn't block add()
+                connection.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+            cursor = connection.execute(
+                f"{verb} INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), self._expiry(timeout), now)
+            )
+            written = cursor.rowcount > 0
+            if written:
+                self._evict(connection)
+            connection.execute("COMMIT")
+            return written
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection):
+        count = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.threshold:
+            connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            excess = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.threshold
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)", (excess,)
+                )
+
+    def set(self, key, value, timeout=None):
+        try:
+            return self._write(key, value, timeout, replace=True)
+        except Exception as e:
+            logger.warning(f"Shared cache set failed for {key}: {type(e).__name__} - {str(e)}")
+            return False
+
+    def add(self, key, value, timeout=None):
+        try:
+            return self._write(key, value, timeout, replace=False)
+        except Exception as e:
+            logger.warning(f"Shared cache add failed for {key}: {type(e).__name__} - {str(e)}")
+            return False
+
+    def delete(self, key):
+        try:
+            connection = self._connection()
+            deleted = connection.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+            deleted += connection.execute("DELETE FROM counters WHERE key = ?", (key,)).rowcount
+            return deleted > 0
+        except Exception as e:
+            logger.warning(f"Shared cache delete failed for {key}: {type(e).__name__} - {str(e)}")
+            return False
+
+    def has(self, key):
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT 1 FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+            return row is not None or connection.execute("SELECT 1 FROM counters WHERE key = ?", (key,)).fetchone() is not None
+        except Exception:
+            return False
+
+    def clear(self):
+        try:
+            connection = self._connection()
+            connection.execute("DELETE FROM cache")
+            connection.execute("DELETE FROM counters")
+            return True
+        except Exception as e:
+            logger.warning(f"Shared cache clear failed: {type(e).__name__} - {str(e)}")
+            return False
+
+    def inc(self, key, delta=1):
+        """
+        Atomic across processes: the read and write happen in one write transaction.
+        The counter lives in the counters table, out of reach of LRU eviction and expiry.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+            value = (row[0] if row else 0) + delta
+            connection.execute("INSERT OR REPLACE INTO counters (key, value) VALUES (?, ?)", (key, value))
+            connection.execute("COMMIT")
+            return value
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
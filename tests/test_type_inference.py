@@ -0,0 +1,68 @@
+from datetime import date
+from decimal import Decimal
+
+import pandas as pd
+
+from type_inference import coerce_for_column, infer_column_type, widen
+
+
+def test_infer_int_and_bigint():
+    assert infer_column_type(pd.Series(['1', '-20', '300'])) == ('INT', None)
+    assert infer_column_type(pd.Series(['1234567890123456789', '', '5'])) == ('BIGINT', None)
+
+
+def test_infer_integer_past_bigint_is_decimal_or_text():
+    sql_type, _ = infer_column_type(pd.Series(['9223372036854775808']))
+    assert sql_type != 'BIGINT'
+
+
+def test_infer_leading_zeros_stay_text():
+    assert infer_column_type(pd.Series(['007', '012'])) == ('VARCHAR(32)', None)
+
+
+def test_infer_decimal():
+    assert infer_column_type(pd.Series(['1.5', '22.25'])) == ('DECIMAL(4,2)', None)
+
+
+def test_infer_long_fraction_is_text():
+    sql_type, _ = infer_column_type(pd.Series(['0.123456789012']))
+    assert sql_type.startswith('VARCHAR')
+
+
+def test_infer_dates():
+    assert infer_column_type(pd.Series(['2024-01-31', '2024-02-01'])) == ('DATE', '%Y-%m-%d')
+    assert infer_column_type(pd.Series(['31/01/2024 10:15:00'])) == ('DATETIME', '%d/%m/%Y %H:%M:%S')
+
+
+def test_infer_blank_column():
+    assert infer_column_type(pd.Series(['', None, 'nan'])) == (None, None)
+
+
+def test_widen():
+    assert widen('INT', 'BIGINT') == 'BIGINT'
+    assert widen('BIGINT', 'DECIMAL(4,2)') == 'DECIMAL(21,2)'
+    assert widen('DATE', 'DATETIME') == 'DATETIME'
+    assert widen('INT', 'VARCHAR(32)') == 'VARCHAR(32)'
+    assert widen('VARCHAR(255)', 'VARCHAR(300)') == 'TEXT'
+    assert widen('TEXT', 'INT') == 'TEXT'
+    assert widen('DOUBLE', 'VARCHAR(32)') == 'DOUBLE'
+    assert widen(None, 'INT') == 'INT'
+
+
+def test_coerce_bigint_keeps_every_digit():
+    values = coerce_for_column(pd.Series(['1234567890123456789', '', '1234567890123456787']), 'BIGINT')
+    assert list(values) == [1234567890123456789, None, 1234567890123456787]
+
+
+def test_coerce_int_rounds_and_drops_garbage():
+    assert list(coerce_for_column(pd.Series(['2.5', '3.5', 'abc', 'NULL']), 'INT')) == [2, 4, None, None]
+
+
+def test_coerce_decimal_is_exact():
+    values = coerce_for_column(pd.Series(['12345678901234567.123', ' 0.1 ', '']), 'DECIMAL(20,3)')
+    assert list(values) == [Decimal('12345678901234567.123'), Decimal('0.1'), None]
+
+
+def test_coerce_date():
+    values = coerce_for_column(pd.Series(['31-01-2024', '']), 'DATE', '%d-%m-%Y')
+    assert list(values) == [date(2024, 1, 31), None]
@@ -0,0 +1,278 @@
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from utils import logger
+from migrations import migration
+
+# Date/datetime layouts seen in the uploaded reports, tried in order
+DATE_FORMATS = ['%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y']
+DATETIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%d-%m-%Y %H:%M:%S',
+                    '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M', '%d-%m-%Y %H:%M', '%d/%m/%Y %H:%M']
+# Time-of-day only values (no date); combined with the row's date when parsed
+TIME_FORMATS = ['%H:%M:%S', '%H:%M:%S.%f', '%H:%M']
+INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+BIGINT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+MAX_DECIMAL_PRECISION = 38
+# Longer fractions are kept as text rather than rounded into a DECIMAL
+MAX_DECIMAL_SCALE = 10
+MAX_VARCHAR = 255
+VARCHAR_BUCKETS = (32, 64, 128, 255)
+# Characters a value of each type needs when it is widened to VARCHAR
+TEXT_WIDTH = {'INT': 11, 'BIGINT': 20, 'DATE': 10, 'DATETIME': 26}
+BLANKS = ('', 'nan', 'none', 'null', 'na', 'n/a', 'nat', '<na>')
+KNOWN_TYPES = ('INT', 'BIGINT', 'DECIMAL', 'DATE', 'DATETIME', 'VARCHAR', 'TEXT', 'MEDIUMTEXT', 'LONGTEXT')
+
+
+@migration('type_inference', 1, 'inferred_schema table')
+def migrate_inferred_schema(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS inferred_schema (
+            table_name VARCHAR(255) NOT NULL,
+            column_name VARCHAR(255) NOT NULL,
+            inferred_type VARCHAR(64) NOT NULL,
+            rows_sampled BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY (table_name, column_name)
+        ) ENGINE=InnoDB
+    """))
+
+
+def _present(series):
+    """Non-blank values of a column, as a Series."""
+    series = series.dropna()
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        stripped = series.astype(str).str.strip()
+        return series[~stripped.str.lower().isin(BLANKS)]
+    return series
+
+
+def _match_format(values, formats):
+    for fmt in formats:
+        if pd.to_datetime(values, format=fmt, errors='coerce').notna().all():
+            return fmt
+    return None
+
+
+def _decimal_type(values):
+    """DECIMAL(p,s) wide enough for every value's integer and fractional digits; None when no DECIMAL holds them exactly."""
+    parts = values.astype(str).str.strip().str.lstrip('+-').str.split('.', n=1, expand=True)
+    int_digits = int(parts[0].str.lstrip('0').str.len().max() or 1)
+    scale = int(parts[1].fillna('').str.rstrip('0').str.len().max()) if parts.shape[1] > 1 else 0
+    scale = max(scale, 1)
+    precision = max(int_digits, 1) + scale
+    if scale > MAX_DECIMAL_SCALE or precision > MAX_DECIMAL_PRECISION:
+        return None
+    return f"DECIMAL({precision},{scale})"
+
+
+def _varchar_type(length):
+    for bucket in VARCHAR_BUCKETS:
+        if length <= bucket:
+            return f"VARCHAR({bucket})"
+    return "TEXT"
+
+
+def infer_column_type(series):
+    """
+    Infer a MySQL type for one column, vectorised over all its values.
+    Returns: (sql_type, date_format) where date_format is the strptime layout for string
+    dates (None otherwise), or (None, None) when the column has no values.
+    """
+    values = _present(series)
+    if values.empty:
+        return None, None
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        has_time = (values.dt.normalize() != values).any()
+        return ("DATETIME" if has_time else "DATE"), None
+    if pd.api.types.is_bool_dtype(values):
+        return "INT", None
+
+    strings = values.astype(str).str.strip()
+    numbers = pd.to_numeric(strings, errors='coerce')
+    if numbers.notna().all():
+        # Leading zeros (codes, phone numbers) must survive, so those stay text
+        if not strings.str.match(r'^[+-]?0\d').any():
+            integral = np.isfinite(numbers).all() and (numbers == np.floor(numbers)).all() and not strings.str.contains(r'[.eE]').any()
+            if integral:
+                # Range checked on exact integers; float64 can't tell values near 2**63 apart
+                integers = strings.str.lstrip('+').map(int)
+                low, high = integers.min(), integers.max()
+                if INT_RANGE[0] <= low and high <= INT_RANGE[1]:
+                    return "INT", None
+                if BIGINT_RANGE[0] <= low and high <= BIGINT_RANGE[1]:
+                    return "BIGINT", None
+            elif not strings.str.contains(r'[eE]').any():
+                decimal_type = _decimal_type(strings)
+                if decimal_type:
+                    return decimal_type, None
+
+    fmt = _match_format(strings, DATE_FORMATS)
+    if fmt:
+        return "DATE", fmt
+    fmt = _match_format(strings, DATETIME_FORMATS)
+    if fmt:
+        return "DATETIME", fmt
+
+    return _varchar_type(int(strings.str.len().max())), None
+
+
+def infer_frame_types(df):
+    """{column: (sql_type, date_format)} for every column of a DataFrame."""
+    return {col: infer_column_type(df[col]) for col in df.columns}
+
+
+def _parse(sql_type):
+    match = re.match(r'^\s*(\w+)\s*(?:\(([\d,\s]+)\))?', str(sql_type or ''))
+    if not match:
+        return 'TEXT', ()
+    base = match.group(1).upper()
+    args = tuple(int(a) for a in match.group(2).split(',')) if match.group(2) else ()
+    return base, args
+
+
+def _text_width(sql_type):
+    base, args = _parse(sql_type)
+    if base == 'VARCHAR':
+        return args[0] if args else MAX_VARCHAR
+    if base == 'DECIMAL':
+        return (args[0] if args else 10) + 2
+    return TEXT_WIDTH.get(base, MAX_VARCHAR + 1)
+
+
+def widen(current, new):
+    """
+    Smallest type that holds values of both `current` and `new`. Types only ever widen:
+    INT -> BIGINT -> DECIMAL, DATE -> DATETIME, anything -> VARCHAR(n) -> TEXT.
+    """
+    if not current:
+        return new
+    if not new:
+        return current
+    cur_base, cur_args = _parse(current)
+    new_base, new_args = _parse(new)
+    if cur_base not in KNOWN_TYPES:
+        # Columns of other types (DOUBLE, ENUM, ...) were defined by hand; never touch them
+        return current
+    if cur_base in ('TEXT', 'MEDIUMTEXT', 'LONGTEXT') or new_base in ('TEXT', 'MEDIUMTEXT', 'LONGTEXT'):
+        return current if cur_base in ('TEXT', 'MEDIUMTEXT', 'LONGTEXT') else 'TEXT'
+    if cur_base == new_base and cur_base in ('INT', 'BIGINT', 'DATE', 'DATETIME'):
+        return current
+
+    integers = ('INT', 'BIGINT')
+    if cur_base in integers and new_base in integers:
+        return 'BIGINT'
+    numeric = integers + ('DECIMAL',)
+    if cur_base in numeric and new_base in numeric:
+        def digits(base, args):
+            # (integer digits, scale)
+            if base == 'INT':
+                return 10, 0
+            if base == 'BIGINT':
+                return 19, 0
+            if len(args) >= 2:
+                return args[0] - args[1], args[1]
+            return (args[0] if args else 10), 0
+        cur_int, cur_scale = digits(cur_base, cur_args)
+        new_int, new_scale = digits(new_base, new_args)
+        scale = max(cur_scale, new_scale)
+        precision = max(cur_int, new_int) + scale
+        if precision <= MAX_DECIMAL_PRECISION:
+            return f"DECIMAL({precision},{scale})"
+    elif {cur_base, new_base} == {'DATE', 'DATETIME'}:
+        return 'DATETIME'
+
+    width = max(_text_width(current), _text_width(new))
+    return _varchar_type(width)
+
+
+def is_wider(current, new):
+    """True when `new` is a strict widening of `current` (so a MODIFY is needed)."""
+    return bool(current) and widen(current, new).upper() != str(current).upper()
+
+
+def _exact_number(value, integer):
+    """A value as an exact Python int (rounded half to even) or Decimal; None when it isn't a finite number."""
+    if isinstance(value, (bool, int, np.integer)):
+        return int(value) if integer else Decimal(int(value))
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite():
+        return None
+    return int(number.to_integral_value()) if integer else number
+
+
+def coerce_for_column(series, sql_type, date_format=None):
+    """
+    Convert a column's values for insertion into a column of `sql_type`: numbers and
+    dates are parsed (string dates with the inferred layout); blanks become None.
+    Numbers are parsed to Python ints / Decimals, never through float64, so BIGINT ids and
+    long DECIMALs keep every digit.
+    """
+    base, _ = _parse(sql_type)
+    present = series.notna() & ~series.astype(str).str.strip().str.lower().isin(BLANKS)
+    if base in ('INT', 'BIGINT', 'DECIMAL'):
+        integer = base != 'DECIMAL'
+        return pd.Series([_exact_number(value, integer) if is_present else None
+                          for value, is_present in zip(series, present)], index=series.index, dtype=object)
+    elif base in ('DATE', 'DATETIME'):
+        if pd.api.types.is_datetime64_any_dtype(series):
+            converted = series
+        else:
+            converted = pd.to_datetime(series.where(present), format=date_format, errors='coerce')
+        if base == 'DATE':
+            converted = converted.dt.date
+    else:
+        return series.where(present, None)
+    return converted.astype(object).where(converted.notna(), None)
+
+
+def parse_datetime_column(series, dates=None):
+    """
+    Parse a timestamp column once, at ingest. One layout from DATETIME_FORMATS/DATE_FORMATS is
+    used when every value matches it; time-of-day values are placed on `dates` (the rows'
+    date) when given; anything else falls back to pandas' own parsing.
+    Returns: (parsed, unparsed) Series - datetimes (None when blank or unparseable), and the
+    original text of the non-blank values that failed to parse (None elsewhere).
+    """
+    present = series.notna() & ~series.astype(str).str.strip().str.lower().isin(BLANKS)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        parsed = series
+    else:
+        strings = series.astype(str).str.strip().where(present)
+        values = strings[present]
+        fmt = _match_format(values, DATETIME_FORMATS + DATE_FORMATS) if not values.empty else None
+        time_fmt = _match_format(values, TIME_FORMATS) if not fmt and dates is not None and not values.empty else None
+        if fmt:
+            parsed = pd.to_datetime(strings, format=fmt, errors='coerce')
+        elif time_fmt:
+            times = pd.to_datetime(strings, format=time_fmt, errors='coerce')
+            days = pd.to_datetime(pd.Series(dates, index=series.index), errors='coerce').dt.normalize()
+            parsed = days + (times - times.dt.normalize())
+        else:
+            parsed = pd.to_datetime(strings, errors='coerce')
+    failed = present & parsed.isna()
+    unparsed = series.astype(str).where(failed, None)
+    return parsed.astype(object).where(parsed.notna(), None), unparsed
+
+
+def record_inferred_schema(connection, table_name, types, rows_sampled):
+    """Upsert the inferred type of each column into inferred_schema."""
+    rows = [{'table_name': table_name, 'column_name': col, 'inferred_type': sql_type,
+             'rows_sampled': rows_sampled, 'updated_at': datetime.now()}
+            for col, sql_type in types.items() if sql_type]
+    if not rows:
+        return
+    connection.execute(text("""
+        INSERT INTO inferred_schema (table_name, column_name, inferred_type, rows_sampled, updated_at)
+        VALUES (:table_name, :column_name, :inferred_type, :rows_sampled, :updated_at)
+        ON DUPLICATE KEY UPDATE inferred_type = VALUES(inferred_type),
+                                rows_sampled = rows_sampled + VALUES(rows_sampled),
+                                updated_at = VALUES(updated_at)
+    """), rows)
+    logger.debug(f"Recorded inferred schema for {table_name}: {types}")
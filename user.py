@@ -1,10 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response
 from utils import get_db_connection, get_tables, get_table_columns
+import schema_catalog
 from pymysql.cursors import DictCursor
-from mapping import table_mappings, normalize_column_name
 import logging
 from datetime import datetime
-import threading
 import os
 import tempfile
 import shutil
@@ -67,23 +66,20 @@ def upload_files():
             flash("No valid files (CSV, XLSX, XLS, XLSB) uploaded", "error")
             return redirect(url_for('user.user_home'))
         
-        result_list = []
-        event = threading.Event()
-        uploaded_by = session.get('role', 'unknown')  # Capture uploaded_by from session
-        thread, event = user_bp.upload_files_to_table(
-            temp_dir, table_name, result_list, event, uploaded_by, has_header=has_header
-        )
-        thread.join()
-        
-        for category, message in result_list:
-            flash(message, category)
-        logger.info(f"Upload completed for table: {table_name}, results: {result_list}")
+        uploaded_by = session.get('role', 'unknown')
+        job_id = user_bp.enqueue_upload(temp_dir, table_name, uploaded_by, has_header=has_header, cleanup=True)
+        # The job owns temp_dir from here and removes it when it finishes
+        temp_dir = None
+        flash(f"Upload queued as job {job_id}", "info")
+        logger.info(f"Upload queued for table: {table_name}, job: {job_id}")
+        return redirect(url_for('user.user_home', job=job_id))
     
     except Exception as e:
         logger.error(f"Error uploading files: {str(e)}")
         flash(f"Error uploading files: {str(e)}", "error")
     finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
     
     return redirect(url_for('user.user_home'))
 
@@ -156,174 +152,172 @@ def user_aggregate():
         return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
 
     try:
-        with engine.connect() as conn:
-            # Verify users table exists
-            result = conn.execute(text("SHOW TABLES LIKE 'users'"))
-            if not result.fetchall():
-                flash("Table 'users' does not exist. Please create it and upload data.", "error")
-                return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
-
-            # Read users table
-            summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
-            logger.info(f"Read {len(summary)} rows from users")
-
-            # Log data types and sample values for debugging
-            logger.info(f"users dtypes: {summary.dtypes.to_dict()}")
-            logger.info(f"users user_id sample: {summary['user_id'].head().tolist()}")
-
-            # Cleaning function for user_id
-            def clean_user_id(uid):
-                try:
-                    if uid is None or pd.isna(uid):
-                        return ''
-                    uid = str(uid).strip()
-                    if uid and uid.startswith('0'):
-                        uid = uid[1:]
-                    return uid
-                except Exception as e:
-                    logger.error(f"Error cleaning user_id {uid} (type: {type(uid)}): {str(e)}")
-                    return str(uid) if uid is not None else ''
-
-            # Clean summary
-            required_summary_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
-            if not required_summary_columns.issubset(summary.columns):
-                missing_cols = required_summary_columns - set(summary.columns)
-                logger.warning(f"Required columns missing in users table: {missing_cols}")
-                flash(f"Required columns {missing_cols} missing in users table", "error")
-                return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
-
-            summary['user_id'] = summary['user_id'].apply(clean_user_id)
-            summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
-
-            # Convert numeric columns in summary
-            numeric_columns = ['allocation', 'mtm_all']
-            optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
-            for col in numeric_columns + optional_columns:
-                if col in summary.columns:
-                    summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
-
-            # Get all user IDs for the dropdown
-            all_user_ids = sorted(summary['user_id'].unique().tolist())
-            logger.info(f"All user IDs: {len(all_user_ids)}")
-
-            # Apply date filter if provided
-            total_mtm = None
-            num_users = None
-            servers = None
-            if selected_date:
-                try:
-                    selected_date = pd.to_datetime(selected_date).date()
-                    filtered_summary = summary[summary['date'] == selected_date]
-                    logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
-                except ValueError:
-                    logger.warning(f"Invalid date format: {selected_date}")
-                    flash("Invalid date format", "error")
-                    return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+        # Verify users table exists
+        if not schema_catalog.table_exists('users'):
+            flash("Table 'users' does not exist. Please create it and upload data.", "error")
+            return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
 
-                # Check if data exists for the selected date
-                if filtered_summary.empty:
-                    logger.warning(f"No data found for date={selected_date}")
-                    flash(f"No data found for the selected date {selected_date}", "warning")
-                    return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+        # Read users table
+        summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
+        logger.info(f"Read {len(summary)} rows from users")
 
-                # Filter out rows where SERVER is "5 Total"
-                filtered_summary = filtered_summary[filtered_summary['server'] != '5 Total']
-
-                # Exclude users with zero or null in allocation or mtm_all
-                filtered_summary = filtered_summary[
-                    (filtered_summary['allocation'].notnull()) & 
-                    (filtered_summary['allocation'] != 0) & 
-                    (filtered_summary['mtm_all'].notnull()) & 
-                    (filtered_summary['mtm_all'] != 0)
-                ]
-                logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
-                # Exclude users with 'DEAL' in alias (case-insensitive)
-                filtered_summary = filtered_summary[
-                    ~filtered_summary['alias'].str.contains('DEAL', case=False, na=False)
-                ]
-                logger.info(f"After filtering out users with 'DEAL' in alias : {len(filtered_summary)} rows")
-
-                # Exclude users with zero or null in max_loss and mtm_all, except for algo == 5
-                filtered_summary = filtered_summary[
-                    ~(
-                        (filtered_summary['max_loss'].isnull() | (filtered_summary['max_loss'] == 0)) &
-                        (filtered_summary['mtm_all'].isnull() | (filtered_summary['mtm_all'] == 0)) &
-                        (filtered_summary['algo'] != 5)
-                    )
-                ]
-                logger.info(f"After filtering out zero/null max_loss and mtm_all (except algo 5): {len(filtered_summary)} rows")
+        # Log data types and sample values for debugging
+        logger.info(f"users dtypes: {summary.dtypes.to_dict()}")
+        logger.info(f"users user_id sample: {summary['user_id'].head().tolist()}")
 
-                # Exclude user_id '92176368'
-                filtered_summary = filtered_summary[
-                    filtered_summary['user_id'] != '92176368'
-                ]
-                logger.info(f"After filtering out user_id '92176368': {len(filtered_summary)} rows")
+        # Cleaning function for user_id
+        def clean_user_id(uid):
+            try:
+                if uid is None or pd.isna(uid):
+                    return ''
+                uid = str(uid).strip()
+                if uid and uid.startswith('0'):
+                    uid = uid[1:]
+                return uid
+            except Exception as e:
+                logger.error(f"Error cleaning user_id {uid} (type: {type(uid)}): {str(e)}")
+                return str(uid) if uid is not None else ''
+
+        # Clean summary
+        required_summary_columns = {'user_id', 'date', 'allocation', 'mtm_all', 'server', 'algo'}
+        if not required_summary_columns.issubset(summary.columns):
+            missing_cols = required_summary_columns - set(summary.columns)
+            logger.warning(f"Required columns missing in users table: {missing_cols}")
+            flash(f"Required columns {missing_cols} missing in users table", "error")
+            return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=[])
+
+        summary['user_id'] = summary['user_id'].apply(clean_user_id)
+        summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
+
+        # Convert numeric columns in summary
+        numeric_columns = ['allocation', 'mtm_all']
+        optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
+        for col in numeric_columns + optional_columns:
+            if col in summary.columns:
+                summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
+
+        # Get all user IDs for the dropdown
+        all_user_ids = sorted(summary['user_id'].unique().tolist())
+        logger.info(f"All user IDs: {len(all_user_ids)}")
+
+        # Apply date filter if provided
+        total_mtm = None
+        num_users = None
+        servers = None
+        if selected_date:
+            try:
+                selected_date = pd.to_datetime(selected_date).date()
+                filtered_summary = summary[summary['date'] == selected_date]
+                logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
+            except ValueError:
+                logger.warning(f"Invalid date format: {selected_date}")
+                flash("Invalid date format", "error")
+                return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
 
-                # Check if any data remains after filtering
-                if filtered_summary.empty:
-                    logger.warning(f"No data remains after filtering for date={selected_date}")
-                    flash("No users | meet the criteria (non-zero and non-null Allocation and MTM (All), no 'DEAL' in algo, and not 'VIVEK_THEBARIA')", "warning")
-                    return redirect(url_for('user.user_aggregate')) 
-                # Check if any data remains after filtering
+            # Check if data exists for the selected date
+            if filtered_summary.empty:
+                logger.warning(f"No data found for date={selected_date}")
+                flash(f"No data found for the selected date {selected_date}", "warning")
+                return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+
+            # Filter out rows where SERVER is "5 Total"
+            filtered_summary = filtered_summary[filtered_summary['server'] != '5 Total']
+
+            # Exclude users with zero or null in allocation or mtm_all
+            filtered_summary = filtered_summary[
+                (filtered_summary['allocation'].notnull()) & 
+                (filtered_summary['allocation'] != 0) & 
+                (filtered_summary['mtm_all'].notnull()) & 
+                (filtered_summary['mtm_all'] != 0)
+            ]
+            logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+            # Exclude users with 'DEAL' in alias (case-insensitive)
+            filtered_summary = filtered_summary[
+                ~filtered_summary['alias'].str.contains('DEAL', case=False, na=False)
+            ]
+            logger.info(f"After filtering out users with 'DEAL' in alias : {len(filtered_summary)} rows")
+
+            # Exclude users with zero or null in max_loss and mtm_all, except for algo == 5
+            filtered_summary = filtered_summary[
+                ~(
+                    (filtered_summary['max_loss'].isnull() | (filtered_summary['max_loss'] == 0)) &
+                    (filtered_summary['mtm_all'].isnull() | (filtered_summary['mtm_all'] == 0)) &
+                    (filtered_summary['algo'] != 5)
+                )
+            ]
+            logger.info(f"After filtering out zero/null max_loss and mtm_all (except algo 5): {len(filtered_summary)} rows")
+
+            # Exclude user_id '92176368'
+            filtered_summary = filtered_summary[
+                filtered_summary['user_id'] != '92176368'
+            ]
+            logger.info(f"After filtering out user_id '92176368': {len(filtered_summary)} rows")
+
+            # Check if any data remains after filtering
+            if filtered_summary.empty:
+                logger.warning(f"No data remains after filtering for date={selected_date}")
+                flash("No users | meet the criteria (non-zero and non-null Allocation and MTM (All), no 'DEAL' in algo, and not 'VIVEK_THEBARIA')", "warning")
+                return redirect(url_for('user.user_aggregate')) 
+            # Check if any data remains after filtering
+            if filtered_summary.empty:
+                logger.warning(f"No data remains after filtering for date={selected_date}")
+                flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
+
+            # Exclude selected user IDs
+            if excluded_users:
+                filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
                 if filtered_summary.empty:
-                    logger.warning(f"No data remains after filtering for date={selected_date}")
-                    flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                    flash("All users have been excluded from the calculation", "warning")
                     return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
 
-                # Exclude selected user IDs
-                if excluded_users:
-                    filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
-                    if filtered_summary.empty:
-                        flash("All users have been excluded from the calculation", "warning")
-                        return render_template('user_aggregate.html', role=session.get('role'), data=None, total_mtm=None, num_users=None, servers=None, selected_date=selected_date, excluded_users=excluded_users, all_user_ids=all_user_ids)
-
-                # Group by ALGO and SERVER
-                grouped = filtered_summary.groupby(['algo', 'server']).agg(
-                    **{
-                        'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
-                        'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
-                        'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
-                    }
-                ).reset_index()
-
-                # Calculate Return Ratio
-                grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION'])
-
-                # Sort by ALGO and SERVER
-                final_df = grouped.sort_values(by=['algo', 'server'])
-
-                # Rename columns for display
-                final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
-
-                # Select and order columns
-                final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
-
-                # Round Return Ratio
-                final_df['Return Ratio'] = final_df['Return Ratio'].round(2)
-
-                # Compute Grand Total row
-                grand_total = {
-                    'ALGO': 'GRAND TOTAL',
-                    'SERVER': '',
-                    'No. of Users': final_df['No. of Users'].sum(),
-                    'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
-                    'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
-                    'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+            # Group by ALGO and SERVER
+            grouped = filtered_summary.groupby(['algo', 'server']).agg(
+                **{
+                    'No. of Users': pd.NamedAgg(column='user_id', aggfunc='count'),
+                    'Sum of ALLOCATION': pd.NamedAgg(column='allocation', aggfunc='sum'),
+                    'Sum of MTM (All)': pd.NamedAgg(column='mtm_all', aggfunc='sum')
                 }
+            ).reset_index()
 
-                # Convert to dictionary for rendering
-                data = final_df.to_dict('records')
-                # Append Grand Total row
-                data.append(grand_total)
-                logger.info(f"Processed {len(data)} records for display, including Grand Total")
-
-                # Calculate total MTM (All), number of users, and servers for the selected date
-                total_mtm = filtered_summary['mtm_all'].sum()
-                num_users = filtered_summary['user_id'].nunique()
-                servers = filtered_summary['server'].unique().tolist()
-                logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
-            else:
-                data = None
+            # Calculate Return Ratio
+            grouped['Return Ratio'] = (grouped['Sum of MTM (All)'] / grouped['Sum of ALLOCATION'])
+
+            # Sort by ALGO and SERVER
+            final_df = grouped.sort_values(by=['algo', 'server'])
+
+            # Rename columns for display
+            final_df = final_df.rename(columns={'algo': 'ALGO', 'server': 'SERVER'})
+
+            # Select and order columns
+            final_df = final_df[['ALGO', 'SERVER', 'No. of Users', 'Sum of ALLOCATION', 'Sum of MTM (All)', 'Return Ratio']]
+
+            # Round Return Ratio
+            final_df['Return Ratio'] = final_df['Return Ratio'].round(2)
+
+            # Compute Grand Total row
+            grand_total = {
+                'ALGO': 'GRAND TOTAL',
+                'SERVER': '',
+                'No. of Users': final_df['No. of Users'].sum(),
+                'Sum of ALLOCATION': final_df['Sum of ALLOCATION'].sum(),
+                'Sum of MTM (All)': final_df['Sum of MTM (All)'].sum(),
+                'Return Ratio': round(final_df['Sum of MTM (All)'].sum() / final_df['Sum of ALLOCATION'].sum(), 2)
+            }
+
+            # Convert to dictionary for rendering
+            data = final_df.to_dict('records')
+            # Append Grand Total row
+            data.append(grand_total)
+            logger.info(f"Processed {len(data)} records for display, including Grand Total")
+
+            # Calculate total MTM (All), number of users, and servers for the selected date
+            total_mtm = filtered_summary['mtm_all'].sum()
+            num_users = filtered_summary['user_id'].nunique()
+            servers = filtered_summary['server'].unique().tolist()
+            logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
+        else:
+            data = None
 
         # Handle CSV export
         if export == 'csv' and data:
@@ -371,72 +365,70 @@ def user_total_mtm():
         return redirect(url_for('user.user_aggregate'))
 
     try:
-        with engine.connect() as conn:
-            # Verify users table exists
-            result = conn.execute(text("SHOW TABLES LIKE 'users'"))
-            if not result.fetchall():
-                flash("Table 'users' does not exist. Please create it and upload data.", "error")
-                return redirect(url_for('user.user_aggregate'))
-
-            # Read users table
-            summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
-            logger.info(f"Read {len(summary)} rows from users")
-
-            # Clean date column
-            summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
-
-            # Convert numeric columns
-            numeric_columns = ['mtm_all', 'allocation']
-            optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
-            for col in numeric_columns + optional_columns:
-                if col in summary.columns:
-                    summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
-
-            # Apply date filter
-            try:
-                selected_date = pd.to_datetime(selected_date).date()
-                filtered_summary = summary[summary['date'] == selected_date]
-                logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
-            except ValueError:
-                logger.warning(f"Invalid date format: {selected_date}")
-                flash("Invalid date format", "error")
-                return redirect(url_for('user.user_aggregate'))
-
-            # Check if data exists for the selected date
-            if filtered_summary.empty:
-                logger.warning(f"No data found for date={selected_date}")
-                flash(f"No data found for the selected date {selected_date}", "warning")
-                return redirect(url_for('user.user_aggregate'))
-
-            # Exclude users with zero or null in allocation or mtm_all
-            filtered_summary = filtered_summary[
-                (filtered_summary['allocation'].notnull()) & 
-                (filtered_summary['allocation'] != 0) & 
-                (filtered_summary['mtm_all'].notnull()) & 
-                (filtered_summary['mtm_all'] != 0)
-            ]
-            logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
-
-            # Check if any data remains after filtering
+        # Verify users table exists
+        if not schema_catalog.table_exists('users'):
+            flash("Table 'users' does not exist. Please create it and upload data.", "error")
+            return redirect(url_for('user.user_aggregate'))
+
+        # Read users table
+        summary = pd.read_sql_table('users', con=engine, coerce_float=False, parse_dates=['date'])
+        logger.info(f"Read {len(summary)} rows from users")
+
+        # Clean date column
+        summary['date'] = pd.to_datetime(summary['date'], errors='coerce').dt.date
+
+        # Convert numeric columns
+        numeric_columns = ['mtm_all', 'allocation']
+        optional_columns = ['max_loss', 'available_margin', 'total_orders', 'total_lots']
+        for col in numeric_columns + optional_columns:
+            if col in summary.columns:
+                summary[col] = pd.to_numeric(summary[col], errors='coerce').fillna(0)
+
+        # Apply date filter
+        try:
+            selected_date = pd.to_datetime(selected_date).date()
+            filtered_summary = summary[summary['date'] == selected_date]
+            logger.info(f"Filtered users for date={selected_date}: {len(filtered_summary)} rows")
+        except ValueError:
+            logger.warning(f"Invalid date format: {selected_date}")
+            flash("Invalid date format", "error")
+            return redirect(url_for('user.user_aggregate'))
+
+        # Check if data exists for the selected date
+        if filtered_summary.empty:
+            logger.warning(f"No data found for date={selected_date}")
+            flash(f"No data found for the selected date {selected_date}", "warning")
+            return redirect(url_for('user.user_aggregate'))
+
+        # Exclude users with zero or null in allocation or mtm_all
+        filtered_summary = filtered_summary[
+            (filtered_summary['allocation'].notnull()) & 
+            (filtered_summary['allocation'] != 0) & 
+            (filtered_summary['mtm_all'].notnull()) & 
+            (filtered_summary['mtm_all'] != 0)
+        ]
+        logger.info(f"After filtering out zero/null allocation and mtm_all: {len(filtered_summary)} rows")
+
+        # Check if any data remains after filtering
+        if filtered_summary.empty:
+            logger.warning(f"No data remains after filtering for date={selected_date}")
+            flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+            return redirect(url_for('user.user_aggregate'))
+
+        # Exclude selected user IDs from session
+        excluded_users = session.get('excluded_users', [])
+        if excluded_users:
+            filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
             if filtered_summary.empty:
-                logger.warning(f"No data remains after filtering for date={selected_date}")
-                flash("No users meet the criteria (non-zero and non-null values required in Allocation and MTM (All))", "warning")
+                logger.warning(f"No data remains after excluding users for date={selected_date}")
+                flash("All users have been excluded from the calculation", "warning")
                 return redirect(url_for('user.user_aggregate'))
 
-            # Exclude selected user IDs from session
-            excluded_users = session.get('excluded_users', [])
-            if excluded_users:
-                filtered_summary = filtered_summary[~filtered_summary['user_id'].isin(excluded_users)]
-                if filtered_summary.empty:
-                    logger.warning(f"No data remains after excluding users for date={selected_date}")
-                    flash("All users have been excluded from the calculation", "warning")
-                    return redirect(url_for('user.user_aggregate'))
-
-            # Calculate total MTM (All), number of users, and servers
-            total_mtm = filtered_summary['mtm_all'].sum()
-            num_users = filtered_summary['user_id'].nunique()
-            servers = filtered_summary['server'].unique().tolist()
-            logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
+        # Calculate total MTM (All), number of users, and servers
+        total_mtm = filtered_summary['mtm_all'].sum()
+        num_users = filtered_summary['user_id'].nunique()
+        servers = filtered_summary['server'].unique().tolist()
+        logger.info(f"Total MTM (All) for date={selected_date}: {total_mtm}, No. of Users: {num_users}, Servers: {servers}")
 
         # Redirect back to aggregate page with total_mtm, num_users, servers, and selected_date
         return redirect(url_for('user.user_aggregate', selected_date=selected_date))
@@ -674,64 +666,3 @@ def user_analysis():
         logger.error(f"Unexpected error in user_analysis: {str(e)}")
         flash(f"Unexpected error: {str(e)}", "error")
         return redirect(url_for('user.user_home'))
-
-def upload_files_to_table(file_source, table_name, result_list, event, uploaded_by, has_header=True):
-    def upload_task():
-        engine = get_db_connection()
-        if not engine:
-            result_list.append(("error", "Database connection failed"))
-            event.set()
-            return
-        
-        try:
-            column_mapping = table_mappings.get(table_name, {})
-            if not column_mapping:
-                result_list.append(("error", f"No column mapping found for table {table_name}"))
-                event.set()
-                return
-            
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SHOW COLUMNS FROM {table_name}"))
-                table_columns = [row['Field'] for row in result.mappings()]
-                logger.debug(f"Table {table_name} columns: {table_columns}")
-
-            uploaded_files = [os.path.join(file_source, f) for f in os.listdir(file_source) if f.endswith(('.csv', '.xlsx', '.xls', '.xlsb'))]
-            
-            for file_path in uploaded_files:
-                try:
-                    if file_path.endswith('.csv'):
-                        df = pd.read_csv(file_path, header=0 if has_header else None)
-                    elif file_path.endswith(('.xlsx', '.xls', '.xlsb')):
-                        df = pd.read_excel(file_path, header=0 if has_header else None)
-                    
-                    original_columns = df.columns.tolist()
-                    normalized_columns = [normalize_column_name(col, column_mapping) for col in original_columns]
-                    df.columns = normalized_columns
-                    logger.debug(f"File {os.path.basename(file_path)} columns normalized: {original_columns} -> {normalized_columns}")
-                    
-                    valid_columns = [col for col in df.columns if col in column_mapping and col in table_columns]
-                    if not valid_columns:
-                        result_list.append(("error", f"No valid columns found in {os.path.basename(file_path)} for table {table_name}"))
-                        continue
-                    df = df[valid_columns]
-                    
-                    df.to_sql(table_name, engine, if_exists='append', index=False)
-                    result_list.append(("success", f"Uploaded {os.path.basename(file_path)} to {table_name} ({len(df)} rows)"))
-                    logger.info(f"Uploaded {file_path} to {table_name} with {len(df)} rows")
-                
-                except Exception as e:
-                    result_list.append(("error", f"Failed to upload {os.path.basename(file_path)}: {str(e)}"))
-                    logger.error(f"Error uploading {file_path}: {str(e)}")
-        
-        except Exception as e:
-            result_list.append(("error", f"Database error: {str(e)}"))
-            logger.error(f"Database error in upload_files_to_table: {str(e)}")
-        
-        finally:
-            event.set()
-    
-    thread = threading.Thread(target=upload_task)
-    thread.start()
-    return thread, event
-
-user_bp.upload_files_to_table = upload_files_to_table
\ No newline at end of file
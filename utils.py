@@ -1,6 +1,8 @@
 import logging
 import os
-from sqlalchemy import create_engine, text
+import threading
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 import os
@@ -13,10 +15,33 @@ load_dotenv()
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# One engine per process and database URI. SQLAlchemy's compiled-statement cache and the
+# connection pool both live on the engine, so building a new engine per call defeats both.
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Compiled cache outcomes for every statement executed through a shared engine
+COMPILED_CACHE_STATS = {'hits': 0, 'misses': 0, 'uncached': 0}
+_cache_stats_lock = threading.Lock()
+
+def _record_compiled_cache(conn, cursor, statement, parameters, context, executemany):
+    status = getattr(context, 'cache_hit', None)
+    key = 'hits' if status == CACHE_HIT else 'misses' if status == CACHE_MISS else 'uncached'
+    with _cache_stats_lock:
+        COMPILED_CACHE_STATS[key] += 1
+
+def get_compiled_cache_stats():
+    """Snapshot of compiled cache hits/misses with the hit rate over cacheable statements."""
+    with _cache_stats_lock:
+        stats = dict(COMPILED_CACHE_STATS)
+    cacheable = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / cacheable, 4) if cacheable else 0.0
+    return stats
+
 def get_db_connection():
     """
     Establishes a connection to the MySQL database.
-    Returns: SQLAlchemy engine object or None if connection fails.
+    Returns: SQLAlchemy engine object (shared per process) or None if connection fails.
     """
     try:
         # Replace with your actual database credentials
@@ -26,11 +51,21 @@ def get_db_connection():
         db_name = os.getenv('DB_NAME', 'mst')
         
         connection_uri = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
-        engine = create_engine(connection_uri, echo=False, pool_pre_ping=True)
-        # Test the connection
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))
-        logger.info("Database connection established successfully")
+        engine_key = (connection_uri, os.getpid())
+        with _engines_lock:
+            engine = _engines.get(engine_key)
+            if engine is None:
+                # Pool sized per process; serve.py sets these from the waitress thread count
+                engine = create_engine(connection_uri, echo=False, pool_pre_ping=True,
+                                       pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+                                       max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+                                       pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)))
+                event.listen(engine, 'after_cursor_execute', _record_compiled_cache)
+                # Test the connection once per engine; afterwards pool_pre_ping checks each checkout
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                _engines[engine_key] = engine
+                logger.info("Database connection established successfully")
         return engine
     except ImportError as e:
         logger.error(f"Missing required package: {str(e)}. Ensure 'pymysql' and 'cryptography' are installed.")
@@ -42,6 +77,15 @@ def get_db_connection():
         logger.error(f"Failed to connect to database: {str(e)}")
         return None
 
+def dispose_engines():
+    """
+    Close every pooled connection held by this process's engines. Called before forking
+    workers so no child inherits (and shares) a parent's MySQL socket; engines reconnect lazily.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+
 def get_db_function(db_type=None):
     """
     Retrieves the appropriate database function or connector based on the database type.
@@ -62,48 +106,35 @@ def get_db_function(db_type=None):
 
 def get_tables(prefix=None):
     """
-    Retrieves a list of table names from the database.
+    Retrieves a list of table names from the database (via the cached schema catalog).
     Args:
         prefix (str, optional): Filter tables by prefix.
     Returns:
         List of table names.
     """
-    engine = get_db_connection()
-    if not engine:
-        logger.error("Cannot retrieve tables: Database connection failed")
-        return []
-    
+    # Imported here: schema_catalog imports this module for get_db_connection
+    import schema_catalog
     try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SHOW TABLES"))
-            tables = [row[0] for row in result.fetchall()]
-            if prefix:
-                tables = [table for table in tables if table.startswith(prefix)]
-            logger.info(f"Retrieved {len(tables)} tables from the database")
-            return tables
+        tables = schema_catalog.get_tables(prefix)
+        logger.debug(f"Retrieved {len(tables)} tables from the schema catalog")
+        return tables
     except Exception as e:
         logger.error(f"Error retrieving tables: {str(e)}")
         return []
 
 def get_table_columns(table):
     """
-    Retrieves the column names of a given table.
+    Retrieves the column names of a given table (via the cached schema catalog).
     Args:
         table (str): Name of the table.
     Returns:
         List of column names.
     """
-    engine = get_db_connection()
-    if not engine:
-        logger.error("Cannot retrieve table columns: Database connection failed")
-        return []
-    
+    import schema_catalog
     try:
-        with engine.connect() as connection:
-            result = connection.execute(text(f"SHOW COLUMNS FROM `{table}`"))
-            columns = [row[0] for row in result.fetchall()]
-            logger.info(f"Retrieved columns for table '{table}': {columns}")
-            return columns
+        columns = schema_catalog.get_columns(table)
+        logger.debug(f"Retrieved columns for table '{table}': {columns}")
+        return columns
     except Exception as e:
         logger.error(f"Error retrieving columns for table '{table}': {str(e)}")
         return []
\ No newline at end of file